@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+Benchmark da API de Ingestão
+- lote: compara o envio leitura a leitura (POST /api/enviar) com o envio em
+  lote (POST /api/enviar-lote) para diferentes quantidades de leituras
+- servidor: mantém N conexões WebSocket abertas e mede a vazão de POSTs
+  concorrentes e a entrega dos eventos 'leituras' (dev server x gunicorn)
+- difusao: custo do broadcast com muitos dashboards por room, comparando a
+  coalescência (EMISSOES_POR_SEGUNDO) com um evento por leitura
+- emissor: simula N sensores publicando no emissor.py e compara o envio
+  síncrono antigo (um POST por leitura no callback) com o spool + lotes
+- formato: bytes e CPU por leitura do JSON x MessagePack (codificação no
+  emissor, decodificação na API) e o tempo de servidor por leitura no lote
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+from simulador import gerar_leitura
+
+# URL base da API (altere para o IP da AWS em produção)
+API_URL = "http://localhost:5000"
+# Credencial dos clientes WebSocket (a CHAVE_PAINEL da API)
+CHAVE_PAINEL = os.environ.get('CHAVE_PAINEL')
+
+# Configurações padrão do benchmark
+TAMANHOS = [1000, 10000, 100000]
+TAMANHO_LOTE = 1000  # leituras por requisição no modo lote
+
+def gerar_payloads(quantidade, dispositivo):
+    """
+    Gera leituras simuladas de um dispositivo espaçadas de 3s, terminando agora.
+    Cada modo usa o seu dispositivo e horários com microssegundos: o índice único
+    (dispositivo, data_hora) recusaria leituras repetidas como duplicadas.
+    """
+    inicio = datetime.now() - timedelta(seconds=3 * quantidade)
+    payloads = []
+    for i in range(quantidade):
+        distancia, alerta = gerar_leitura()
+        payloads.append({
+            "distancia_cm": distancia,
+            "alerta": alerta,
+            "data_hora": (inicio + timedelta(seconds=3 * i)).isoformat(timespec="microseconds"),
+            "dispositivo": dispositivo
+        })
+    return payloads
+
+def medir_individual(sessao, payloads):
+    """Envia uma requisição por leitura e retorna (segundos, erros, duplicadas)"""
+    erros = 0
+    duplicadas = 0
+    inicio = time.perf_counter()
+    for payload in payloads:
+        resposta = sessao.post(f"{API_URL}/api/enviar", json=payload, timeout=10)
+        if resposta.status_code != 201:
+            erros += 1
+        elif resposta.json().get('duplicada'):
+            duplicadas += 1
+    return time.perf_counter() - inicio, erros, duplicadas
+
+def medir_lote(sessao, payloads, tamanho_lote):
+    """Envia as leituras em lotes e retorna (segundos, erros, duplicadas)"""
+    erros = 0
+    duplicadas = 0
+    inicio = time.perf_counter()
+    for i in range(0, len(payloads), tamanho_lote):
+        lote = payloads[i:i + tamanho_lote]
+        resposta = sessao.post(f"{API_URL}/api/enviar-lote", json=lote, timeout=60)
+        if resposta.status_code != 201:
+            erros += len(lote)
+        else:
+            erros += resposta.json().get('rejeitados', 0)
+            duplicadas += resposta.json().get('duplicados', 0)
+    return time.perf_counter() - inicio, erros, duplicadas
+
+def imprimir_resultado(modo, quantidade, segundos, erros, duplicadas):
+    taxa = quantidade / segundos if segundos > 0 else 0
+    print(f"   {modo:<10} {quantidade:>8} leituras | {segundos:8.2f}s | "
+          f"{taxa:10.0f} leituras/s | erros: {erros} | duplicadas: {duplicadas}")
+
+def bench_lote(args):
+    print("=" * 70)
+    print("📊 BENCHMARK: /api/enviar x /api/enviar-lote")
+    print(f"   API: {API_URL} | Lote: {args.tamanho_lote} leituras/requisição")
+    print("=" * 70)
+
+    sessao = requests.Session()
+    total_duplicadas = 0
+    for quantidade in args.tamanhos:
+        print(f"\n📦 {quantidade} leituras")
+        if not args.sem_individual:
+            payloads = gerar_payloads(quantidade, f"bench-individual-{quantidade}")
+            segundos, erros, duplicadas = medir_individual(sessao, payloads)
+            imprimir_resultado("individual", quantidade, segundos, erros, duplicadas)
+            total_duplicadas += duplicadas
+        payloads = gerar_payloads(quantidade, f"bench-lote-{quantidade}")
+        segundos, erros, duplicadas = medir_lote(sessao, payloads, args.tamanho_lote)
+        imprimir_resultado("lote", quantidade, segundos, erros, duplicadas)
+        total_duplicadas += duplicadas
+
+    # Duplicadas só passam pelo ON CONFLICT DO NOTHING: a vazão medida não vale
+    if total_duplicadas:
+        raise SystemExit(f"\n❌ {total_duplicadas} leituras duplicadas: resultado inválido")
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+def bench_servidor(args):
+    import socketio
+
+    print("=" * 70)
+    print("📊 BENCHMARK: conexões WebSocket + POSTs concorrentes")
+    print(f"   API: {API_URL} | Conexões: {args.conexoes} | Leitos: {args.leitos} "
+          f"| POSTs: {args.posts} | Concorrência: {args.concorrencia}")
+    print("=" * 70)
+
+    # Cada leito é simulado por um IP distinto (X-Forwarded-For); as conexões
+    # são distribuídas entre os leitos e só recebem os eventos da sua room
+    def ip_leito(i):
+        return f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+
+    eventos = [0]
+    lock = threading.Lock()
+
+    def ao_receber(mensagem):
+        # Mensagens coalescidas: 'n' é o número de leituras que cada uma representa
+        with lock:
+            eventos[0] += mensagem['n']
+
+    # A room só aceita dashboards depois da primeira leitura do dispositivo
+    for i in range(args.leitos):
+        distancia, alerta = gerar_leitura()
+        requests.post(f"{API_URL}/api/enviar", timeout=10, json={
+            "distancia_cm": distancia, "alerta": alerta,
+            "data_hora": datetime.now().isoformat(timespec="microseconds")
+        }, headers={'X-Forwarded-For': ip_leito(i)})
+
+    clientes = []
+    falhas_conexao = 0
+    inicio = time.perf_counter()
+    conexoes_por_leito = [0] * args.leitos
+    for i in range(args.conexoes):
+        cliente = socketio.Client(reconnection=False)
+        cliente.on('leituras', ao_receber)
+        try:
+            cliente.connect(API_URL, transports=['websocket'], wait_timeout=10,
+                            headers={'X-Forwarded-For': ip_leito(i % args.leitos)},
+                            auth={'chave': CHAVE_PAINEL})
+            clientes.append(cliente)
+            conexoes_por_leito[i % args.leitos] += 1
+        except Exception:
+            falhas_conexao += 1
+    tempo_conexao = time.perf_counter() - inicio
+    print(f"\n🔌 {len(clientes)} conexões abertas em {tempo_conexao:.2f}s "
+          f"(falhas: {falhas_conexao})")
+
+    locais = threading.local()
+    latencias = []
+    erros = [0]
+
+    def enviar(i):
+        if not hasattr(locais, 'sessao'):
+            locais.sessao = requests.Session()
+        distancia, alerta = gerar_leitura()
+        t0 = time.perf_counter()
+        try:
+            resposta = locais.sessao.post(f"{API_URL}/api/enviar", timeout=30, json={
+                "distancia_cm": distancia,
+                "alerta": alerta,
+                "data_hora": datetime.now().isoformat(timespec="microseconds")
+            }, headers={'X-Forwarded-For': ip_leito(i % args.leitos)})
+            ok = resposta.status_code in (201, 202)
+        except requests.RequestException:
+            ok = False
+        with lock:
+            latencias.append(time.perf_counter() - t0)
+            if not ok:
+                erros[0] += 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(args.concorrencia) as executor:
+        list(executor.map(enviar, range(args.posts)))
+    duracao = time.perf_counter() - inicio
+
+    # Aguarda os últimos eventos chegarem
+    esperados = sum(conexoes_por_leito[i % args.leitos] for i in range(args.posts))
+    limite = time.time() + 10
+    while eventos[0] < esperados and time.time() < limite:
+        time.sleep(0.2)
+
+    print(f"📤 {args.posts} POSTs em {duracao:.2f}s | {args.posts / duracao:.0f} req/s "
+          f"| erros: {erros[0]}")
+    print(f"   latência p50: {percentil(latencias, 50) * 1000:.1f} ms | "
+          f"p95: {percentil(latencias, 95) * 1000:.1f} ms | "
+          f"média: {statistics.mean(latencias) * 1000:.1f} ms")
+    print(f"📥 leituras entregues: {eventos[0]}/{esperados}")
+
+    for cliente in clientes:
+        cliente.disconnect()
+
+def bench_difusao(args):
+    import socketio
+
+    print("=" * 70)
+    print("📊 BENCHMARK: broadcast Socket.IO por room")
+    print(f"   API: {API_URL} | Clientes: {args.clientes} | Rooms: {args.rooms} "
+          f"| Taxa: {args.taxa} leituras/s por room | Duração: {args.duracao}s")
+    print("=" * 70)
+
+    lock = threading.Lock()
+    recebido = {'mensagens': 0, 'leituras': 0, 'pontos': 0, 'bytes': 0}
+
+    def ao_receber(mensagem):
+        with lock:
+            recebido['mensagens'] += 1
+            recebido['leituras'] += mensagem['n']
+            recebido['pontos'] += len(mensagem['p'])
+            recebido['bytes'] += len(json.dumps(mensagem, separators=(',', ':')))
+
+    # Cada room é um dispositivo; os clientes são distribuídos entre elas.
+    # A room só aceita dashboards depois da primeira leitura do dispositivo
+    agora = datetime.now().isoformat(timespec="microseconds")
+    requests.post(f"{API_URL}/api/enviar-lote", timeout=30, json=[
+        {"distancia_cm": 150.0, "alerta": False, "data_hora": agora, "dispositivo": f"bench-{room}"}
+        for room in range(args.rooms)
+    ])
+    clientes = []
+    inicio = time.perf_counter()
+    for i in range(args.clientes):
+        cliente = socketio.Client(reconnection=False)
+        cliente.on('leituras', ao_receber)
+        try:
+            cliente.connect(f"{API_URL}?dispositivo=bench-{i % args.rooms}",
+                            transports=['websocket'], wait_timeout=10,
+                            auth={'chave': CHAVE_PAINEL})
+            clientes.append(cliente)
+        except Exception:
+            pass
+    print(f"\n🔌 {len(clientes)} conexões abertas em {time.perf_counter() - inicio:.2f}s")
+
+    # Um lote a cada 100 ms com as leituras de todas as rooms
+    sessao = requests.Session()
+    por_ciclo = max(1, round(args.taxa / 10))
+    enviadas = 0
+    inicio = time.perf_counter()
+    while time.perf_counter() - inicio < args.duracao:
+        agora = datetime.now()
+        lote = []
+        for room in range(args.rooms):
+            for j in range(por_ciclo):
+                # Instantes distintos por room: leituras repetidas seriam ignoradas
+                distancia, alerta = gerar_leitura()
+                data_hora = (agora + timedelta(microseconds=j)).isoformat(timespec="microseconds")
+                lote.append({"distancia_cm": distancia, "alerta": alerta,
+                             "data_hora": data_hora, "dispositivo": f"bench-{room}"})
+        sessao.post(f"{API_URL}/api/enviar-lote", json=lote, timeout=30)
+        enviadas += len(lote)
+        time.sleep(max(0.0, 0.1 - (time.perf_counter() - inicio) % 0.1))
+    duracao = time.perf_counter() - inicio
+    time.sleep(2)  # último ciclo de difusão
+
+    with ThreadPoolExecutor(50) as executor:
+        list(executor.map(lambda cliente: cliente.disconnect(), clientes))
+
+    por_room = len(clientes) / args.rooms
+    sem_coalescer = enviadas * por_room
+    print(f"📤 {enviadas} leituras em {duracao:.1f}s ({enviadas / duracao:.0f}/s)")
+    print(f"📥 mensagens entregues: {recebido['mensagens']} "
+          f"({recebido['mensagens'] / duracao / max(len(clientes), 1):.1f}/s por cliente) "
+          f"| um evento por leitura seriam {sem_coalescer:.0f}")
+    print(f"   leituras representadas: {recebido['leituras']} | pontos enviados: "
+          f"{recebido['pontos']} | bytes: {recebido['bytes']} "
+          f"({recebido['bytes'] / max(recebido['mensagens'], 1):.0f} por mensagem)")
+
+def bench_emissor(args):
+    import types
+
+    import emissor
+
+    print("=" * 70)
+    print("📊 BENCHMARK: emissor.py (callback MQTT -> API)")
+    print(f"   API: {API_URL} | Sensores: {args.sensores} | Leituras: {args.leituras}")
+    print("=" * 70)
+
+    mensagens = []
+    for i in range(args.leituras):
+        distancia, alerta = gerar_leitura()
+        mensagens.append(types.SimpleNamespace(
+            topic=f"lab/{i % args.sensores:03d}/ultrasonico",
+            payload=json.dumps({"distancia_cm": distancia, "alerta": alerta}).encode()
+        ))
+
+    # Antes: um requests.post (nova conexão) por leitura, dentro do callback
+    inicio = time.perf_counter()
+    bloqueio_max = 0.0
+    for msg in mensagens:
+        t0 = time.perf_counter()
+        dados = json.loads(msg.payload.decode())
+        dados["data_hora"] = datetime.now().isoformat(timespec="microseconds")
+        requests.post(f"{API_URL}/api/enviar", json=dados, timeout=2)
+        bloqueio_max = max(bloqueio_max, time.perf_counter() - t0)
+    duracao = time.perf_counter() - inicio
+    print(f"\n🐢 síncrono: {args.leituras / duracao:8.0f} leituras/s | "
+          f"callback bloqueado até {bloqueio_max * 1000:.1f} ms")
+
+    # Depois: on_message só grava no spool; a thread de envio manda lotes
+    emissor.SPOOL_ARQUIVO = os.path.join(tempfile.mkdtemp(), 'spool.db')
+    emissor.AWS_LOTE_URL = f"{API_URL}/api/enviar-lote"
+    emissor.DEADBAND_CM = -1  # sem banda morta: encaminha todas as leituras
+    emissor.iniciar_enviador()
+
+    inicio = time.perf_counter()
+    bloqueio_max = 0.0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for msg in mensagens:
+            t0 = time.perf_counter()
+            emissor.on_message(None, None, msg)
+            bloqueio_max = max(bloqueio_max, time.perf_counter() - t0)
+        tempo_callback = time.perf_counter() - inicio
+        est = emissor.estatisticas
+        while est['enviadas'] + est['descartadas'] < args.leituras:
+            time.sleep(0.01)
+    duracao = time.perf_counter() - inicio
+    print(f"🚀 em lote:  {args.leituras / duracao:8.0f} leituras/s | "
+          f"callback bloqueado até {bloqueio_max * 1000:.2f} ms "
+          f"(todos os callbacks em {tempo_callback * 1000:.0f} ms)")
+    print(f"   enviadas: {est['enviadas']} | falhas: {est['falhas']} | "
+          f"descartadas: {est['descartadas']}")
+
+def tempo_servidor_lote():
+    """Soma de http_requisicao_segundos de POST /api/enviar-lote em /metrics"""
+    metricas = requests.get(f"{API_URL}/metrics", timeout=10).text
+    for linha in metricas.splitlines():
+        if (linha.startswith('http_requisicao_segundos_sum{')
+                and 'endpoint="receber_lote"' in linha and 'metodo="POST"' in linha):
+            return float(linha.rsplit(' ', 1)[1])
+    return 0.0
+
+def cpu_por_leitura(funcao, quantidade, repeticoes=5):
+    """Menor tempo de CPU (µs) por leitura entre as repetições"""
+    melhores = []
+    for _ in range(repeticoes):
+        inicio = time.process_time()
+        funcao()
+        melhores.append(time.process_time() - inicio)
+    return min(melhores) / quantidade * 1e6
+
+def bench_formato(args):
+    import msgpack
+
+    import emissor
+
+    print("=" * 70)
+    print("📊 BENCHMARK: JSON x MessagePack na ingestão")
+    print(f"   API: {API_URL} | Leituras: {args.leituras} | Lote: {args.tamanho_lote}")
+    print("=" * 70)
+
+    pacotes = gerar_payloads(args.leituras)
+    for i, pacote in enumerate(pacotes):
+        pacote['dispositivo'] = f"formato-{i % 10:02d}"
+    lotes = [pacotes[i:i + args.tamanho_lote] for i in range(0, len(pacotes), args.tamanho_lote)]
+    corpos = {formato: [emissor.codificar_lote(lote, formato)[0] for lote in lotes]
+              for formato in ('json', 'msgpack')}
+
+    # Decodificação como na API: corpo -> itens -> data_hora em datetime
+    def decodificar_json():
+        for corpo in corpos['json']:
+            for item in json.loads(corpo):
+                datetime.fromisoformat(item['data_hora'])
+
+    def decodificar_msgpack():
+        for corpo in corpos['msgpack']:
+            for item in msgpack.unpackb(corpo):
+                datetime.fromtimestamp(item[1] / 1000)
+
+    unitario = {
+        'json': statistics.mean(len(json.dumps(p)) for p in pacotes),
+        'msgpack': statistics.mean(len(msgpack.packb(emissor.leitura_binaria(p), use_single_float=True))
+                                   for p in pacotes)
+    }
+    resultados = {}
+    for formato, decodificar in (('json', decodificar_json), ('msgpack', decodificar_msgpack)):
+        resultados[formato] = {
+            'bytes_unitario': unitario[formato],
+            'bytes_lote': sum(map(len, corpos[formato])) / args.leituras,
+            'cpu_codificar': cpu_por_leitura(
+                lambda: [emissor.codificar_lote(lote, formato) for lote in lotes], args.leituras),
+            'cpu_decodificar': cpu_por_leitura(decodificar, args.leituras)
+        }
+
+    print(f"\n{'':10} {'B/leitura':>10} {'B/leitura':>10} {'µs CPU':>10} {'µs CPU':>10}")
+    print(f"{'':10} {'unitária':>10} {'no lote':>10} {'codificar':>10} {'decodif.':>10}")
+    for formato, r in resultados.items():
+        print(f"{formato:10} {r['bytes_unitario']:10.1f} {r['bytes_lote']:10.1f} "
+              f"{r['cpu_codificar']:10.2f} {r['cpu_decodificar']:10.2f}")
+    j, m = resultados['json'], resultados['msgpack']
+    print(f"{'economia':10} {1 - m['bytes_unitario'] / j['bytes_unitario']:10.0%} "
+          f"{1 - m['bytes_lote'] / j['bytes_lote']:10.0%} "
+          f"{1 - m['cpu_codificar'] / j['cpu_codificar']:10.0%} "
+          f"{1 - m['cpu_decodificar'] / j['cpu_decodificar']:10.0%}")
+
+    if args.sem_api:
+        return
+    # Tempo de servidor por leitura (validação + gravação), lido do /metrics
+    print()
+    sessao = requests.Session()
+    for formato in ('json', 'msgpack'):
+        tipo = 'application/msgpack' if formato == 'msgpack' else 'application/json'
+        antes = tempo_servidor_lote()
+        inicio = time.perf_counter()
+        erros = 0
+        for corpo in corpos[formato]:
+            resposta = sessao.post(f"{API_URL}/api/enviar-lote", data=corpo,
+                                   headers={'Content-Type': tipo}, timeout=60)
+            if resposta.status_code != 201:
+                erros += 1
+        duracao = time.perf_counter() - inicio
+        servidor = tempo_servidor_lote() - antes
+        print(f"   {formato:8} {args.leituras / duracao:10.0f} leituras/s | "
+              f"servidor {servidor / args.leituras * 1e6:7.1f} µs/leitura | lotes com erro: {erros}")
+
+def main():
+    global API_URL, CHAVE_PAINEL
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=API_URL, help="URL base da API")
+    parser.add_argument('--chave', default=CHAVE_PAINEL,
+                        help="CHAVE_PAINEL da API, para os clientes WebSocket (padrão: variável CHAVE_PAINEL)")
+    subparsers = parser.add_subparsers(dest='cenario', required=True)
+
+    p_lote = subparsers.add_parser('lote', help="ingestão individual x em lote")
+    p_lote.add_argument('--tamanhos', type=int, nargs='+', default=TAMANHOS,
+                        help="quantidades de leituras a medir")
+    p_lote.add_argument('--tamanho-lote', type=int, default=TAMANHO_LOTE,
+                        help="leituras por requisição no modo lote")
+    p_lote.add_argument('--sem-individual', action='store_true',
+                        help="mede apenas o modo lote (o individual é lento em 100k)")
+    p_lote.set_defaults(func=bench_lote)
+
+    p_servidor = subparsers.add_parser('servidor', help="conexões WebSocket + POSTs concorrentes")
+    p_servidor.add_argument('--conexoes', type=int, default=200,
+                            help="conexões WebSocket mantidas abertas")
+    p_servidor.add_argument('--posts', type=int, default=2000,
+                            help="total de POST /api/enviar")
+    p_servidor.add_argument('--concorrencia', type=int, default=50,
+                            help="POSTs simultâneos")
+    p_servidor.add_argument('--leitos', type=int, default=50,
+                            help="leitos (IPs/rooms) simulados")
+    p_servidor.set_defaults(func=bench_servidor)
+
+    p_difusao = subparsers.add_parser('difusao', help="custo do broadcast Socket.IO por room")
+    p_difusao.add_argument('--clientes', type=int, default=1000,
+                           help="dashboards conectados")
+    p_difusao.add_argument('--rooms', type=int, default=100,
+                           help="rooms (dispositivos) entre as quais os clientes se dividem")
+    p_difusao.add_argument('--taxa', type=float, default=10,
+                           help="leituras por segundo em cada room")
+    p_difusao.add_argument('--duracao', type=float, default=10,
+                           help="segundos de envio")
+    p_difusao.set_defaults(func=bench_difusao)
+
+    p_emissor = subparsers.add_parser('emissor', help="emissor.py síncrono x fila com lotes")
+    p_emissor.add_argument('--sensores', type=int, default=100,
+                           help="sensores simulados (tópicos MQTT)")
+    p_emissor.add_argument('--leituras', type=int, default=5000,
+                           help="total de mensagens publicadas")
+    p_emissor.set_defaults(func=bench_emissor)
+
+    p_formato = subparsers.add_parser('formato', help="JSON x MessagePack: bytes e CPU por leitura")
+    p_formato.add_argument('--leituras', type=int, default=20000,
+                           help="leituras medidas")
+    p_formato.add_argument('--tamanho-lote', type=int, default=500,
+                           help="leituras por lote (LOTE_MAX do emissor)")
+    p_formato.add_argument('--sem-api', action='store_true',
+                           help="mede só bytes e CPU, sem enviar à API")
+    p_formato.set_defaults(func=bench_formato)
+
+    args = parser.parse_args()
+    API_URL = args.url.rstrip('/')
+    CHAVE_PAINEL = args.chave
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
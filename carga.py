@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Gerador de Carga da API
+Simula milhares de leitos simultâneos (asyncio), cada um com seu IP
+(X-Forwarded-For) e seu id de dispositivo, enviando leituras a uma taxa que
+sobe em degraus. Mede, por degrau, a latência da ingestão (p50/p95/p99) e a
+taxa de erros; dashboards simulados medem o atraso de entrega via WebSocket.
+O resultado vai para um relatório JSON (parâmetros + semente) que pode ser
+comparado com o de uma execução anterior (--comparar).
+
+Exige: pip install aiohttp python-socketio
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from datetime import datetime
+
+import aiohttp
+import socketio
+
+from popular_historico import gerar_distancia
+from simulador import gerar_leitura
+
+# URL base da API (altere para o IP da AWS em produção)
+API_URL = "http://localhost:5000"
+# Credencial dos dashboards simulados (a CHAVE_PAINEL da API)
+CHAVE_PAINEL = os.environ.get('CHAVE_PAINEL')
+
+# Perfil 'episodios': chance, por leitura, de o leito mudar de estado
+CHANCE_SAIR = 0.02  # deitado -> fora do leito (alerta)
+CHANCE_VOLTAR = 0.2  # fora do leito -> deitado
+
+def ip_leito(i):
+    return f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+
+def dispositivo_leito(i):
+    return f"carga-{i}"
+
+def percentis(valores):
+    """p50/p95/p99/máx/média em milissegundos"""
+    if not valores:
+        return None
+    valores = sorted(valores)
+    def p(q):
+        return round(valores[min(len(valores) - 1, int(len(valores) * q / 100))] * 1000, 2)
+    return {
+        'p50': p(50), 'p95': p(95), 'p99': p(99),
+        'max': round(valores[-1] * 1000, 2),
+        'media': round(statistics.mean(valores) * 1000, 2)
+    }
+
+class Leitos:
+    """Gera as leituras de cada leito de forma determinística pela semente"""
+
+    def __init__(self, quantidade, perfil):
+        self.quantidade = quantidade
+        self.perfil = perfil
+        self.fora = [False] * quantidade
+
+    def leitura(self, i):
+        if self.perfil == 'aleatorio':
+            return gerar_leitura()
+        # Estado por leito: saídas duram várias leituras, como no sensor real
+        if self.fora[i]:
+            self.fora[i] = random.random() >= CHANCE_VOLTAR
+        else:
+            self.fora[i] = random.random() < CHANCE_SAIR
+        return gerar_distancia(self.fora[i]), self.fora[i]
+
+class Carga:
+    def __init__(self, args):
+        self.args = args
+        self.leitos = Leitos(args.leitos, args.perfil)
+        self.em_voo = 0
+        self.enviadas = {}  # (dispositivo, hora, distância) -> instante do envio
+        self.atrasos_ws = []
+        self.degrau = None
+
+    async def enviar(self, sessao, i):
+        distancia, alerta = self.leitos.leitura(i)
+        agora = datetime.now()
+        dispositivo = dispositivo_leito(i)
+        payload = {
+            "distancia_cm": distancia,
+            "alerta": alerta,
+            "data_hora": agora.isoformat(timespec="microseconds"),
+            "dispositivo": dispositivo
+        }
+        degrau = self.degrau
+        t0 = time.perf_counter()
+        if i < self.args.observadores:
+            chave = (dispositivo, agora.strftime("%H:%M:%S"), round(distancia, 1))
+            self.enviadas[chave] = t0
+        self.em_voo += 1
+        try:
+            async with sessao.post(f"{API_URL}/api/enviar", json=payload,
+                                   headers={'X-Forwarded-For': ip_leito(i)}) as resposta:
+                await resposta.read()
+                status = resposta.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status = type(e).__name__
+        finally:
+            self.em_voo -= 1
+        degrau['latencias'].append(time.perf_counter() - t0)
+        if status not in (201, 202):
+            degrau['erros'][str(status)] = degrau['erros'].get(str(status), 0) + 1
+
+    async def cadastrar_observados(self, sessao):
+        """Uma leitura de cada leito observado, para que seu dispositivo exista"""
+        if not self.args.observadores:
+            return
+        agora = datetime.now().isoformat(timespec="microseconds")
+        lote = [{"distancia_cm": 150.0, "alerta": False, "data_hora": agora,
+                 "dispositivo": dispositivo_leito(i)} for i in range(self.args.observadores)]
+        async with sessao.post(f"{API_URL}/api/enviar-lote", json=lote) as resposta:
+            await resposta.read()
+
+    async def observar(self, i):
+        """Dashboard simulado: mede o atraso entre o POST e a chegada do ponto"""
+        cliente = socketio.AsyncClient(reconnection=False)
+        dispositivo = dispositivo_leito(i)
+
+        @cliente.on('leituras')
+        async def ao_receber(mensagem):
+            agora = time.perf_counter()
+            for hora, distancia, _alerta in mensagem['p']:
+                enviado = self.enviadas.pop((dispositivo, hora, distancia), None)
+                if enviado is not None:
+                    self.atrasos_ws.append(agora - enviado)
+
+        await cliente.connect(f"{API_URL}?dispositivo={dispositivo}",
+                              transports=['websocket'], wait_timeout=10,
+                              auth={'chave': CHAVE_PAINEL})
+        return cliente
+
+    async def executar_degrau(self, sessao, taxa):
+        self.degrau = {'taxa_alvo': taxa, 'latencias': [], 'erros': {}, 'descartadas': 0}
+        tarefas = []
+        intervalo = 1 / taxa
+        inicio = time.perf_counter()
+        k = 0
+        proximo_leito = 0
+        while True:
+            alvo = inicio + k * intervalo
+            if alvo - inicio >= self.args.duracao_degrau:
+                break
+            espera = alvo - time.perf_counter()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            k += 1
+            # Carga em malha aberta: com muitas requisições pendentes o servidor
+            # já não acompanha; a leitura é contada como descartada
+            if self.em_voo >= self.args.max_em_voo:
+                self.degrau['descartadas'] += 1
+                continue
+            tarefas.append(asyncio.ensure_future(self.enviar(sessao, proximo_leito)))
+            proximo_leito = (proximo_leito + 1) % self.args.leitos
+        await asyncio.gather(*tarefas)
+        duracao = time.perf_counter() - inicio
+
+        degrau = self.degrau
+        latencias = degrau.pop('latencias')
+        erros = sum(degrau['erros'].values())
+        degrau.update({
+            'enviadas': len(latencias),
+            'taxa_obtida': round(len(latencias) / duracao, 1),
+            'taxa_erros': round(erros / len(latencias), 4) if latencias else 0.0,
+            'latencia_ms': percentis(latencias)
+        })
+        return degrau
+
+    async def executar(self):
+        args = self.args
+        inicio = datetime.now().isoformat(timespec='seconds')
+        taxas = [args.taxa_inicial + (args.taxa_final - args.taxa_inicial) * d / max(args.degraus - 1, 1)
+                 for d in range(args.degraus)]
+
+        conector = aiohttp.TCPConnector(limit=args.conexoes)
+        timeout = aiohttp.ClientTimeout(total=args.timeout)
+        async with aiohttp.ClientSession(connector=conector, timeout=timeout) as sessao:
+            # A room só aceita dashboards depois da primeira leitura do dispositivo
+            await self.cadastrar_observados(sessao)
+            observadores = await asyncio.gather(
+                *(self.observar(i) for i in range(args.observadores)), return_exceptions=True)
+            conectados = [c for c in observadores if not isinstance(c, Exception)]
+            print(f"🔌 {len(conectados)}/{args.observadores} dashboards conectados")
+
+            degraus = []
+            for taxa in taxas:
+                degrau = await self.executar_degrau(sessao, taxa)
+                degraus.append(degrau)
+                lat = degrau['latencia_ms'] or {}
+                print(f"   {taxa:8.0f} alvo | {degrau['taxa_obtida']:8.1f} req/s | "
+                      f"p50 {lat.get('p50', 0):7.1f} ms | p95 {lat.get('p95', 0):7.1f} ms | "
+                      f"p99 {lat.get('p99', 0):7.1f} ms | erros {degrau['taxa_erros']:.2%} | "
+                      f"descartadas {degrau['descartadas']}")
+
+            await asyncio.sleep(2)  # últimos eventos coalescidos
+            await asyncio.gather(*(c.disconnect() for c in conectados))
+
+        return {
+            'parametros': {k: v for k, v in vars(args).items() if k not in ('comparar', 'relatorio')},
+            'url': API_URL,
+            'inicio': inicio,
+            'degraus': degraus,
+            'entrega_ws': dict(percentis(self.atrasos_ws) or {}, amostras=len(self.atrasos_ws))
+        }
+
+def comparar(relatorio, anterior):
+    """Diferença de vazão e latência por degrau em relação a outro relatório"""
+    print(f"\n📈 Comparação com a execução de {anterior.get('inicio')}")
+    if anterior.get('parametros') != relatorio['parametros']:
+        print("   ⚠️  parâmetros diferentes; a comparação pode não ser válida")
+    for atual, antes in zip(relatorio['degraus'], anterior['degraus']):
+        p95 = (atual['latencia_ms'] or {}).get('p95', 0)
+        p95_antes = (antes['latencia_ms'] or {}).get('p95', 0)
+        print(f"   {atual['taxa_alvo']:8.0f} alvo | req/s {antes['taxa_obtida']:8.1f} -> "
+              f"{atual['taxa_obtida']:8.1f} | p95 {p95_antes:7.1f} -> {p95:7.1f} ms | "
+              f"erros {antes['taxa_erros']:.2%} -> {atual['taxa_erros']:.2%}")
+    ws, ws_antes = relatorio['entrega_ws'], anterior.get('entrega_ws', {})
+    print(f"   entrega WebSocket p95: {ws_antes.get('p95', 0)} -> {ws.get('p95', 0)} ms")
+
+def main():
+    global API_URL, CHAVE_PAINEL
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=API_URL, help="URL base da API")
+    parser.add_argument('--chave', default=CHAVE_PAINEL,
+                        help="CHAVE_PAINEL da API, para os dashboards (padrão: variável CHAVE_PAINEL)")
+    parser.add_argument('--leitos', type=int, default=2000, help="leitos simulados")
+    parser.add_argument('--perfil', choices=['episodios', 'aleatorio'], default='episodios',
+                        help="episodios: cada leito entra e sai do alerta; aleatorio: gerar_leitura()")
+    parser.add_argument('--taxa-inicial', type=float, default=100, help="leituras/s no 1º degrau")
+    parser.add_argument('--taxa-final', type=float, default=1000, help="leituras/s no último degrau")
+    parser.add_argument('--degraus', type=int, default=5, help="degraus da rampa")
+    parser.add_argument('--duracao-degrau', type=float, default=10, help="segundos por degrau")
+    parser.add_argument('--observadores', type=int, default=50,
+                        help="dashboards WebSocket (um por leito, dos primeiros leitos)")
+    parser.add_argument('--conexoes', type=int, default=200, help="conexões HTTP simultâneas")
+    parser.add_argument('--max-em-voo', type=int, default=2000,
+                        help="requisições pendentes a partir das quais as leituras são descartadas")
+    parser.add_argument('--timeout', type=float, default=30, help="timeout por requisição (s)")
+    parser.add_argument('--semente', type=int, default=42, help="semente das leituras simuladas")
+    parser.add_argument('--relatorio', default=None,
+                        help="arquivo JSON do relatório (padrão: carga_AAAAMMDD_HHMMSS.json)")
+    parser.add_argument('--comparar', default=None, help="relatório anterior para comparação")
+    args = parser.parse_args()
+    API_URL = args.url.rstrip('/')
+    CHAVE_PAINEL = args.chave
+    random.seed(args.semente)
+
+    print("=" * 70)
+    print("📊 CARGA: leitos simultâneos em rampa")
+    print(f"   API: {API_URL} | Leitos: {args.leitos} | Taxa: {args.taxa_inicial:.0f} -> "
+          f"{args.taxa_final:.0f} leituras/s em {args.degraus} degraus de {args.duracao_degrau}s")
+    print("=" * 70)
+
+    relatorio = asyncio.run(Carga(args).executar())
+
+    ws = relatorio['entrega_ws']
+    print(f"📥 entrega WebSocket: {ws['amostras']} amostras | p50 {ws.get('p50', 0)} ms | "
+          f"p95 {ws.get('p95', 0)} ms | p99 {ws.get('p99', 0)} ms")
+
+    arquivo = args.relatorio or datetime.now().strftime("carga_%Y%m%d_%H%M%S.json")
+    with open(arquivo, 'w') as f:
+        json.dump(relatorio, f, indent=2, ensure_ascii=False)
+    print(f"💾 relatório: {arquivo}")
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            comparar(relatorio, json.load(f))
+
+if __name__ == "__main__":
+    main()
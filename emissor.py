@@ -1,65 +1,334 @@
 import paho.mqtt.client as mqtt
 import json
+import os
+import random
 import requests
+import sqlite3
+import threading
 import time
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from requests.adapters import HTTPAdapter
+
+try:
+    import msgpack  # opcional: formato binário (EMISSOR_FORMATO=msgpack)
+except ImportError:
+    msgpack = None
 
 # --- CONFIGURAÇÕES ---
 MQTT_BROKER = "localhost"  # Mosquitto Local
-MQTT_TOPIC = "lab/03/ultrasonico"
+# Um tópico por leito: o nível '+' identifica o dispositivo (lab/03/ultrasonico -> "03")
+MQTT_TOPIC = "lab/+/ultrasonico"
 
 # IP PÚBLICO DA EC2 DA AWS
-AWS_URL = "http://98.95.203.92:5000/api/enviar"
+AWS_LOTE_URL = "http://98.95.203.92:5000/api/enviar-lote"
+
+# Relógio das leituras: horário de Brasília sem fuso, como a API grava
+# (independe do fuso configurado na máquina do emissor)
+BRAZIL_TZ = timezone(timedelta(hours=-3))
+
+# Política de encaminhamento por dispositivo (um leito não limita os outros):
+# envia na hora quando o alerta muda ou a distância sai da banda morta; sem
+# mudanças, envia só um heartbeat com mín/média/máx do intervalo.
+DEADBAND_CM = 5.0  # Variação de distância que força o envio imediato
+INTERVALO_HEARTBEAT = 30  # Segundos sem mudança até o heartbeat
+dispositivos = {}  # tópico -> estado do dispositivo
+
+# Envio para a AWS fora do callback do MQTT: o on_message só grava a leitura
+# no spool e uma thread envia o que estiver pendente em um único POST (lote),
+# reaproveitando a conexão HTTP (keep-alive). Assim o loop do paho nunca fica
+# bloqueado e nenhuma leitura se perde se a API cair.
+LOTE_MAX = 500  # Leituras por requisição
+TIMEOUT_ENVIO = 5  # Segundos
+
+# Spool em disco (SQLite em modo WAL): guarda toda leitura ainda não enviada,
+# com a data_hora original, e sobrevive a quedas da API e reinícios do emissor
+SPOOL_ARQUIVO = os.environ.get('EMISSOR_SPOOL', 'emissor_spool.db')
+SPOOL_MAX_LEITURAS = int(os.environ.get('EMISSOR_SPOOL_MAX', '500000'))
+# Com o spool cheio: 'antigas' descarta as mais antigas, 'novas' recusa as novas
+SPOOL_POLITICA = os.environ.get('EMISSOR_SPOOL_POLITICA', 'antigas')
+BACKOFF_INICIAL = 1  # Segundos
+BACKOFF_MAX = 60  # Segundos
+
+# Formato do corpo enviado à API: 'json' ou 'msgpack' (binário compacto, cada
+# leitura vira [dispositivo, epoch_ms, distância float32, alerta]). O spool
+# continua em JSON; a conversão acontece só no envio.
+FORMATO_ENVIO = os.environ.get('EMISSOR_FORMATO', 'json')
+
+# Chaves de API por dispositivo (flask cadastrar-dispositivo na API): arquivo
+# JSON {"03": "<chave>", ...}. A chave autentica um único dispositivo, então o
+# enviador separa o lote por chave; dispositivos fora do arquivo vão sem chave.
+CHAVES_ARQUIVO = os.environ.get('EMISSOR_CHAVES')
+chaves_api = {}  # dispositivo -> chave; carregado em iniciar_enviador()
+
+estatisticas = {'enviadas': 0, 'falhas': 0, 'descartadas': 0, 'suprimidas': 0}
+spool = None  # Aberto em iniciar_enviador()
+
+class Spool:
+    """Fila FIFO persistente: adicionar() no callback, proximas()/remover() no envio"""
+
+    def __init__(self, arquivo, max_leituras, politica='antigas'):
+        if politica not in ('antigas', 'novas'):
+            raise ValueError("politica deve ser 'antigas' ou 'novas'")
+        self.max_leituras = max_leituras
+        self.politica = politica
+        self.disponivel = threading.Event()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(arquivo, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, leitura TEXT NOT NULL)"
+        )
+        self._tamanho = self._conn.execute("SELECT count(*) FROM spool").fetchone()[0]
+        if self._tamanho:
+            self.disponivel.set()
+
+    def __len__(self):
+        return self._tamanho
+
+    def adicionar(self, leitura):
+        """Grava a leitura; retorna False se ela (ou a mais antiga) foi descartada"""
+        descartou = False
+        with self._lock:
+            if self._tamanho >= self.max_leituras:
+                if self.politica == 'novas':
+                    return False
+                excesso = self._tamanho - self.max_leituras + 1
+                apagadas = self._conn.execute(
+                    "DELETE FROM spool WHERE id IN "
+                    "(SELECT id FROM spool ORDER BY id LIMIT ?)", (excesso,)
+                ).rowcount
+                self._tamanho -= apagadas
+                descartou = True
+            self._conn.execute("INSERT INTO spool (leitura) VALUES (?)", (json.dumps(leitura),))
+            self._tamanho += 1
+        self.disponivel.set()
+        return not descartou
+
+    def proximas(self, limite):
+        """Leituras mais antigas ainda não enviadas: [(id, leitura)] em ordem"""
+        with self._lock:
+            linhas = self._conn.execute(
+                "SELECT id, leitura FROM spool ORDER BY id LIMIT ?", (limite,)
+            ).fetchall()
+            if not linhas:
+                self.disponivel.clear()
+        return [(id_, json.loads(leitura)) for id_, leitura in linhas]
+
+    def remover(self, ids):
+        """Remove as leituras confirmadas pela API"""
+        with self._lock:
+            apagadas = self._conn.executemany(
+                "DELETE FROM spool WHERE id = ?", [(id_,) for id_ in ids]
+            ).rowcount
+            self._tamanho -= apagadas
+
+def criar_sessao():
+    """Sessão HTTP com pool de conexões persistentes"""
+    sessao = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+    sessao.mount('http://', adaptador)
+    sessao.mount('https://', adaptador)
+    return sessao
+
+def leitura_binaria(leitura):
+    """Pacote do spool no formato binário da API (data_hora em horário de Brasília)"""
+    data_hora = datetime.fromisoformat(leitura['data_hora']).replace(tzinfo=BRAZIL_TZ)
+    epoch_ms = int(data_hora.timestamp() * 1000)
+    return [leitura.get('dispositivo'), epoch_ms, float(leitura['distancia_cm']),
+            bool(leitura['alerta'])]
+
+def codificar_lote(lote, formato=None):
+    """Corpo e Content-Type do POST do lote"""
+    if (formato or FORMATO_ENVIO) == 'msgpack':
+        corpo = msgpack.packb([leitura_binaria(l) for l in lote], use_single_float=True)
+        return corpo, 'application/msgpack'
+    return json.dumps(lote).encode(), 'application/json'
+
+def espera_retry(resposta, backoff):
+    """Respeita o Retry-After da API (503 com fila cheia); senão usa o backoff com jitter"""
+    if resposta is not None:
+        try:
+            return float(resposta.headers['Retry-After'])
+        except (KeyError, ValueError):
+            pass
+    return backoff * random.uniform(0.5, 1.0)
+
+def grupos_por_chave(pendentes):
+    """Separa [(id, leitura)] por chave de API, mantendo a ordem dentro de cada grupo"""
+    grupos = {}
+    for id_, leitura in pendentes:
+        grupos.setdefault(chaves_api.get(leitura.get('dispositivo')), []).append((id_, leitura))
+    return grupos.items()
+
+def enviar_grupo(sessao, chave, pendentes):
+    """POST de um lote com a chave do grupo; retorna a resposta ou None (falha de conexão)"""
+    corpo, tipo = codificar_lote([leitura for _, leitura in pendentes])
+    cabecalhos = {'Content-Type': tipo}
+    if chave:
+        cabecalhos['X-API-Key'] = chave
+    try:
+        return sessao.post(AWS_LOTE_URL, data=corpo, headers=cabecalhos, timeout=TIMEOUT_ENVIO)
+    except requests.RequestException as e:
+        print(f"Falha na conexão com AWS: {e}")
+        return None
+
+def enviador():
+    """Esvazia o spool em ordem; em falha, tenta o mesmo lote de novo com backoff exponencial"""
+    sessao = criar_sessao()
+    backoff = BACKOFF_INICIAL
+    while True:
+        spool.disponivel.wait()
+        pendentes = spool.proximas(LOTE_MAX)
+        if not pendentes:
+            continue
+        
+        for chave, grupo in grupos_por_chave(pendentes):
+            ids = [id_ for id_, _ in grupo]
+            resposta = enviar_grupo(sessao, chave, grupo)
+            
+            if resposta is not None and resposta.status_code in (201, 202):
+                spool.remover(ids)
+                estatisticas['enviadas'] += len(grupo)
+                backoff = BACKOFF_INICIAL
+                print(f">> Enviado para AWS com sucesso! ({len(grupo)} leitura(s), "
+                      f"{len(spool)} no spool)")
+            elif resposta is not None and resposta.status_code in (400, 401, 403, 413):
+                # Lote recusado por inteiro: reenviar não adianta e travaria o spool
+                spool.remover(ids)
+                estatisticas['descartadas'] += len(grupo)
+                print(f"Erro AWS: {resposta.status_code}, lote descartado")
+            else:
+                if resposta is not None:
+                    print(f"Erro AWS: {resposta.status_code}")
+                estatisticas['falhas'] += len(grupo)
+                espera = espera_retry(resposta, backoff)
+                print(f"Nova tentativa em {espera:.1f}s ({len(spool)} leitura(s) no spool)")
+                time.sleep(espera)
+                backoff = min(backoff * 2, BACKOFF_MAX)
+                break  # os grupos seguintes voltam no próximo proximas()
+
+def iniciar_enviador():
+    global spool, chaves_api
+    if FORMATO_ENVIO not in ('json', 'msgpack'):
+        raise ValueError("EMISSOR_FORMATO deve ser 'json' ou 'msgpack'")
+    if FORMATO_ENVIO == 'msgpack' and msgpack is None:
+        raise RuntimeError("EMISSOR_FORMATO=msgpack exige o pacote msgpack")
+    if CHAVES_ARQUIVO:
+        with open(CHAVES_ARQUIVO) as f:
+            chaves_api = json.load(f)
+        print(f"Chaves de API de {len(chaves_api)} dispositivo(s) carregadas")
+    spool = Spool(SPOOL_ARQUIVO, SPOOL_MAX_LEITURAS, SPOOL_POLITICA)
+    if len(spool):
+        print(f"Spool com {len(spool)} leitura(s) pendente(s), reenviando")
+    threading.Thread(target=enviador, daemon=True).start()
+
+def dispositivo_do_topico(topico):
+    """Id do dispositivo: o nível do tópico que casa com o '+' de MQTT_TOPIC"""
+    niveis_filtro = MQTT_TOPIC.split('/')
+    niveis = topico.split('/')
+    for filtro, nivel in zip(niveis_filtro, niveis):
+        if filtro == '+':
+            return nivel
+    return topico
+
+def estado_dispositivo(topico):
+    """Estado do dispositivo, criado na primeira mensagem do tópico (busca O(1))"""
+    estado = dispositivos.get(topico)
+    if estado is None:
+        estado = dispositivos[topico] = {
+            'id': dispositivo_do_topico(topico),
+            'ultimo_envio': 0,
+            'distancia': None,  # Último valor enviado (referência da banda morta)
+            'alerta': None,
+            'amostras': 0,  # Janela desde o último envio
+            'soma': 0.0,
+            'minimo': None,
+            'maximo': None
+        }
+    return estado
+
+def filtrar_leitura(estado, distancia, alerta, agora):
+    """
+    Aplica a política de encaminhamento à leitura e retorna o pacote a enviar
+    (mudança ou heartbeat) ou None quando ela só entra no resumo do intervalo.
+    """
+    estado['amostras'] += 1
+    estado['soma'] += distancia
+    estado['minimo'] = distancia if estado['minimo'] is None else min(estado['minimo'], distancia)
+    estado['maximo'] = distancia if estado['maximo'] is None else max(estado['maximo'], distancia)
+    
+    mudou = (estado['alerta'] is None or alerta != estado['alerta']
+             or abs(distancia - estado['distancia']) > DEADBAND_CM)
+    if not mudou and agora - estado['ultimo_envio'] < INTERVALO_HEARTBEAT:
+        return None
+    
+    pacote = {
+        "distancia_cm": distancia,
+        "alerta": alerta,
+        "data_hora": datetime.now(BRAZIL_TZ).replace(tzinfo=None).isoformat(timespec="milliseconds"),
+        "dispositivo": estado['id']
+    }
+    if not mudou:
+        # Heartbeat: a distância é a média da janela, com mín/máx e nº de amostras
+        pacote.update({
+            "distancia_cm": round(estado['soma'] / estado['amostras'], 1),
+            "distancia_min": estado['minimo'],
+            "distancia_max": estado['maximo'],
+            "amostras": estado['amostras']
+        })
+    
+    estado.update(ultimo_envio=agora, distancia=pacote['distancia_cm'], alerta=alerta,
+                  amostras=0, soma=0.0, minimo=None, maximo=None)
+    return pacote
 
-# Variáveis globais para controle de tempo
-ultimo_envio = 0
-INTERVALO_ENVIO = 3  # Segundos
+def ler_mensagem(payload):
+    """
+    (distância, alerta) da mensagem MQTT: objeto JSON do ESP32 ou, em
+    MessagePack, o array [distancia_cm, alerta] (objetos JSON começam com '{')
+    """
+    if payload[:1] == b'{':
+        dados = json.loads(payload.decode())
+        return dados.get('distancia_cm'), dados.get('alerta', False)
+    distancia, alerta = msgpack.unpackb(payload)
+    return distancia, alerta
 
 def on_connect(client, userdata, flags, rc):
     print("Conectado ao MQTT Local!")
     client.subscribe(MQTT_TOPIC)
 
 def on_message(client, userdata, msg):
-    global ultimo_envio
-    
     try:
         # Recebe dados do ESP32
-        payload = msg.payload.decode()
-        dados = json.loads(payload)
+        distancia, alerta = ler_mensagem(msg.payload)
         
-        distancia = dados.get('distancia_cm')
-        alerta = dados.get('alerta', False)
+        estado = estado_dispositivo(msg.topic)
+        print(f"Local [{estado['id']}]: {distancia} cm | Alerta: {'SIM' if alerta else 'NÃO'}")
         
-        print(f"Local: {distancia} cm | Alerta: {'SIM' if alerta else 'NÃO'}")
-        
-        # Verifica se já passou o intervalo
-        agora = time.time()
-        if (agora - ultimo_envio) >= INTERVALO_ENVIO:
-            
-            # Prepara o pacote para a AWS (adiciona timestamp)
-            json_aws = {
-                "distancia_cm": distancia,
-                "alerta": alerta,
-                "data_hora": datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-            }
-            
-            # Envia para a AWS via HTTP POST
-            try:
-                resposta = requests.post(AWS_URL, json=json_aws, timeout=2)
-                if resposta.status_code == 201:
-                    print(">> Enviado para AWS com sucesso!")
-                    ultimo_envio = agora
-                else:
-                    print(f"Erro AWS: {resposta.status_code}")
-            except Exception as e:
-                print(f"Falha na conexão com AWS: {e}")
-                
+        # Mudança de alerta ou de distância vai na hora; o resto vira heartbeat
+        json_aws = filtrar_leitura(estado, float(distancia), alerta, time.time())
+        if json_aws is None:
+            estatisticas['suprimidas'] += 1
+        else:
+            # Grava no spool para a thread de envio (não bloqueia o loop do MQTT)
+            if not spool.adicionar(json_aws):
+                estatisticas['descartadas'] += 1
+                descartada = 'mais antiga' if SPOOL_POLITICA == 'antigas' else 'nova'
+                print(f"Spool cheio, leitura {descartada} descartada")
+    
     except Exception as e:
         print(f"Erro de processamento: {e}")
 
-client = mqtt.Client()
-client.on_connect = on_connect
-client.on_message = on_message
+def main():
+    iniciar_enviador()
+    
+    client = mqtt.Client()
+    client.on_connect = on_connect
+    client.on_message = on_message
+    
+    client.connect(MQTT_BROKER, 1883, 60)
+    client.loop_forever()
 
-client.connect(MQTT_BROKER, 1883, 60)
-client.loop_forever()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,28 @@
 """
 Popular Banco com Dados Históricos
 Gera dados fictícios de dias anteriores para testar o histórico de alertas
+
+Modo padrão: 200 leituras por dia, uma requisição por leitura.
+Modo --massa: gera meses de leituras de centenas de leitos com NumPy
+(determinístico pela --semente) e carrega via COPY direto no Postgres ou em
+lotes pelo /api/enviar-lote. Exige numpy (e psycopg2 no destino copy).
 """
 
-import requests
+import argparse
+import io
+import json
+import os
 import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+import requests
+
 # URL da API
 AWS_URL = "http://98.95.203.92:5000/api/enviar"
+AWS_LOTE_URL = "http://98.95.203.92:5000/api/enviar-lote"
 
 # Configurações
 DIAS_ANTERIORES = 7  # Quantos dias para trás gerar dados
@@ -26,7 +40,7 @@ def gerar_distancia(alerta):
         else:
             return round(random.uniform(110, 200), 1)  # Normal: muito longe
 
-def main():
+def popular_por_requisicao():
     print("=" * 60)
     print("📊 POPULAR BANCO COM DADOS HISTÓRICOS")
     print(f"   Dias: {DIAS_ANTERIORES} | Leituras/dia: {LEITURAS_POR_DIA}")
@@ -66,7 +80,7 @@ def main():
             
             try:
                 resposta = requests.post(AWS_URL, json=payload, timeout=5)
-                if resposta.status_code == 201:
+                if resposta.status_code in (201, 202):
                     enviados_dia += 1
                     total_enviados += 1
                 else:
@@ -87,5 +101,216 @@ def main():
     print(f"{'=' * 60}")
     print("\n✅ Pronto! Acesse /graficos para ver o histórico.")
 
+# --- Carga em massa ---
+MAX_LINHAS_BLOCO = 1000000  # Leituras geradas/carregadas por vez
+EPISODIOS_POR_DIA = 8  # Saídas do leito por leito e dia (média)
+DURACAO_EPISODIO = 120  # Segundos (média)
+
+def dispositivos(args):
+    return [f"{args.prefixo}-{i:04d}" for i in range(args.leitos)]
+
+def gerar_bloco(np, args, dia, primeiro, quantidade):
+    """
+    Leituras de `quantidade` leitos em um dia, vetorizadas: uma a cada
+    args.intervalo segundos por leito, com saídas do leito (alerta) em episódios.
+    A semente combina --semente, dia e leito: o mesmo intervalo gera sempre os mesmos dados.
+    Retorna (data_hora, distancia_cm, alerta, índice do leito) ordenados por leito e hora.
+    """
+    rng = np.random.default_rng([args.semente, dia.toordinal(), primeiro])
+    por_leito = 86400 // args.intervalo
+    
+    inicio = np.datetime64(dia.isoformat(), 's')
+    deslocamento = np.arange(por_leito) * args.intervalo
+    jitter = rng.integers(0, args.intervalo, size=(quantidade, por_leito))
+    data_hora = inicio + (deslocamento + jitter).astype('timedelta64[s]')
+    
+    # Episódios: início uniforme no dia, duração exponencial; marca com +1/-1 e acumula
+    episodios = rng.poisson(EPISODIOS_POR_DIA, size=quantidade)
+    leito = np.repeat(np.arange(quantidade), episodios)
+    comeco = rng.integers(0, por_leito, size=len(leito))
+    duracao = np.maximum(1, np.round(rng.exponential(DURACAO_EPISODIO, len(leito)) / args.intervalo))
+    fim = np.minimum(comeco + duracao.astype(np.int64), por_leito)
+    marcas = np.zeros((quantidade, por_leito + 1), dtype=np.int32)
+    np.add.at(marcas, (leito, comeco), 1)
+    np.add.at(marcas, (leito, fim), -1)
+    alerta = np.cumsum(marcas, axis=1)[:, :por_leito] > 0
+    
+    # Mesmas faixas de gerar_distancia(): alerta 30-100 cm; normal 10-25 ou 110-200 cm
+    perto = rng.random(alerta.shape) < 0.5
+    distancia = np.where(alerta, rng.uniform(30, 100, alerta.shape),
+                         np.where(perto, rng.uniform(10, 25, alerta.shape),
+                                  rng.uniform(110, 200, alerta.shape)))
+    distancia = np.round(distancia, 1)
+    
+    indice = np.repeat(np.arange(primeiro, primeiro + quantidade), por_leito)
+    return data_hora.ravel(), distancia.ravel(), alerta.ravel(), indice
+
+def blocos(np, args):
+    """Percorre os dias (do mais antigo a ontem) em blocos de até MAX_LINHAS_BLOCO leituras"""
+    por_leito = 86400 // args.intervalo
+    leitos_bloco = max(1, MAX_LINHAS_BLOCO // por_leito)
+    hoje = datetime.now().date()
+    for dias_atras in range(args.dias, 0, -1):
+        dia = hoje - timedelta(days=dias_atras)
+        for primeiro in range(0, args.leitos, leitos_bloco):
+            yield dia, gerar_bloco(np, args, dia, primeiro, min(leitos_bloco, args.leitos - primeiro))
+
+def carregar_copy(np, args):
+    """COPY FROM STDIN direto na tabela leitura, depois recalcula o resumo por hora"""
+    import psycopg2
+    
+    # psycopg2 não aceita o sufixo de driver do SQLAlchemy (postgresql+psycopg2://)
+    url = args.database_url.replace('postgresql+psycopg2://', 'postgresql://')
+    conn = psycopg2.connect(url)
+    cur = conn.cursor()
+    codigos = dispositivos(args)
+    hoje = datetime.now().date()
+    inicio, fim = hoje - timedelta(days=args.dias), hoje
+    
+    # As leituras referenciam o cadastro pelo id: cadastra os códigos que faltam
+    cur.execute("""
+        INSERT INTO dispositivo (codigo) SELECT unnest(%s)
+        ON CONFLICT (codigo) DO UPDATE SET codigo = EXCLUDED.codigo
+        RETURNING codigo, id
+    """, (codigos,))
+    id_por_codigo = dict(cur.fetchall())
+    origens = [id_por_codigo[c] for c in codigos]
+    
+    # Recarregar com a mesma semente substitui os dados em vez de duplicá-los
+    cur.execute("DELETE FROM leitura WHERE dispositivo_id = ANY(%s) AND data_hora >= %s AND data_hora < %s",
+                (origens, inicio, fim))
+    conn.commit()
+    
+    total = 0
+    for dia, (data_hora, distancia, alerta, indice) in blocos(np, args):
+        linhas = zip(data_hora.astype(str), distancia.astype(str),
+                     np.where(alerta, 't', 'f'), np.array(origens).astype(str)[indice])
+        dados = io.StringIO('\n'.join(map('\t'.join, linhas)) + '\n')
+        cur.copy_expert("COPY leitura (data_hora, distancia_cm, alerta, dispositivo_id) FROM STDIN", dados)
+        conn.commit()
+        total += len(indice)
+        print(f"   {dia} | {total} leituras")
+    
+    # O COPY não passa pela API: o agregado dos leitos gerados é refeito aqui
+    print("   Recalculando resumo_hora...")
+    cur.execute("DELETE FROM resumo_hora WHERE dispositivo_id = ANY(%s) AND data >= %s AND data < %s",
+                (origens, inicio, fim))
+    cur.execute("""
+        INSERT INTO resumo_hora (dispositivo_id, data, hora, leituras, alertas,
+                                 distancia_min, distancia_max, distancia_soma)
+        SELECT dispositivo_id, CAST(data_hora AS date), EXTRACT(hour FROM data_hora),
+               count(*), count(*) FILTER (WHERE alerta),
+               min(distancia_cm), max(distancia_cm), coalesce(sum(distancia_cm), 0)
+        FROM leitura
+        WHERE dispositivo_id = ANY(%s) AND data_hora >= %s AND data_hora < %s
+        GROUP BY 1, 2, 3
+    """, (origens, inicio, fim))
+    conn.commit()
+    conn.close()
+    marcar_cache_historico(origens, inicio, fim)
+    return total
+
+def marcar_cache_historico(origens, inicio, fim):
+    """
+    Marca a escrita nos dias carregados no cache compartilhado da API
+    (CACHE_REDIS_URL), invalidando o cache HTTP do histórico. Sem ele as
+    marcas ficam na memória de cada worker: é preciso reiniciar a API.
+    """
+    url = os.environ.get('CACHE_REDIS_URL')
+    if not url:
+        print("   Reinicie a API para descartar as respostas de histórico em cache.")
+        return
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'subir'))
+    from cache import CacheRedis
+    
+    dias = {'*'} | {(inicio + timedelta(days=i)).isoformat() for i in range((fim - inicio).days)}
+    cache = CacheRedis(url)
+    agora = time.time_ns()
+    for origem in origens:
+        cache.marcar_escrita(origem, dias, agora)
+    print("   Cache do histórico invalidado.")
+
+def enviar_lote(sessao, lote):
+    """POST de um lote com novas tentativas; uma falha não interrompe a carga"""
+    for tentativa in range(5):
+        try:
+            resposta = sessao.post(AWS_LOTE_URL, data=lote, timeout=120,
+                                   headers={'Content-Type': 'application/x-ndjson'})
+            if resposta.status_code in (201, 202):
+                return resposta.json().get('inseridos', 0)
+            print(f"   ⚠️  HTTP {resposta.status_code}")
+        except requests.RequestException as e:
+            print(f"   ⚠️  {e}")
+        time.sleep(2 ** tentativa)
+    return 0
+
+def carregar_api(np, args):
+    """Envia os blocos em NDJSON pelo /api/enviar-lote (resumo e episódios ficam com o servidor)"""
+    origens = dispositivos(args)
+    sessao = requests.Session()
+    total = 0
+    with ThreadPoolExecutor(args.paralelo) as executor:
+        for dia, (data_hora, distancia, alerta, indice) in blocos(np, args):
+            linhas = [json.dumps({"distancia_cm": d, "alerta": a, "data_hora": h,
+                                  "dispositivo": origens[i]})
+                      for h, d, a, i in zip(data_hora.astype(str), distancia.tolist(),
+                                            alerta.tolist(), indice.tolist())]
+            lotes = ['\n'.join(linhas[i:i + args.tamanho_lote])
+                     for i in range(0, len(linhas), args.tamanho_lote)]
+            total += sum(executor.map(lambda lote: enviar_lote(sessao, lote), lotes))
+            print(f"   {dia} | {total} leituras")
+    return total
+
+def popular_em_massa(args):
+    import numpy as np
+    
+    por_leito = 86400 // args.intervalo
+    print("=" * 60)
+    print("📊 CARGA EM MASSA DE DADOS HISTÓRICOS")
+    print(f"   Dias: {args.dias} | Leitos: {args.leitos} | Intervalo: {args.intervalo}s "
+          f"| Total: {args.dias * args.leitos * por_leito} leituras")
+    print(f"   Destino: {args.destino} | Semente: {args.semente}")
+    print("=" * 60)
+    
+    inicio = time.perf_counter()
+    if args.destino == 'copy':
+        total = carregar_copy(np, args)
+    else:
+        total = carregar_api(np, args)
+    duracao = time.perf_counter() - inicio
+    
+    print(f"\n✅ {total} leituras em {duracao:.1f}s ({total / duracao:.0f} leituras/s)")
+    if args.destino == 'copy':
+        print("   Episódios não são detectados no COPY (só na ingestão pela API).")
+
+def main():
+    global AWS_LOTE_URL
+    
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--massa', action='store_true', help="carga em massa (NumPy)")
+    parser.add_argument('--destino', choices=['copy', 'api'], default='copy',
+                        help="copy: COPY no Postgres (DATABASE_URL); api: /api/enviar-lote")
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'),
+                        help="URL do Postgres para o destino copy")
+    parser.add_argument('--url', default=None, help="URL base da API para o destino api")
+    parser.add_argument('--dias', type=int, default=30, help="dias anteriores a hoje")
+    parser.add_argument('--leitos', type=int, default=100, help="leitos (dispositivos) simulados")
+    parser.add_argument('--intervalo', type=int, default=30, help="segundos entre leituras de um leito")
+    parser.add_argument('--prefixo', default='hist', help="prefixo dos ids de dispositivo gerados")
+    parser.add_argument('--semente', type=int, default=42, help="semente do gerador")
+    parser.add_argument('--tamanho-lote', type=int, default=20000, help="leituras por POST (destino api)")
+    parser.add_argument('--paralelo', type=int, default=4, help="POSTs simultâneos (destino api)")
+    args = parser.parse_args()
+    
+    if not args.massa:
+        popular_por_requisicao()
+        return
+    if args.url:
+        AWS_LOTE_URL = args.url.rstrip('/') + '/api/enviar-lote'
+    if args.destino == 'copy' and not args.database_url:
+        parser.error("o destino copy exige --database-url ou DATABASE_URL")
+    popular_em_massa(args)
+
 if __name__ == "__main__":
     main()
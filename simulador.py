@@ -66,7 +66,7 @@ def main():
             
             try:
                 resposta = requests.post(AWS_URL, json=payload, timeout=5)
-                if resposta.status_code == 201:
+                if resposta.status_code in (201, 202):
                     print(f"        ✅ Enviado com sucesso!")
                 else:
                     print(f"        ❌ Erro: HTTP {resposta.status_code}")
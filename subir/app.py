@@ -1,29 +1,192 @@
-from flask import Flask, request, jsonify, render_template_string, send_from_directory
+from flask import (Flask, g, request, jsonify, render_template, send_from_directory,
+                   stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
 from flask_socketio import SocketIO, emit
+from collections import OrderedDict
 from datetime import datetime, date, timedelta, timezone
-from sqlalchemy import func
+from sqlalchemy import func, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import OperationalError
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from werkzeug.http import is_resource_modified
+from werkzeug.utils import secure_filename
+import atexit
+import click
+import csv
+import gzip
+import hashlib
+import hmac
+import io
+import json
 import os
+import queue
+import re
+import threading
+import time
+
+from cache import CacheMemoria, CacheRedis
+from difusao import DifusorLeituras, mensagem_unica
+from dispositivos import RegistroDispositivos, gerar_chave, hash_chave
+from episodios import DetectorEpisodios, EstadoOrigem
+from vivacidade import MonitorVivacidade
+import metricas
+
+try:
+    import brotli  # opcional: compressão 'br' além de gzip
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack  # opcional: ingestão no formato binário
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow  # opcional: exportação em Parquet
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import saude  # opcional: análise de saúde dos sensores (numpy)
+except ImportError:
+    saude = None
 
 # Timezone Brasil (UTC-3)
 BRAZIL_TZ = timezone(timedelta(hours=-3))
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = 'monitor-ultrassonico-secret'
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'monitor-ultrassonico-secret')
 
 # Configuração do Banco
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://user:password@db/monitor_db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'DATABASE_URL', 'postgresql+psycopg2://user:password@db/monitor_db'
+)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True}
 db = SQLAlchemy(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+
+# Em desenvolvimento (python app.py) usa threads; em produção o wsgi.py aplica o
+# monkey patching do gevent e seleciona async_mode='gevent'. Com vários processos
+# os eventos passam por uma fila de mensagens (Redis), para que
+# emit(..., room=dispositivo) alcance os clientes conectados em qualquer worker.
+socketio = SocketIO(app, cors_allowed_origins="*",
+                    async_mode=os.environ.get('SOCKETIO_ASYNC_MODE', 'threading'),
+                    message_queue=os.environ.get('SOCKETIO_MESSAGE_QUEUE'))
+
+# Leito monitorado; o sensor instalado nele é um Dispositivo (pode ser trocado)
+# A chave do leito (SHA-256, como a de API) dá acesso de leitura aos
+# dispositivos do leito: histórico, exportação e a room do Socket.IO.
+class Leito(db.Model):
+    __tablename__ = 'leito'
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(100), nullable=False, unique=True)
+    chave_hash = db.Column(db.String(64), unique=True)
+
+# Dispositivo que envia leituras. O código é o id textual usado até aqui (nível
+# do tópico MQTT ou, para clientes antigos, o IP); as tabelas de leituras
+# guardam só o id inteiro. Com chave de API (guardada como SHA-256) o
+# dispositivo só aceita leituras autenticadas por ela.
+class Dispositivo(db.Model):
+    __tablename__ = 'dispositivo'
+    id = db.Column(db.Integer, primary_key=True)
+    codigo = db.Column(db.String(45), nullable=False, unique=True)
+    leito_id = db.Column(db.Integer, db.ForeignKey('leito.id'))
+    leito = db.relationship('Leito')
+    chave_hash = db.Column(db.String(64), unique=True)
+    criado_em = db.Column(db.DateTime, nullable=False, server_default=func.now())
 
 # Modelo da Tabela
 class Leitura(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     distancia_cm = db.Column(db.Float)
     alerta = db.Column(db.Boolean, default=False)
-    data_hora = db.Column(db.DateTime, default=datetime.utcnow)
-    ip_origem = db.Column(db.String(45))  # Suporta IPv4 e IPv6
+    data_hora = db.Column(db.DateTime, primary_key=True, default=datetime.utcnow)
+    dispositivo_id = db.Column(db.Integer, db.ForeignKey('dispositivo.id'), nullable=False)
+    
+    # Consultas do dashboard filtram por dispositivo e intervalo de data_hora;
+    # o índice parcial cobre só as linhas de alerta (histórico por hora).
+    # O índice por dispositivo e data_hora é único: o reenvio de uma leitura
+    # (spool do emissor) é ignorado na gravação (ver gravar_leituras).
+    # A tabela é particionada por data_hora (ver criar_particoes), por isso
+    # data_hora faz parte da chave primária e do índice único.
+    __table_args__ = (
+        db.Index('ux_leitura_dispositivo_data_hora', 'dispositivo_id', 'data_hora', unique=True),
+        db.Index('ix_leitura_dispositivo_data_hora_alerta', 'dispositivo_id', 'data_hora',
+                 postgresql_where=db.text('alerta')),
+        {'postgresql_partition_by': 'RANGE (data_hora)'},
+    )
+
+# Agregado por hora, mantido incrementalmente na ingestão (ver atualizar_resumo).
+# Atende /api/alertas-por-hora e /api/datas-disponiveis sem ler a tabela leitura.
+class ResumoHora(db.Model):
+    __tablename__ = 'resumo_hora'
+    dispositivo_id = db.Column(db.Integer, db.ForeignKey('dispositivo.id'), primary_key=True)
+    data = db.Column(db.Date, primary_key=True)
+    hora = db.Column(db.SmallInteger, primary_key=True)
+    leituras = db.Column(db.Integer, nullable=False, default=0)
+    alertas = db.Column(db.Integer, nullable=False, default=0)
+    distancia_min = db.Column(db.Float)
+    distancia_max = db.Column(db.Float)
+    distancia_soma = db.Column(db.Float, nullable=False, default=0)  # média = soma / leituras
+
+# Episódios de saída do leito detectados na ingestão (ver processar_episodios).
+# Episódio aberto tem fim NULL; o índice único parcial garante no máximo um por origem.
+class Episodio(db.Model):
+    __tablename__ = 'episodio'
+    id = db.Column(db.Integer, primary_key=True)
+    dispositivo_id = db.Column(db.Integer, db.ForeignKey('dispositivo.id'), nullable=False)
+    inicio = db.Column(db.DateTime, nullable=False)
+    fim = db.Column(db.DateTime)
+    duracao_s = db.Column(db.Float)
+    alertas = db.Column(db.Integer, nullable=False, default=0)  # leituras em alerta no episódio
+    
+    __table_args__ = (
+        db.Index('ix_episodio_dispositivo_inicio', 'dispositivo_id', 'inicio'),
+        db.Index('ux_episodio_aberto', 'dispositivo_id', unique=True,
+                 postgresql_where=db.text('fim IS NULL')),
+    )
+
+# Interrupções: períodos em que um dispositivo ficou sem enviar leituras (ver
+# ciclo_vivacidade). Começam na última leitura antes do silêncio; a aberta tem
+# fim NULL e o índice único parcial garante no máximo uma por dispositivo.
+class Interrupcao(db.Model):
+    __tablename__ = 'interrupcao'
+    id = db.Column(db.Integer, primary_key=True)
+    dispositivo_id = db.Column(db.Integer, db.ForeignKey('dispositivo.id'), nullable=False)
+    inicio = db.Column(db.DateTime, nullable=False)
+    fim = db.Column(db.DateTime)
+    duracao_s = db.Column(db.Float)
+    
+    __table_args__ = (
+        db.Index('ix_interrupcao_dispositivo_inicio', 'dispositivo_id', 'inicio'),
+        db.Index('ux_interrupcao_aberta', 'dispositivo_id', unique=True,
+                 postgresql_where=db.text('fim IS NULL')),
+    )
+
+# Saúde de cada sensor por dia (ver analisar_saude_dia): leituras inválidas,
+# picos, lacunas, travamento e a nota resultante. O dia corrente é refeito
+# periodicamente; os anteriores ficam fixos depois de fechados.
+class SaudeDia(db.Model):
+    __tablename__ = 'saude_dia'
+    dispositivo_id = db.Column(db.Integer, db.ForeignKey('dispositivo.id'), primary_key=True)
+    data = db.Column(db.Date, primary_key=True)
+    leituras = db.Column(db.Integer, nullable=False)
+    invalidas = db.Column(db.Integer, nullable=False)
+    picos = db.Column(db.Integer, nullable=False)
+    lacunas = db.Column(db.Integer, nullable=False)
+    sem_dados_s = db.Column(db.Float, nullable=False)
+    maior_lacuna_s = db.Column(db.Float, nullable=False)
+    travado_s = db.Column(db.Float, nullable=False)  # maior sequência de distâncias iguais
+    cobertura = db.Column(db.Float, nullable=False)  # fração do período com leituras
+    nota = db.Column(db.Float, nullable=False)  # 0 a 100
+    estado = db.Column(db.String(12), nullable=False)  # ok, degradado, falho, sem_dados
+    calculado_em = db.Column(db.DateTime, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_saude_dia_data_nota', 'data', 'nota'),
+    )
 
 def get_client_ip():
     """Obtém o IP real do cliente, considerando proxies"""
@@ -31,74 +194,1347 @@ def get_client_ip():
         return request.headers.get('X-Forwarded-For').split(',')[0].strip()
     return request.remote_addr
 
-# Quando cliente conecta via WebSocket, entra na room do seu IP
+# Vários leitos podem compartilhar o mesmo emissor (e o mesmo IP): a leitura
+# pode trazer o código do dispositivo; sem ele, o código é o IP do cliente.
+# O código é resolvido para o id inteiro do cadastro, que é a origem usada em
+# rooms, cache, resumo e consultas.
+PADRAO_DISPOSITIVO = re.compile(r'^[A-Za-z0-9_.-]{1,45}$')
+
+def ler_dispositivo(dados):
+    """Id do dispositivo informado na leitura (ou None); ValueError se inválido"""
+    dispositivo = dados.get('dispositivo')
+    if dispositivo is None:
+        return None
+    if not isinstance(dispositivo, str) or not PADRAO_DISPOSITIVO.match(dispositivo):
+        raise ValueError('dispositivo inválido (até 45 letras, números, _ . -)')
+    return dispositivo
+
+# --- Cadastro de dispositivos e chaves de API ---
+# Sem EXIGIR_CHAVE, um código novo é cadastrado na primeira leitura (como era
+# com IPs). Dispositivos com chave só aceitam leituras com o cabeçalho
+# X-API-Key correspondente; com EXIGIR_CHAVE=1 toda leitura precisa de chave e
+# só dispositivos cadastrados (flask cadastrar-dispositivo) existem.
+EXIGIR_CHAVE = os.environ.get('EXIGIR_CHAVE', '0') == '1'
+
+registro_dispositivos = RegistroDispositivos(ttl=int(os.environ.get('DISPOSITIVOS_TTL', '60')))
+
+def buscar_dispositivo(codigo, criar=False):
+    """
+    (id, hash da chave de API, hash da chave do leito) do código, ou None;
+    com criar=True cadastra se não existir. Com o banco indisponível vale o
+    último cadastro conhecido; sem ele, o OperationalError é propagado.
+    """
+    encontrado, valor = registro_dispositivos.por_codigo(codigo)
+    if not encontrado or (valor is None and criar):
+        try:
+            d = Dispositivo.query.filter_by(codigo=codigo).first()
+            if d is None and criar:
+                # Upsert: outro worker pode cadastrar o mesmo código ao mesmo tempo
+                id_ = db.session.execute(pg_insert(Dispositivo).values(codigo=codigo).on_conflict_do_update(
+                    index_elements=['codigo'], set_={'codigo': codigo}
+                ).returning(Dispositivo.id)).scalar()
+                db.session.commit()
+                valor = (id_, None, None)
+            else:
+                valor = (d.id, d.chave_hash, d.leito.chave_hash if d.leito else None) if d else None
+        except OperationalError:
+            db.session.rollback()
+            encontrado, valor = registro_dispositivos.por_codigo(codigo, vencido=True)
+            if not encontrado or (valor is None and criar):
+                raise
+        # Renovado também no fallback: o banco volta a ser consultado só depois de ttl
+        registro_dispositivos.guardar_codigo(codigo, valor)
+    return valor
+
+def dispositivo_da_chave(chave):
+    """(id, código) do dispositivo dono da chave de API, ou None; banco indisponível como em buscar_dispositivo"""
+    chave_hash = hash_chave(chave)
+    encontrado, valor = registro_dispositivos.por_chave(chave_hash)
+    if not encontrado:
+        try:
+            d = Dispositivo.query.filter_by(chave_hash=chave_hash).first()
+            valor = (d.id, d.codigo) if d else None
+        except OperationalError:
+            db.session.rollback()
+            encontrado, valor = registro_dispositivos.por_chave(chave_hash, vencido=True)
+            if not encontrado:
+                raise
+        registro_dispositivos.guardar_chave(chave_hash, valor)
+    return valor
+
+def resolver_dispositivo(codigo, ip_cliente, chave):
+    """
+    Id do dispositivo em que a leitura será gravada. codigo é o 'dispositivo'
+    da leitura (ou None, e então vale o IP do cliente); chave é o X-API-Key.
+    Lança PermissionError quando a chave falta, é inválida ou é de outro dispositivo.
+    """
+    if chave:
+        dono = dispositivo_da_chave(chave)
+        if dono is None:
+            raise PermissionError('chave de API inválida')
+        if codigo is not None and codigo != dono[1]:
+            raise PermissionError(f"a chave de API não é do dispositivo '{codigo}'")
+        return dono[0]
+    if EXIGIR_CHAVE:
+        raise PermissionError('chave de API obrigatória (cabeçalho X-API-Key)')
+    
+    cadastro = buscar_dispositivo(codigo or ip_cliente, criar=True)
+    if cadastro[1] is not None:
+        raise PermissionError('dispositivo exige chave de API (cabeçalho X-API-Key)')
+    return cadastro[0]
+
+# --- Acesso de leitura (visualizadores) ---
+# Histórico, exportação e a room do Socket.IO de um dispositivo exigem uma
+# credencial no cabeçalho X-Chave-Leito (no Socket.IO, em auth.chave): a chave
+# do leito do dispositivo (flask cadastrar-leito) ou a CHAVE_PAINEL, que vale
+# para todos os dispositivos e para as listas gerais. O IP do cliente não
+# serve de credencial (X-Forwarded-For é informado pelo próprio cliente), e
+# consultas de visualizadores nunca cadastram dispositivos.
+CHAVE_PAINEL = os.environ.get('CHAVE_PAINEL')
+
+def credencial_painel(credencial):
+    """True se a credencial é a CHAVE_PAINEL (comparação em tempo constante)"""
+    return bool(CHAVE_PAINEL and credencial) and hmac.compare_digest(
+        hash_chave(credencial), hash_chave(CHAVE_PAINEL))
+
+def exigir_painel():
+    """Listas de todos os dispositivos: só com a CHAVE_PAINEL"""
+    if not credencial_painel(request.headers.get('X-Chave-Leito')):
+        raise PermissionError('credencial do painel obrigatória (cabeçalho X-Chave-Leito)')
+
+def get_origem(credencial=None):
+    """
+    Id do dispositivo que o visualizador acompanha (?dispositivo=<código> ou o
+    seu IP), ou None se o código não está cadastrado. Lança PermissionError
+    sem credencial (X-Chave-Leito) válida para o dispositivo.
+    """
+    codigo = request.args.get('dispositivo') or get_client_ip()
+    credencial = credencial or request.headers.get('X-Chave-Leito')
+    if not credencial:
+        raise PermissionError('credencial de visualização obrigatória (cabeçalho X-Chave-Leito)')
+    cadastro = buscar_dispositivo(codigo)
+    if credencial_painel(credencial):
+        return cadastro[0] if cadastro else None
+    if cadastro is None or cadastro[2] is None or not hmac.compare_digest(
+            hash_chave(credencial), cadastro[2]):
+        raise PermissionError('credencial sem acesso a este dispositivo')
+    return cadastro[0]
+
+@app.errorhandler(PermissionError)
+def acesso_negado(e):
+    return jsonify({"status": "erro", "mensagem": str(e)}), 403
+
+# Quando cliente conecta via WebSocket, entra na room do dispositivo (ou do seu
+# IP). Sem credencial ou com o dispositivo ainda não cadastrado (antes da sua
+# primeira leitura) a conexão é recusada; o dashboard tenta de novo depois.
 @socketio.on('connect')
-def handle_connect():
-    from flask_socketio import join_room
-    ip_cliente = get_client_ip()
-    join_room(ip_cliente)
+def handle_connect(auth=None):
+    from flask_socketio import ConnectionRefusedError, join_room
+    try:
+        origem = get_origem(auth.get('chave') if isinstance(auth, dict) else None)
+    except PermissionError as e:
+        raise ConnectionRefusedError(str(e))
+    if origem is None:
+        raise ConnectionRefusedError('dispositivo não cadastrado')
+    join_room(origem)
+    metricas.CLIENTES.inc()
 
-with app.app_context():
+@socketio.on('disconnect')
+def handle_disconnect(motivo=None):
+    metricas.CLIENTES.dec()
+
+# --- Métricas e profiling ---
+# GET /metrics expõe os contadores e histogramas (ver metricas.py). Com
+# PROFILING_DIR definido, uma fração PROFILING_AMOSTRAGEM das requisições (ou
+# as que mandarem o cabeçalho X-Profiling: 1) gera um .prof do cProfile.
+PROFILING_DIR = os.environ.get('PROFILING_DIR')
+PROFILING_AMOSTRAGEM = float(os.environ.get('PROFILING_AMOSTRAGEM', '0'))
+
+profiler = metricas.ProfilerRequisicoes(PROFILING_DIR, PROFILING_AMOSTRAGEM)
+
+@app.before_request
+def iniciar_medicao():
+    g.inicio_requisicao = time.perf_counter()
+    g.perfil = profiler.iniciar(forcar=request.headers.get('X-Profiling') == '1')
+
+@app.after_request
+def registrar_metricas(resposta):
+    """Registrado antes de comprimir_resposta, então roda depois dela (tamanho comprimido)"""
+    endpoint = request.endpoint or 'nao_encontrado'
+    metricas.REQUISICOES.labels(endpoint, request.method, resposta.status_code).inc()
+    metricas.LATENCIA.labels(endpoint, request.method).observe(
+        time.perf_counter() - g.inicio_requisicao)
+    if request.content_length:
+        metricas.TAMANHO_REQUISICAO.labels(endpoint).observe(request.content_length)
+    # Streams (exportação, resumo) não têm tamanho conhecido e não podem ser lidos aqui
+    if not resposta.is_streamed:
+        metricas.TAMANHO_RESPOSTA.labels(endpoint).observe(resposta.calculate_content_length())
+    return resposta
+
+@app.teardown_request
+def finalizar_profiling(erro=None):
+    perfil = g.pop('perfil', None)
+    if perfil is not None:
+        duracao = time.perf_counter() - g.inicio_requisicao
+        arquivo = profiler.finalizar(perfil, f"{request.method}_{request.endpoint}", duracao)
+        print(f"Perfil gravado em {arquivo}")
+
+@app.route('/metrics')
+def metricas_prometheus():
+    return app.response_class(generate_latest(), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+# Migrações idempotentes para bancos criados antes das mudanças de schema.
+# db.create_all() só cria tabelas novas; índices de tabelas existentes são
+# criados aqui com CONCURRENTLY para não bloquear a ingestão.
+MIGRACOES = [
+    # Falha se houver leituras repetidas de antes do índice: ver 'flask deduplicar'
+    "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_leitura_dispositivo_data_hora "
+    "ON leitura (dispositivo_id, data_hora)",
+    # O índice único substitui o antigo, mas só depois de criado
+    """
+    DO $$ BEGIN
+        IF to_regclass('ux_leitura_dispositivo_data_hora') IS NOT NULL THEN
+            DROP INDEX IF EXISTS ix_leitura_dispositivo_data_hora;
+        END IF;
+    END $$
+    """,
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_leitura_dispositivo_data_hora_alerta "
+    "ON leitura (dispositivo_id, data_hora) WHERE alerta",
+    # Chave de visualização do leito (ver get_origem)
+    "ALTER TABLE leito ADD COLUMN IF NOT EXISTS chave_hash varchar(64) UNIQUE",
+]
+
+def tabela_particionada(conn):
+    """True se a tabela leitura já usa particionamento nativo"""
+    return conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+        "WHERE partrelid = to_regclass('leitura'))"
+    )).scalar()
+
+def migrar_schema():
+    """Aplica as migrações pendentes (CONCURRENTLY exige autocommit)"""
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        # Tabelas particionadas não aceitam CREATE INDEX CONCURRENTLY
+        particionada = tabela_particionada(conn)
+        for sql in MIGRACOES:
+            if particionada:
+                sql = sql.replace(' CONCURRENTLY', '')
+            try:
+                conn.execute(text(sql))
+            except Exception as e:
+                print(f"Falha na migração '{sql}': {e}")
+
+@app.cli.command('migrar')
+def migrar_command():
+    """Cria tabelas e aplica as migrações de schema"""
     db.create_all()
+    migrar_schema()
+    print("Schema atualizado.")
+
+# Bancos anteriores ao cadastro de dispositivos guardam o IP/código como texto
+# (ip_origem) em cada linha. A conversão cria um dispositivo por código e troca
+# a coluna pelo id; reescreve as tabelas, então roda em uma única transação e
+# com as tabelas bloqueadas (janela de manutenção).
+MIGRACAO_DISPOSITIVOS = [
+    "LOCK TABLE leitura, resumo_hora, episodio IN ACCESS EXCLUSIVE MODE",
+    """
+    INSERT INTO dispositivo (codigo)
+    SELECT DISTINCT coalesce(ip_origem, 'desconhecido') FROM (
+        SELECT ip_origem FROM leitura
+        UNION SELECT ip_origem FROM resumo_hora
+        UNION SELECT ip_origem FROM episodio
+    ) origens
+    ON CONFLICT (codigo) DO NOTHING
+    """,
+] + [
+    sql.format(tabela=tabela)
+    for tabela in ('leitura', 'resumo_hora', 'episodio')
+    for sql in [
+        "ALTER TABLE {tabela} ADD COLUMN dispositivo_id integer",
+        "UPDATE {tabela} t SET dispositivo_id = d.id FROM dispositivo d "
+        "WHERE d.codigo = coalesce(t.ip_origem, 'desconhecido')",
+        "ALTER TABLE {tabela} ALTER COLUMN dispositivo_id SET NOT NULL",
+        "ALTER TABLE {tabela} ADD FOREIGN KEY (dispositivo_id) REFERENCES dispositivo (id)",
+    ]
+] + [
+    # Remover ip_origem remove também os índices antigos que a usavam
+    "ALTER TABLE resumo_hora DROP CONSTRAINT resumo_hora_pkey",
+    "ALTER TABLE leitura DROP COLUMN ip_origem",
+    "ALTER TABLE resumo_hora DROP COLUMN ip_origem",
+    "ALTER TABLE episodio DROP COLUMN ip_origem",
+    "ALTER TABLE resumo_hora ADD PRIMARY KEY (dispositivo_id, data, hora)",
+    "CREATE INDEX ix_leitura_dispositivo_data_hora ON leitura (dispositivo_id, data_hora)",
+    "CREATE INDEX ix_leitura_dispositivo_data_hora_alerta "
+    "ON leitura (dispositivo_id, data_hora) WHERE alerta",
+    "CREATE INDEX ix_episodio_dispositivo_inicio ON episodio (dispositivo_id, inicio)",
+    "CREATE UNIQUE INDEX ux_episodio_aberto ON episodio (dispositivo_id) WHERE fim IS NULL",
+]
+
+def schema_com_ip_origem(conn):
+    """True se a tabela leitura ainda tem a coluna ip_origem (banco não convertido)"""
+    return conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'leitura' AND column_name = 'ip_origem')"
+    )).scalar()
+
+@app.cli.command('migrar-dispositivos')
+def migrar_dispositivos_command():
+    """Converte ip_origem (texto) em dispositivo_id nas tabelas de leituras"""
+    if not schema_com_ip_origem(db.session):
+        print("As tabelas já usam dispositivo_id.")
+        return
+    for sql in MIGRACAO_DISPOSITIVOS:
+        db.session.execute(text(sql))
+    db.session.commit()
+    total = db.session.query(func.count(Dispositivo.id)).scalar()
+    print(f"Tabelas convertidas para dispositivo_id ({total} dispositivos cadastrados).")
+
+@app.cli.command('cadastrar-dispositivo')
+@click.option('--codigo', required=True, help="Código do dispositivo (nível do tópico MQTT ou IP)")
+@click.option('--leito', help="Nome do leito monitorado (criado se não existir)")
+@click.option('--sem-chave', is_flag=True, help="Remove a chave de API em vez de gerar uma nova")
+def cadastrar_dispositivo_command(codigo, leito, sem_chave):
+    """Cadastra o dispositivo e gera uma nova chave de API (mostrada só uma vez)"""
+    if not PADRAO_DISPOSITIVO.match(codigo):
+        raise click.BadParameter('até 45 letras, números, _ . -', param_hint='--codigo')
+    dispositivo = Dispositivo.query.filter_by(codigo=codigo).first()
+    if dispositivo is None:
+        dispositivo = Dispositivo(codigo=codigo)
+        db.session.add(dispositivo)
+    if leito:
+        registro = Leito.query.filter_by(nome=leito).first()
+        if registro is None:
+            registro = Leito(nome=leito)
+            db.session.add(registro)
+        dispositivo.leito = registro
+    chave = None if sem_chave else gerar_chave()
+    dispositivo.chave_hash = hash_chave(chave) if chave else None
+    db.session.commit()
+    
+    print(f"Dispositivo '{codigo}' (id {dispositivo.id})"
+          + (f", leito '{leito}'" if leito else ''))
+    if chave:
+        print(f"Chave de API (guarde agora, não será mostrada de novo): {chave}")
+    else:
+        print("Sem chave de API: aceita leituras sem X-API-Key (se EXIGIR_CHAVE não estiver ligado).")
+
+@app.cli.command('cadastrar-leito')
+@click.option('--nome', required=True, help="Nome do leito (criado se não existir)")
+@click.option('--sem-chave', is_flag=True, help="Remove a chave de visualização em vez de gerar uma nova")
+def cadastrar_leito_command(nome, sem_chave):
+    """Gera uma nova chave de visualização do leito (mostrada só uma vez)"""
+    leito = Leito.query.filter_by(nome=nome).first()
+    if leito is None:
+        leito = Leito(nome=nome)
+        db.session.add(leito)
+    chave = None if sem_chave else gerar_chave()
+    leito.chave_hash = hash_chave(chave) if chave else None
+    db.session.commit()
+
+    print(f"Leito '{nome}' (id {leito.id})")
+    if chave:
+        print(f"Chave de visualização (guarde agora, não será mostrada de novo): {chave}")
+        print(f"Dashboard: /?dispositivo=<código>#chave={chave}")
+    else:
+        print("Sem chave de visualização: só a CHAVE_PAINEL dá acesso aos dispositivos do leito.")
+
+# Vários workers sobem juntos em produção: o advisory lock garante que só um
+# por vez cria tabelas e aplica migrações
+LOCK_SCHEMA = 730300
+
+with app.app_context():
+    with db.engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:chave)"), {'chave': LOCK_SCHEMA})
+        try:
+            db.create_all()
+            # Os índices novos dependem de dispositivo_id (ver migrar-dispositivos)
+            if schema_com_ip_origem(conn):
+                print("AVISO: tabelas ainda com ip_origem; rode 'flask migrar-dispositivos'")
+            else:
+                migrar_schema()
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:chave)"), {'chave': LOCK_SCHEMA})
 
 @app.route('/sensor.jsonld')
 def serve_jsonld():
     return send_from_directory(os.getcwd(), 'sensor.jsonld', mimetype='application/ld+json')
 
+def ler_data_hora(texto):
+    """
+    datetime.fromisoformat que também aceita o sufixo Z: antes do Python 3.11
+    (a imagem usa o 3.9) ele só entende +00:00
+    """
+    if isinstance(texto, str) and texto[-1:] in ('Z', 'z'):
+        texto = texto[:-1] + '+00:00'
+    return datetime.fromisoformat(texto)
+
+def data_hora_local(data_hora):
+    """
+    Datas com fuso (ex.: +00:00 ou Z) viram horário de Brasília sem fuso, como as
+    demais: misturar as duas formas quebra ordenações e comparações (episódios)
+    """
+    if data_hora.tzinfo is None:
+        return data_hora
+    return data_hora.astimezone(BRAZIL_TZ).replace(tzinfo=None)
+
+def payload_leitura(distancia_cm, alerta, data_hora):
+    """Leitura formatada para o dashboard (hora local HH:MM:SS)"""
+    return {
+        'distancia_cm': distancia_cm,
+        'alerta': alerta,
+        'data_hora': data_hora.strftime("%H:%M:%S")
+    }
+
+def validar_leitura(dados):
+    """
+    Valida uma leitura (item do lote ou da fila) e retorna os campos da linha.
+    Lança ValueError com a mensagem de erro quando o item é inválido.
+    """
+    if not isinstance(dados, dict):
+        raise ValueError('item deve ser um objeto JSON')
+    
+    distancia = dados.get('distancia_cm')
+    if distancia is None:
+        distancia = dados.get('distancia')
+    if isinstance(distancia, bool) or not isinstance(distancia, (int, float)):
+        raise ValueError('distancia_cm ausente ou não numérica')
+    try:
+        distancia = float(distancia)
+    except OverflowError:
+        raise ValueError('distancia_cm fora do intervalo')
+    
+    alerta = dados.get('alerta', False)
+    if not isinstance(alerta, bool):
+        raise ValueError('alerta deve ser booleano')
+    
+    data_hora_str = dados.get('data_hora')
+    if data_hora_str is None:
+        data_hora = datetime.now()
+    else:
+        try:
+            data_hora = data_hora_local(ler_data_hora(data_hora_str))
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError('data_hora inválida (esperado ISO 8601)')
+    
+    return {
+        'distancia_cm': distancia,
+        'alerta': alerta,
+        'data_hora': data_hora,
+        'dispositivo': ler_dispositivo(dados)
+    }
+
+# --- Formato binário (MessagePack) ---
+# Alternativa compacta ao JSON, escolhida pelo Content-Type: cada leitura é o
+# array [dispositivo ou nil, epoch em ms, distância (float32), alerta], sem
+# nomes de campos nem data em texto; o lote é um array dessas leituras.
+TIPOS_MSGPACK = {'application/msgpack', 'application/x-msgpack'}
+
+def corpo_binario():
+    """True se a requisição veio em MessagePack"""
+    return request.mimetype in TIPOS_MSGPACK
+
+def ler_msgpack():
+    """Decodifica o corpo MessagePack; ValueError se inválido"""
+    try:
+        return msgpack.unpackb(request.get_data())
+    except (ValueError, msgpack.UnpackException):
+        raise ValueError('corpo MessagePack inválido')
+
+def validar_leitura_binaria(item):
+    """Como validar_leitura, para uma leitura no formato binário"""
+    if not isinstance(item, list) or len(item) != 4:
+        raise ValueError('leitura deve ser [dispositivo, epoch_ms, distancia_cm, alerta]')
+    dispositivo, epoch_ms, distancia, alerta = item
+    
+    if isinstance(epoch_ms, bool) or not isinstance(epoch_ms, int):
+        raise ValueError('epoch_ms deve ser inteiro')
+    if isinstance(distancia, bool) or not isinstance(distancia, (int, float)):
+        raise ValueError('distancia_cm ausente ou não numérica')
+    if not isinstance(alerta, bool):
+        raise ValueError('alerta deve ser booleano')
+    try:
+        # Mesmo relógio das datas em texto: horário de Brasília, sem fuso
+        data_hora = datetime.fromtimestamp(epoch_ms / 1000, BRAZIL_TZ).replace(tzinfo=None)
+    except (OverflowError, OSError, ValueError):
+        raise ValueError('epoch_ms fora do intervalo')
+    
+    return {
+        # O emissor envia float32: 12.3 chega como 12.300000190734863. O sensor
+        # mede com resolução de 0,1 cm, então o arredondamento não perde nada
+        'distancia_cm': round(float(distancia), 1),
+        'alerta': alerta,
+        'data_hora': data_hora,
+        'dispositivo': ler_dispositivo({'dispositivo': dispositivo})
+    }
+
+def formato_nao_suportado():
+    return jsonify({"status": "erro", "mensagem": "formato MessagePack indisponível no servidor"}), 415
+
+# --- Cache da última leitura por dispositivo ---
+# Status atual e leituras recentes de cada room sem consultar o banco.
+# Com CACHE_REDIS_URL o cache é compartilhado entre workers (pacote redis).
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+CACHE_MAX_IPS = int(os.environ.get('CACHE_MAX_IPS', '10000'))
+CACHE_BUFFER = int(os.environ.get('CACHE_BUFFER', '100'))  # leituras recentes por dispositivo
+
+if CACHE_REDIS_URL:
+    cache_leituras = CacheRedis(CACHE_REDIS_URL, tamanho_buffer=CACHE_BUFFER)
+else:
+    cache_leituras = CacheMemoria(max_ips=CACHE_MAX_IPS, tamanho_buffer=CACHE_BUFFER)
+
+def atualizar_cache(linhas, transicoes=()):
+    """Registra leituras já gravadas no cache; falhas do cache não afetam a ingestão"""
+    try:
+        cache_leituras.registrar_lote(linhas)
+        marcar_escritas(linhas, transicoes)
+    except Exception as e:
+        print(f"Erro ao atualizar o cache de leituras: {e}")
+
+def dias_entre(inicio, fim):
+    """Dias (ISO) de inicio a fim, inclusive"""
+    dia, dias = inicio.date(), set()
+    while dia <= fim.date():
+        dias.add(dia.isoformat())
+        dia += timedelta(days=1)
+    return dias
+
+def marcar_escritas(linhas, transicoes=()):
+    """
+    Instante da escrita por origem e dia: invalida o cache HTTP do histórico.
+    Além dos dias das leituras, marca todos os dias de cada episódio aberto ou
+    fechado no lote (um episódio que fecha no dia seguinte muda o dia do início).
+    """
+    dias_por_origem = {}
+    for linha in linhas:
+        dias_por_origem.setdefault(linha['dispositivo_id'], {'*'}).add(
+            linha['data_hora'].date().isoformat())
+    for t in transicoes:
+        fim = t['fim'] or max(l['data_hora'] for l in linhas if l['dispositivo_id'] == t['origem'])
+        dias_por_origem.setdefault(t['origem'], {'*'}).update(dias_entre(t['inicio'], fim))
+    agora = time.time_ns()
+    for origem, dias in dias_por_origem.items():
+        cache_leituras.marcar_escrita(origem, dias, agora)
+
+def marcar_dias(origens, dias):
+    """Marca escrita nos dias (date) das origens, para recálculos fora da ingestão"""
+    try:
+        dias = {'*'} | {dia.isoformat() for dia in dias}
+        agora = time.time_ns()
+        for origem in origens:
+            cache_leituras.marcar_escrita(origem, dias, agora)
+    except Exception as e:
+        print(f"Erro ao atualizar o cache de leituras: {e}")
+
+# --- Episódios de saída do leito ---
+# Máquina de estados por origem sobre o fluxo de leituras (ver episodios.py):
+# abre quando o alerta dura EPISODIO_INICIO_S segundos e fecha quando a volta
+# ao normal dura EPISODIO_FIM_S segundos (pela data_hora das leituras: o emissor
+# só encaminha mudanças). Com leituras a cada 3 s, um único alerta isolado é ruído.
+EPISODIO_INICIO_S = float(os.environ.get('EPISODIO_INICIO_S', '5'))
+EPISODIO_FIM_S = float(os.environ.get('EPISODIO_FIM_S', '5'))
+
+detector_episodios = DetectorEpisodios(EPISODIO_INICIO_S, EPISODIO_FIM_S,
+                                       max_origens=CACHE_MAX_IPS)
+
+def processar_episodios(linhas):
+    """
+    Passa as leituras, em ordem cronológica, por cópias dos estados do detector e
+    grava as transições na transação corrente. Retorna (transições, estados): as
+    transições são notificadas e os estados publicados só depois do commit.
+    """
+    estados = detector_episodios.estados({linha['dispositivo_id'] for linha in linhas})
+    for origem, estado in estados.items():
+        if estado is None:
+            # Origem nova neste processo: retoma o episódio aberto, se houver
+            aberto = Episodio.query.filter_by(dispositivo_id=origem, fim=None).first()
+            estados[origem] = EstadoOrigem(aberto.inicio, aberto.alertas) if aberto else EstadoOrigem()
+    
+    transicoes = []
+    for linha in sorted(linhas, key=lambda l: l['data_hora']):
+        origem = linha['dispositivo_id']
+        transicao = detector_episodios.processar(estados[origem], origem,
+                                                 linha['data_hora'], linha['alerta'])
+        if transicao is not None:
+            transicoes.append(transicao)
+    
+    for t in transicoes:
+        if t['tipo'] == 'inicio':
+            db.session.execute(pg_insert(Episodio).values(
+                dispositivo_id=t['origem'], inicio=t['inicio'], alertas=t['alertas']
+            ).on_conflict_do_nothing())
+        else:
+            db.session.execute(update(Episodio).where(
+                Episodio.dispositivo_id == t['origem'],
+                Episodio.fim.is_(None)
+            ).values(
+                fim=t['fim'],
+                duracao_s=(t['fim'] - t['inicio']).total_seconds(),
+                alertas=t['alertas']
+            ))
+    return transicoes, estados
+
+def payload_episodio(inicio, fim, alertas):
+    return {
+        'inicio': inicio.isoformat(),
+        'fim': fim.isoformat() if fim else None,
+        'duracao_s': (fim - inicio).total_seconds() if fim else None,
+        'alertas': alertas
+    }
+
+def notificar_episodios(transicoes):
+    for t in transicoes:
+        socketio.emit('episodio', dict(
+            payload_episodio(t['inicio'], t['fim'], t['alertas']), tipo=t['tipo']
+        ), room=t['origem'])
+        metricas.EMISSOES.labels('episodio').inc()
+
+# Advisory lock por dia do agregado (LOCK_RESUMO, dia.toordinal()): a ingestão
+# o toma compartilhado antes do upsert e o recálculo de um dia (ver
+# recalcular_resumo_dia), exclusivo. Só aquele dia espera pelo recálculo.
+LOCK_RESUMO = 730303
+
+def travar_dia_resumo(dia, exclusivo=False):
+    """Trava o dia do agregado até o fim da transação corrente"""
+    funcao = 'pg_advisory_xact_lock' if exclusivo else 'pg_advisory_xact_lock_shared'
+    db.session.execute(text(f"SELECT {funcao}(:classe, :dia)"),
+                       {'classe': LOCK_RESUMO, 'dia': dia.toordinal()})
+
+def atualizar_resumo(linhas):
+    """
+    Soma as leituras ao agregado por (dispositivo, dia, hora) na transação corrente.
+    O lote é pré-agregado em memória e aplicado com um único upsert; as chaves
+    vão ordenadas para que transações concorrentes travem as linhas na mesma ordem.
+    """
+    grupos = {}
+    for linha in linhas:
+        data_hora = linha['data_hora']
+        chave = (linha['dispositivo_id'], data_hora.date(), data_hora.hour)
+        grupo = grupos.get(chave)
+        if grupo is None:
+            grupo = grupos[chave] = {
+                'dispositivo_id': chave[0], 'data': chave[1], 'hora': chave[2],
+                'leituras': 0, 'alertas': 0,
+                'distancia_min': None, 'distancia_max': None, 'distancia_soma': 0.0
+            }
+        grupo['leituras'] += 1
+        grupo['alertas'] += bool(linha['alerta'])
+        distancia = linha['distancia_cm']
+        if distancia is not None:
+            grupo['distancia_soma'] += distancia
+            if grupo['distancia_min'] is None or distancia < grupo['distancia_min']:
+                grupo['distancia_min'] = distancia
+            if grupo['distancia_max'] is None or distancia > grupo['distancia_max']:
+                grupo['distancia_max'] = distancia
+    
+    for dia in sorted({chave[1] for chave in grupos}):
+        travar_dia_resumo(dia)
+    
+    stmt = pg_insert(ResumoHora).values([grupos[chave] for chave in sorted(grupos)])
+    tabela = ResumoHora.__table__
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['dispositivo_id', 'data', 'hora'],
+        set_={
+            'leituras': tabela.c.leituras + stmt.excluded.leituras,
+            'alertas': tabela.c.alertas + stmt.excluded.alertas,
+            'distancia_min': func.least(tabela.c.distancia_min, stmt.excluded.distancia_min),
+            'distancia_max': func.greatest(tabela.c.distancia_max, stmt.excluded.distancia_max),
+            'distancia_soma': tabela.c.distancia_soma + stmt.excluded.distancia_soma
+        }
+    )
+    db.session.execute(stmt)
+
+# --- Notificação dos dashboards ---
+# As leituras de cada room são coalescidas e enviadas no evento 'leituras'
+# no máximo EMISSOES_POR_SEGUNDO vezes por segundo (formato em difusao.py).
+# Com EMISSOES_POR_SEGUNDO=0 cada leitura sai na hora, em uma mensagem própria.
+EMISSOES_POR_SEGUNDO = float(os.environ.get('EMISSOES_POR_SEGUNDO', '2'))
+
+difusor = DifusorLeituras()
+
+def notificar_leituras(linhas):
+    """Agenda a notificação das rooms, na ordem cronológica das leituras"""
+    for linha in sorted(linhas, key=lambda l: l['data_hora']):
+        if EMISSOES_POR_SEGUNDO > 0:
+            difusor.registrar(linha['dispositivo_id'], linha['data_hora'],
+                              linha['distancia_cm'], linha['alerta'])
+        else:
+            socketio.emit('leituras', mensagem_unica(
+                linha['data_hora'], linha['distancia_cm'], linha['alerta']
+            ), room=linha['dispositivo_id'])
+            metricas.EMISSOES.labels('leituras').inc()
+
+def tarefa_difusao():
+    """Envia o que cada room acumulou desde o último ciclo"""
+    while True:
+        socketio.sleep(1 / EMISSOES_POR_SEGUNDO)
+        inicio = time.perf_counter()
+        try:
+            mensagens = difusor.coletar()
+            for room, mensagem in mensagens.items():
+                socketio.emit('leituras', mensagem, room=room)
+            metricas.EMISSOES.labels('leituras').inc(len(mensagens))
+            metricas.ROOMS_POR_CICLO.observe(len(mensagens))
+            metricas.CICLO_DIFUSAO.observe(time.perf_counter() - inicio)
+        except Exception as e:
+            print(f"Erro na difusão das leituras: {e}")
+
+if EMISSOES_POR_SEGUNDO > 0:
+    socketio.start_background_task(tarefa_difusao)
+
+# --- Vivacidade dos sensores ---
+# Um dispositivo sem leituras por SENSOR_TIMEOUT segundos fica offline: a room
+# recebe 'sensor_offline' e uma interrupção é aberta; na próxima leitura sai
+# 'sensor_online' e a interrupção é fechada. O padrão (90 s) tolera dois
+# heartbeats perdidos do emissor (30 s). A ingestão só atualiza o último
+# instante visto em memória; uma tarefa verifica os prazos a cada segundo
+# (heap único em vivacidade.py) e faz as gravações e emissões.
+# O monitor é de cada processo: se o balanceador mudar o emissor de instância,
+# a interrupção aberta pela antiga é fechada pela nova (na primeira leitura que
+# ela vê e, para as abertas depois disso, a cada SENSOR_TIMEOUT segundos).
+SENSOR_TIMEOUT = int(os.environ.get('SENSOR_TIMEOUT', '90'))  # segundos; 0 desliga
+VIVACIDADE_INTERVALO = 1  # segundos entre verificações
+
+monitor_vivacidade = MonitorVivacidade(timeout=SENSOR_TIMEOUT)
+
+def instante_local(epoch):
+    """Epoch -> data/hora de Brasília sem fuso (como data_hora das leituras)"""
+    return datetime.fromtimestamp(epoch, BRAZIL_TZ).replace(tzinfo=None)
+
+def interrupcoes_abertas(origens):
+    """(dispositivo, início) das interrupções abertas das origens"""
+    return db.session.query(Interrupcao.dispositivo_id, Interrupcao.inicio).filter(
+        Interrupcao.fim.is_(None), Interrupcao.dispositivo_id.in_(origens)
+    ).all()
+
+def registrar_vivacidade(linhas):
+    """Renova o prazo dos dispositivos das leituras gravadas"""
+    if SENSOR_TIMEOUT > 0:
+        agora = time.time()
+        origens = {linha['dispositivo_id'] for linha in linhas}
+        novas = monitor_vivacidade.desconhecidos(origens)
+        if novas:
+            # Primeira leitura neste processo: retoma a interrupção aberta (por
+            # outra instância ou antes do reinício), fechada no próximo ciclo
+            try:
+                for origem, inicio in interrupcoes_abertas(novas):
+                    monitor_vivacidade.marcar_offline(origem, inicio.replace(tzinfo=BRAZIL_TZ).timestamp())
+            except Exception as e:
+                print(f"Erro ao consultar interrupções abertas: {e}")
+        for origem in origens:
+            monitor_vivacidade.registrar(origem, agora)
+
+proxima_reconciliacao = [0.0]
+
+def reconciliar_vivacidade(voltaram):
+    """
+    Interrupções abertas por outra instância de dispositivos que este processo
+    vê online (o emissor mudou de instância depois da primeira leitura vista
+    aqui), como (origem, offline desde, visto em); no máximo a cada SENSOR_TIMEOUT s.
+    """
+    agora = time.monotonic()
+    if agora < proxima_reconciliacao[0]:
+        return []
+    proxima_reconciliacao[0] = agora + SENSOR_TIMEOUT
+    online = monitor_vivacidade.online()
+    for origem, _desde, _visto in voltaram:
+        online.pop(origem, None)
+    if not online:
+        return []
+    with app.app_context():
+        abertas = interrupcoes_abertas(list(online))
+        db.session.rollback()
+    return [(origem, inicio, instante_local(online[origem])) for origem, inicio in abertas
+            if instante_local(online[origem]) > inicio]
+
+def payload_interrupcao(inicio, fim):
+    return {
+        'inicio': inicio.isoformat(),
+        'fim': fim.isoformat() if fim else None,
+        'duracao_s': (fim - inicio).total_seconds() if fim else None
+    }
+
+def ciclo_vivacidade():
+    """Grava e notifica as transições online/offline desde o último ciclo"""
+    caidos, voltaram = monitor_vivacidade.coletar()
+    online, offline = monitor_vivacidade.contagem()
+    metricas.SENSORES_ONLINE.set(online)
+    metricas.SENSORES_OFFLINE.set(offline)
+    
+    caidos = [(origem, instante_local(ultimo)) for origem, ultimo in caidos]
+    voltaram = [(origem, instante_local(desde), instante_local(visto))
+                for origem, desde, visto in voltaram]
+    voltaram += reconciliar_vivacidade(voltaram)
+    if not caidos and not voltaram:
+        return
+    with app.app_context():
+        for origem, inicio in caidos:
+            db.session.execute(pg_insert(Interrupcao).values(
+                dispositivo_id=origem, inicio=inicio
+            ).on_conflict_do_nothing())
+        for origem, _desde, fim in voltaram:
+            db.session.execute(update(Interrupcao).where(
+                Interrupcao.dispositivo_id == origem,
+                Interrupcao.fim.is_(None)
+            ).values(
+                fim=fim,
+                duracao_s=func.extract('epoch', fim - Interrupcao.inicio)
+            ))
+        db.session.commit()
+    
+    for origem, inicio in caidos:
+        socketio.emit('sensor_offline', dict(payload_interrupcao(inicio, None),
+                                             timeout_s=SENSOR_TIMEOUT), room=origem)
+    for origem, desde, fim in voltaram:
+        socketio.emit('sensor_online', payload_interrupcao(desde, fim), room=origem)
+    metricas.EMISSOES.labels('sensor_offline').inc(len(caidos))
+    metricas.EMISSOES.labels('sensor_online').inc(len(voltaram))
+
+def tarefa_vivacidade():
+    while True:
+        socketio.sleep(VIVACIDADE_INTERVALO)
+        try:
+            ciclo_vivacidade()
+        except Exception as e:
+            print(f"Erro na verificação de vivacidade dos sensores: {e}")
+
+if SENSOR_TIMEOUT > 0:
+    # Interrupções abertas antes do reinício continuam abertas até a próxima leitura
+    with app.app_context():
+        for origem, inicio in db.session.query(Interrupcao.dispositivo_id, Interrupcao.inicio).filter(
+            Interrupcao.fim.is_(None)
+        ):
+            monitor_vivacidade.marcar_offline(origem, inicio.replace(tzinfo=BRAZIL_TZ).timestamp())
+    socketio.start_background_task(tarefa_vivacidade)
+
+def commit_medido(caminho, inicio_transacao):
+    """COMMIT com as métricas de duração do commit e da transação inteira"""
+    inicio = time.perf_counter()
+    db.session.commit()
+    fim = time.perf_counter()
+    metricas.COMMIT.labels(caminho).observe(fim - inicio)
+    metricas.TRANSACAO.labels(caminho).observe(fim - inicio_transacao)
+
+def gravar_leituras(linhas, caminho='lote'):
+    """
+    Grava as leituras com um único INSERT multi-linha em uma única transação
+    e notifica cada room (dispositivo) na ordem cronológica das leituras.
+    O reenvio é at-least-once (spool do emissor): leituras já gravadas (mesmo
+    dispositivo e data_hora) são ignoradas pelo ON CONFLICT, e agregado,
+    episódios, cache e notificações usam só as inseridas. Retorna quantas
+    foram inseridas.
+    """
+    inicio = time.perf_counter()
+    inseridas = set(db.session.execute(
+        pg_insert(Leitura.__table__).on_conflict_do_nothing()
+        .returning(Leitura.dispositivo_id, Leitura.data_hora),
+        linhas
+    ).all())
+    metricas.LEITURAS.labels('duplicada').inc(len(linhas) - len(inseridas))
+    if not inseridas:
+        db.session.rollback()
+        return 0
+    # Repetidas dentro do próprio lote: fica a primeira, como no INSERT
+    novas = []
+    for linha in linhas:
+        chave = (linha['dispositivo_id'], linha['data_hora'])
+        if chave in inseridas:
+            inseridas.remove(chave)
+            novas.append(linha)
+    
+    atualizar_resumo(novas)
+    transicoes, estados = processar_episodios(novas)
+    commit_medido(caminho, inicio)
+    detector_episodios.publicar(estados)
+    metricas.LEITURAS.labels('gravada').inc(len(novas))
+    metricas.LEITURAS_POR_COMMIT.observe(len(novas))
+    atualizar_cache(novas, transicoes)
+    registrar_vivacidade(novas)
+    notificar_episodios(transicoes)
+    notificar_leituras(novas)
+    return len(novas)
+
+# --- Ingestão assíncrona (write-behind) ---
+# Com INGESTAO_ASSINCRONA=1 o /api/enviar apenas valida e enfileira a leitura
+# (HTTP 202). Uma tarefa em segundo plano grava a fila em grupo (group commit)
+# ao juntar FLUSH_MAX_LEITURAS leituras ou a cada FLUSH_INTERVALO segundos.
+# Com o banco fora do ar o grupo espera (e a fila cheia devolve 503); um grupo
+# que falha por outro motivo FLUSH_TENTATIVAS vezes seguidas é gravado leitura
+# a leitura, e só as que o banco recusa são descartadas (com registro no log).
+INGESTAO_ASSINCRONA = os.environ.get('INGESTAO_ASSINCRONA', '0') == '1'
+FILA_MAX = int(os.environ.get('FILA_MAX', '10000'))
+FLUSH_MAX_LEITURAS = int(os.environ.get('FLUSH_MAX_LEITURAS', '500'))
+FLUSH_INTERVALO = float(os.environ.get('FLUSH_INTERVALO', '0.2'))  # segundos
+FLUSH_TENTATIVAS = int(os.environ.get('FLUSH_TENTATIVAS', '3'))
+RETRY_AFTER = 1  # segundos sugeridos ao cliente quando a fila está cheia
+
+fila_ingestao = queue.Queue(maxsize=FILA_MAX)
+pendentes_escritor = []  # já retiradas da fila e ainda não gravadas
+lock_escritor = threading.Lock()  # o escritor e o encerramento não gravam ao mesmo tempo
+metricas.PROFUNDIDADE_FILA.set_function(fila_ingestao.qsize)
+lock_metricas = threading.Lock()
+metricas_ingestao = {
+    'leituras_enfileiradas': 0,
+    'leituras_gravadas': 0,
+    'rejeitadas_fila_cheia': 0,
+    'rejeitadas_banco_indisponivel': 0,
+    'descartadas': 0,
+    'duplicadas': 0,
+    'flushes': 0,
+    'falhas_flush': 0,
+    'ultimo_flush_tamanho': 0,
+    'ultimo_flush_ms': 0.0,
+    'max_flush_ms': 0.0,
+    'soma_flush_ms': 0.0
+}
+
+def flush_fila(pendentes):
+    """Grava um grupo de leituras da fila e atualiza as métricas"""
+    inicio = time.perf_counter()
+    with app.app_context():
+        try:
+            gravadas = gravar_leituras(pendentes)
+        except Exception:
+            db.session.rollback()
+            with lock_metricas:
+                metricas_ingestao['falhas_flush'] += 1
+            raise
+    duracao_ms = (time.perf_counter() - inicio) * 1000
+    
+    with lock_metricas:
+        metricas_ingestao['flushes'] += 1
+        metricas_ingestao['leituras_gravadas'] += gravadas
+        metricas_ingestao['duplicadas'] += len(pendentes) - gravadas
+        metricas_ingestao['ultimo_flush_tamanho'] = len(pendentes)
+        metricas_ingestao['ultimo_flush_ms'] = duracao_ms
+        metricas_ingestao['soma_flush_ms'] += duracao_ms
+        metricas_ingestao['max_flush_ms'] = max(metricas_ingestao['max_flush_ms'], duracao_ms)
+
+def descartar_leitura(linha, erro):
+    with lock_metricas:
+        metricas_ingestao['descartadas'] += 1
+    metricas.LEITURAS.labels('descartada').inc()
+    print(f"Leitura descartada: {json.dumps(linha, default=str)} ({erro})")
+
+def gravar_isoladas(linhas):
+    """
+    Grava leitura a leitura e descarta as que falham. Retorna as que ficaram
+    sem gravar porque o banco caiu no meio (para tentar de novo depois).
+    """
+    for i, linha in enumerate(linhas):
+        try:
+            flush_fila([linha])
+        except OperationalError:
+            return linhas[i:]
+        except Exception as e:
+            descartar_leitura(linha, e)
+    return []
+
+def escritor_ingestao():
+    """Consome a fila e grava em grupo, por tamanho ou por tempo"""
+    tentativas = 0
+    while True:
+        prazo = time.monotonic() + FLUSH_INTERVALO
+        while len(pendentes_escritor) < FLUSH_MAX_LEITURAS:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                linha = fila_ingestao.get(timeout=restante)
+            except queue.Empty:
+                break
+            with lock_escritor:
+                pendentes_escritor.append(linha)
+        
+        with lock_escritor:
+            if not pendentes_escritor:
+                continue
+            try:
+                flush_fila(pendentes_escritor)
+                pendentes_escritor.clear()
+                tentativas = 0
+                continue
+            except OperationalError as e:
+                print(f"Banco indisponível; {len(pendentes_escritor)} leituras aguardam: {e}")
+            except Exception as e:
+                tentativas += 1
+                print(f"Erro ao gravar {len(pendentes_escritor)} leituras da fila "
+                      f"(tentativa {tentativas} de {FLUSH_TENTATIVAS}): {e}")
+                if tentativas >= FLUSH_TENTATIVAS:
+                    # Uma leitura recusada pelo banco não pode travar a fila inteira
+                    pendentes_escritor[:] = gravar_isoladas(pendentes_escritor)
+                    tentativas = 0
+        time.sleep(RETRY_AFTER)
+
+def drenar_fila_ingestao():
+    """Ao encerrar o processo, grava o grupo em mãos do escritor e o que restou na fila"""
+    with lock_escritor:
+        while True:
+            try:
+                pendentes_escritor.append(fila_ingestao.get_nowait())
+            except queue.Empty:
+                break
+        if not pendentes_escritor:
+            return
+        try:
+            flush_fila(pendentes_escritor)
+        except Exception as e:
+            print(f"Erro ao gravar {len(pendentes_escritor)} leituras no encerramento: {e}")
+            for linha in gravar_isoladas(pendentes_escritor):
+                descartar_leitura(linha, 'banco indisponível no encerramento')
+        pendentes_escritor.clear()
+
+if INGESTAO_ASSINCRONA:
+    socketio.start_background_task(escritor_ingestao)
+    atexit.register(drenar_fila_ingestao)
+
 @app.route('/api/enviar', methods=['POST'])
 def receber_dados():
-    dados = request.json
+    """Uma leitura (JSON ou MessagePack): validada e gravada (ou enfileirada) como no lote"""
     ip_cliente = get_client_ip()
+    binario = corpo_binario()
+    if binario and msgpack is None:
+        return formato_nao_suportado()
+    try:
+        linha = validar_leitura_binaria(ler_msgpack()) if binario else validar_leitura(request.json)
+        atribuir_dispositivo(linha, ip_cliente)
+    except ValueError as e:
+        metricas.LEITURAS.labels('rejeitada').inc()
+        return jsonify({"status": "erro", "mensagem": str(e)}), 400
+    except PermissionError as e:
+        metricas.LEITURAS.labels('rejeitada').inc()
+        return jsonify({"status": "erro", "mensagem": str(e)}), 403
+    except OperationalError as e:
+        return banco_indisponivel(1, e)
     
-    # Parse data_hora string to datetime
-    data_hora_str = dados.get('data_hora')
-    if data_hora_str:
+    if INGESTAO_ASSINCRONA:
+        return enfileirar_linha(linha, ip_cliente)
+    # Notifica apenas clientes da mesma origem (room = id do dispositivo)
+    duplicada = gravar_leituras([linha], 'unitaria') == 0
+    return jsonify({"status": "sucesso", "ip_registrado": ip_cliente, "duplicada": duplicada}), 201
+
+def atribuir_dispositivo(linha, ip_cliente):
+    """Troca o código 'dispositivo' da linha validada pelo id do cadastro (dispositivo_id)"""
+    linha['dispositivo_id'] = resolver_dispositivo(linha.pop('dispositivo'), ip_cliente,
+                                                   request.headers.get('X-API-Key'))
+
+def banco_indisponivel(quantidade, erro):
+    """
+    503 para leituras de dispositivo que não está no cadastro em memória
+    enquanto o banco não responde: o cliente deve reenviar depois
+    """
+    db.session.rollback()
+    with lock_metricas:
+        metricas_ingestao['rejeitadas_banco_indisponivel'] += quantidade
+    metricas.LEITURAS.labels('banco_indisponivel').inc(quantidade)
+    print(f"Banco indisponível ao resolver o dispositivo: {erro}")
+    resposta = jsonify({"status": "erro", "mensagem": "banco de dados indisponível"})
+    resposta.headers['Retry-After'] = str(RETRY_AFTER)
+    return resposta, 503
+
+def enfileirar_linha(linha, ip_cliente):
+    """Coloca a leitura validada na fila de gravação (modo write-behind)"""
+    try:
+        fila_ingestao.put_nowait(linha)
+    except queue.Full:
+        # Back-pressure: o cliente deve reenviar depois
+        with lock_metricas:
+            metricas_ingestao['rejeitadas_fila_cheia'] += 1
+        metricas.LEITURAS.labels('fila_cheia').inc()
+        resposta = jsonify({"status": "erro", "mensagem": "fila de ingestão cheia"})
+        resposta.headers['Retry-After'] = str(RETRY_AFTER)
+        return resposta, 503
+    
+    with lock_metricas:
+        metricas_ingestao['leituras_enfileiradas'] += 1
+    metricas.LEITURAS.labels('enfileirada').inc()
+    return jsonify({"status": "enfileirado", "ip_registrado": ip_cliente}), 202
+
+@app.route('/api/ingestao/metricas')
+def metricas_fila():
+    with lock_metricas:
+        valores = dict(metricas_ingestao)
+    flushes = valores.pop('flushes')
+    soma_flush_ms = valores.pop('soma_flush_ms')
+    valores.update({
+        'modo': 'assincrono' if INGESTAO_ASSINCRONA else 'sincrono',
+        'profundidade_fila': fila_ingestao.qsize(),
+        'capacidade_fila': FILA_MAX,
+        'flushes': flushes,
+        'media_flush_ms': soma_flush_ms / flushes if flushes else 0.0
+    })
+    return jsonify(valores)
+
+# Limite de leituras aceitas em uma única requisição de lote
+MAX_LOTE = 100000
+
+def ler_itens_lote():
+    """Lê o corpo do lote: array JSON, NDJSON (uma leitura por linha) ou MessagePack"""
+    if corpo_binario():
         try:
-            data_hora = datetime.fromisoformat(data_hora_str)
+            dados = ler_msgpack()
         except ValueError:
-            data_hora = datetime.now()
-    else:
-        data_hora = datetime.now()
+            return None
+        return dados if isinstance(dados, list) else None
+    
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        itens = []
+        for linha in request.stream:
+            linha = linha.strip()
+            if not linha:
+                continue
+            try:
+                itens.append(json.loads(linha))
+            except ValueError:
+                # Mantém a posição do item para o relatório de validação
+                itens.append(None)
+        return itens
+    
+    dados = request.get_json(silent=True)
+    if isinstance(dados, dict):
+        dados = dados.get('leituras')
+    if not isinstance(dados, list):
+        return None
+    return dados
+
+@app.route('/api/enviar-lote', methods=['POST'])
+def receber_lote():
+    ip_cliente = get_client_ip()
+    if corpo_binario() and msgpack is None:
+        return formato_nao_suportado()
+    itens = ler_itens_lote()
+    if itens is None:
+        return jsonify({"status": "erro",
+                        "mensagem": "corpo deve ser um array JSON, NDJSON ou MessagePack"}), 400
+    if len(itens) > MAX_LOTE:
+        return jsonify({"status": "erro", "mensagem": f"lote maior que {MAX_LOTE} leituras"}), 413
+    
+    # Resultado por item: só os rejeitados são listados (índice + motivo)
+    validar = validar_leitura_binaria if corpo_binario() else validar_leitura
+    linhas = []
+    erros = []
+    for indice, item in enumerate(itens):
+        try:
+            linha = validar(item)
+            atribuir_dispositivo(linha, ip_cliente)
+        except (ValueError, PermissionError) as e:
+            erros.append({'indice': indice, 'erro': str(e)})
+            continue
+        except OperationalError as e:
+            # Nada foi gravado ainda: o cliente reenvia o lote inteiro
+            return banco_indisponivel(len(itens), e)
+        linhas.append(linha)
+    metricas.LEITURAS.labels('rejeitada').inc(len(erros))
     
-    # Aceita tanto 'distancia_cm' quanto 'distancia'
-    distancia = dados.get('distancia_cm') or dados.get('distancia')
+    if not linhas:
+        return jsonify({
+            "status": "erro",
+            "ip_registrado": ip_cliente,
+            "inseridos": 0,
+            "rejeitados": len(erros),
+            "erros": erros
+        }), 400
     
-    nova_leitura = Leitura(
-        distancia_cm=distancia,
-        alerta=dados.get('alerta', False),
-        data_hora=data_hora,
-        ip_origem=ip_cliente
+    inseridos = gravar_leituras(linhas)
+    
+    return jsonify({
+        "status": "sucesso",
+        "ip_registrado": ip_cliente,
+        "inseridos": inseridos,
+        "duplicados": len(linhas) - inseridos,
+        "rejeitados": len(erros),
+        "erros": erros
+    }), 201
+
+def intervalo_dia(dia):
+    """Intervalo semiaberto [início do dia, início do dia seguinte)"""
+    inicio = datetime.combine(dia, datetime.min.time())
+    return inicio, inicio + timedelta(days=1)
+
+def consulta_leituras_dia(origem, dia, desde_id=None, desde_hora=None):
+    """Leituras do dia (só as colunas do gráfico), opcionalmente após um cursor"""
+    inicio, fim = intervalo_dia(dia)
+    if desde_hora is not None:
+        inicio = max(inicio, desde_hora + timedelta(microseconds=1))
+    consulta = db.session.query(
+        Leitura.id, Leitura.distancia_cm, Leitura.alerta, Leitura.data_hora
+    ).filter(
+        Leitura.dispositivo_id == origem,
+        Leitura.data_hora >= inicio,
+        Leitura.data_hora < fim
     )
-    db.session.add(nova_leitura)
-    db.session.commit()
+    if desde_id is not None:
+        consulta = consulta.filter(Leitura.id > desde_id)
+    return consulta.order_by(Leitura.data_hora.asc())
+
+def reduzir_pontos(leituras, max_pontos):
+    """
+    Reduz a série para no máximo max_pontos mantendo o formato do gráfico:
+    divide em baldes consecutivos e guarda de cada um a menor e a maior distância
+    e a primeira leitura de alerta, na ordem original. Alertas nunca somem, ao
+    contrário de min/max puro ou LTTB (a faixa de alerta fica entre os extremos).
+    A última leitura é sempre mantida, pois define o status atual do dashboard.
+    """
+    if max_pontos is None or len(leituras) <= max_pontos:
+        return leituras
+    
+    ultima = leituras[-1]
+    leituras = leituras[:-1]
+    baldes = max(1, (max_pontos - 1) // 3)
+    tamanho = len(leituras) / baldes
+    reduzidas = []
+    for b in range(baldes):
+        balde = leituras[int(b * tamanho):int((b + 1) * tamanho)]
+        if not balde:
+            continue
+        com_distancia = [l for l in balde if l.distancia_cm is not None] or balde
+        escolhidas = {
+            min(com_distancia, key=lambda l: l.distancia_cm or 0).id,
+            max(com_distancia, key=lambda l: l.distancia_cm or 0).id
+        }
+        alerta = next((l for l in balde if l.alerta), None)
+        if alerta is not None:
+            escolhidas.add(alerta.id)
+        reduzidas.extend(l for l in balde if l.id in escolhidas)
+    reduzidas.append(ultima)
+    return reduzidas
+
+def consulta_alertas_por_hora(origem, dia):
+    return ResumoHora.query.filter(
+        ResumoHora.dispositivo_id == origem,
+        ResumoHora.data == dia
+    ).order_by(ResumoHora.hora)
+
+def consulta_episodios_dia(origem, dia):
+    inicio, fim = intervalo_dia(dia)
+    return Episodio.query.filter(
+        Episodio.dispositivo_id == origem,
+        Episodio.inicio >= inicio,
+        Episodio.inicio < fim
+    ).order_by(Episodio.inicio)
+
+def consulta_datas_disponiveis(origem):
+    return db.session.query(ResumoHora.data).filter(
+        ResumoHora.dispositivo_id == origem
+    ).distinct().order_by(ResumoHora.data.desc())
+
+# --- Cache HTTP do histórico ---
+# Toda escrita marca o instante por origem e dia no cache de leituras
+# (marcar_escritas). Esse instante é o ETag/Last-Modified das respostas de
+# histórico: o navegador revalida e recebe 304 sem consulta ao banco, e o
+# resultado já calculado fica em memória até a próxima escrita daquele dia.
+# Sem marca (reinício do processo) vale o início do processo.
+# Dias com mais de HISTORICO_DIAS_ABERTOS dias recebem max-age longo; os
+# recentes ainda recebem leituras atrasadas (reenvio do spool do emissor)
+# e são sempre revalidados.
+HISTORICO_MAX_AGE = int(os.environ.get('HISTORICO_MAX_AGE', '86400'))  # segundos
+HISTORICO_DIAS_ABERTOS = int(os.environ.get('HISTORICO_DIAS_ABERTOS', '7'))
+HISTORICO_MEMO_MAX = int(os.environ.get('HISTORICO_MEMO_MAX', '1000'))  # respostas em memória
+INICIO_PROCESSO = time.time_ns()
+
+memo_historico = OrderedDict()  # (endpoint, origem, dia) -> (versão, corpo)
+lock_memo = threading.Lock()
+
+def versao_historico(origem, dia):
+    """Instante (ns) da última escrita da origem no dia (None = todos os dias)"""
+    try:
+        versao = cache_leituras.ultima_escrita(origem, dia.isoformat() if dia else '*')
+    except Exception as e:
+        print(f"Erro ao consultar o cache de leituras: {e}")
+        return None
+    return versao or INICIO_PROCESSO
+
+def resposta_historico(origem, dia, calcular):
+    """
+    Resposta JSON de histórico com ETag/Last-Modified: 304 quando o cliente já
+    tem a versão atual; senão reaproveita o corpo memorizado ou chama calcular().
+    """
+    hoje = datetime.now(BRAZIL_TZ).date()
+    versao = versao_historico(origem, dia)
+    chave = (request.endpoint, origem, dia)
+    
+    resposta = app.response_class(mimetype='application/json')
+    resposta.cache_control.private = True  # resposta depende do dispositivo acompanhado
+    if dia is not None and dia < hoje - timedelta(days=HISTORICO_DIAS_ABERTOS):
+        resposta.cache_control.max_age = HISTORICO_MAX_AGE
+    else:
+        resposta.cache_control.no_cache = True
+    if versao is None:
+        resposta.set_data(json.dumps(calcular()))
+        return resposta
     
-    # Notifica apenas clientes do mesmo IP (room = IP)
-    socketio.emit('nova_leitura', {
-        'distancia_cm': nova_leitura.distancia_cm,
-        'alerta': nova_leitura.alerta,
-        'data_hora': nova_leitura.data_hora.strftime("%H:%M:%S")
-    }, room=ip_cliente)
+    etag = f"{versao:x}"
+    ultima_modificacao = datetime.fromtimestamp(versao / 1e9, timezone.utc).replace(microsecond=0)
+    resposta.set_etag(etag)
+    resposta.last_modified = ultima_modificacao
+    if not is_resource_modified(request.environ, etag=etag, last_modified=ultima_modificacao):
+        resposta.status_code = 304
+        return resposta
     
-    return jsonify({"status": "sucesso", "ip_registrado": ip_cliente}), 201
+    with lock_memo:
+        memorizada = memo_historico.get(chave)
+        if memorizada is not None:
+            memo_historico.move_to_end(chave)
+    if memorizada is not None and memorizada[0] == versao:
+        corpo = memorizada[1]
+    else:
+        corpo = json.dumps(calcular()).encode()
+        with lock_memo:
+            memo_historico[chave] = (versao, corpo)
+            memo_historico.move_to_end(chave)
+            if len(memo_historico) > HISTORICO_MEMO_MAX:
+                memo_historico.popitem(last=False)
+    resposta.set_data(corpo)
+    return resposta
+
+CURSOR_SOBREPOSICAO = 30  # segundos relidos a cada polling do dashboard
 
 @app.route('/api/leituras-hoje')
 def leituras_hoje():
     # Usa timezone do Brasil para determinar "hoje"
     agora_brasil = datetime.now(BRAZIL_TZ)
     hoje = agora_brasil.date()
-    ip_visualizador = get_client_ip()
+    origem = get_origem()
+    
+    # Cursor opcional: ?since=<data/hora ISO> (ou id) devolve só as leituras novas.
+    # O id não serve de cursor com gravações concorrentes: é reservado antes do
+    # commit, e um id menor pode ficar visível depois de um maior.
+    desde_id = desde_hora = None
+    since = request.args.get('since')
+    if since:
+        try:
+            desde_id = int(since)
+        except ValueError:
+            try:
+                desde_hora = data_hora_local(ler_data_hora(since))
+            except (ValueError, OverflowError):
+                return jsonify({"status": "erro", "mensagem": "since deve ser um id ou data/hora ISO"}), 400
+    
+    max_pontos = request.args.get('max_points', type=int)
+    if max_pontos is not None and max_pontos < 3:
+        return jsonify({"status": "erro", "mensagem": "max_points deve ser pelo menos 3"}), 400
     
-    # Filtra apenas leituras do mesmo IP (mesma casa/rede)
-    leituras = Leitura.query.filter(
-        func.date(Leitura.data_hora) == hoje,
-        Leitura.ip_origem == ip_visualizador
-    ).order_by(Leitura.data_hora.asc()).all()
+    # Filtra apenas leituras do dispositivo acompanhado
+    leituras = consulta_leituras_dia(origem, hoje, desde_id, desde_hora).all()
+    # Próximo cursor (X-Cursor): relê os últimos CURSOR_SOBREPOSICAO segundos, para
+    # pegar commits fora de ordem; o cliente ignora os ids que já tem
+    cursor = None
+    if leituras:
+        cursor = leituras[-1].data_hora - timedelta(seconds=CURSOR_SOBREPOSICAO)
+        if desde_hora is not None:
+            cursor = max(cursor, desde_hora)
+    elif desde_hora is not None:
+        cursor = desde_hora
+    leituras = reduzir_pontos(leituras, max_pontos)
     
-    return jsonify([{
+    resposta = jsonify([{
+        'id': l.id,
         'distancia_cm': l.distancia_cm,
         'alerta': l.alerta,
         'data_hora': l.data_hora.strftime("%H:%M:%S")
     } for l in leituras])
+    if cursor is not None:
+        resposta.headers['X-Cursor'] = cursor.isoformat(timespec='microseconds')
+    return resposta
 
 @app.route('/api/alertas-por-hora')
 def alertas_por_hora():
@@ -109,537 +1545,1028 @@ def alertas_por_hora():
         # Usa timezone do Brasil como padrão
         data_filtro = datetime.now(BRAZIL_TZ).date()
     
-    ip_visualizador = get_client_ip()
-    
-    # Agrupa alertas por hora (filtrando por IP)
-    resultado = db.session.query(
-        func.extract('hour', Leitura.data_hora).label('hora'),
-        func.count(Leitura.id).label('total_alertas')
-    ).filter(
-        func.date(Leitura.data_hora) == data_filtro,
-        Leitura.alerta == True,
-        Leitura.ip_origem == ip_visualizador
-    ).group_by(
-        func.extract('hour', Leitura.data_hora)
-    ).order_by('hora').all()
+    origem = get_origem()
+    return resposta_historico(origem, data_filtro,
+                              lambda: calcular_alertas_por_hora(origem, data_filtro))
+
+def calcular_alertas_por_hora(origem, data_filtro):
+    # Alertas por hora vêm do agregado (no máximo 24 linhas por dispositivo e dia)
+    resumo = {r.hora: r for r in consulta_alertas_por_hora(origem, data_filtro)}
+    episodios = [0] * 24
+    for e in consulta_episodios_dia(origem, data_filtro):
+        episodios[e.inicio.hour] += 1
     
     # Formata resposta com todas as 24 horas
-    alertas_por_hora = {int(r.hora): r.total_alertas for r in resultado}
-    dados = [{'hora': h, 'alertas': alertas_por_hora.get(h, 0)} for h in range(24)]
+    dados = []
+    for h in range(24):
+        r = resumo.get(h)
+        dados.append({
+            'hora': h,
+            'alertas': r.alertas if r else 0,
+            'episodios': episodios[h],
+            'leituras': r.leituras if r else 0,
+            'distancia_min': r.distancia_min if r else None,
+            'distancia_media': r.distancia_soma / r.leituras if r and r.leituras else None,
+            'distancia_max': r.distancia_max if r else None
+        })
     
-    return jsonify({
+    return {
         'data': data_filtro.strftime('%Y-%m-%d'),
         'dados': dados
+    }
+
+@app.route('/api/episodios')
+def episodios_do_dia():
+    data_str = request.args.get('data')
+    if data_str:
+        data_filtro = datetime.strptime(data_str, '%Y-%m-%d').date()
+    else:
+        data_filtro = datetime.now(BRAZIL_TZ).date()
+    
+    origem = get_origem()
+    
+    # Episódio ainda aberto vem com fim e duracao_s nulos
+    return resposta_historico(origem, data_filtro, lambda: {
+        'data': data_filtro.strftime('%Y-%m-%d'),
+        'episodios': [payload_episodio(e.inicio, e.fim, e.alertas)
+                      for e in consulta_episodios_dia(origem, data_filtro)]
+    })
+
+@app.route('/api/vivacidade')
+def vivacidade_dispositivo():
+    """Se o sensor acompanhado está offline agora (interrupção aberta) e desde quando"""
+    origem = get_origem()
+    aberta = Interrupcao.query.filter_by(dispositivo_id=origem, fim=None).first()
+    return jsonify({
+        'dispositivo_id': origem,
+        'offline': aberta is not None,
+        'offline_desde': aberta.inicio.isoformat() if aberta else None,
+        'timeout_s': SENSOR_TIMEOUT
+    })
+
+@app.route('/api/vivacidade/offline')
+def dispositivos_offline():
+    """Todos os dispositivos offline agora, do silêncio mais antigo ao mais recente"""
+    exigir_painel()
+    abertas = db.session.query(Interrupcao.inicio, Dispositivo.codigo, Leito.nome).join(
+        Dispositivo, Dispositivo.id == Interrupcao.dispositivo_id
+    ).outerjoin(Leito, Leito.id == Dispositivo.leito_id).filter(
+        Interrupcao.fim.is_(None)
+    ).order_by(Interrupcao.inicio)
+    return jsonify([{'dispositivo': codigo, 'leito': leito, 'offline_desde': inicio.isoformat()}
+                    for inicio, codigo, leito in abertas])
+
+@app.route('/api/interrupcoes')
+def interrupcoes():
+    """Interrupções do sensor que tocam o período (?de=&ate=, padrão: hoje); a aberta vem sem fim"""
+    hoje = datetime.now(BRAZIL_TZ).date().isoformat()
+    try:
+        inicio, fim = periodo_exportacao(request.args.get('de', hoje), request.args.get('ate', hoje))
+    except ValueError:
+        return jsonify({"status": "erro", "mensagem": "de e ate devem ser AAAA-MM-DD, com ate >= de"}), 400
+    
+    origem = get_origem()
+    registros = Interrupcao.query.filter(
+        Interrupcao.dispositivo_id == origem,
+        Interrupcao.inicio < fim,
+        db.or_(Interrupcao.fim.is_(None), Interrupcao.fim >= inicio)
+    ).order_by(Interrupcao.inicio)
+    return jsonify({
+        'de': inicio.date().isoformat(),
+        'ate': (fim - timedelta(days=1)).date().isoformat(),
+        'interrupcoes': [payload_interrupcao(i.inicio, i.fim) for i in registros]
     })
 
 @app.route('/api/datas-disponiveis')
 def datas_disponiveis():
-    ip_visualizador = get_client_ip()
+    origem = get_origem()
     
-    # Retorna apenas datas que têm dados do mesmo IP
-    datas = db.session.query(
-        func.date(Leitura.data_hora).label('data')
-    ).filter(
-        Leitura.ip_origem == ip_visualizador
-    ).distinct().order_by(func.date(Leitura.data_hora).desc()).all()
+    # Retorna apenas datas que têm dados do dispositivo
+    return resposta_historico(origem, None, lambda: [
+        d.data.strftime('%Y-%m-%d') for d in consulta_datas_disponiveis(origem)
+    ])
+
+# --- Resumo de um período ---
+# Relatórios semanais/mensais em uma única requisição: o agregado por hora
+# (resumo_hora) e os episódios são agrupados em baldes de hora, dia ou semana
+# no próprio Postgres, em uma consulta só, sem tocar nas leituras brutas. O
+# resultado sai em stream (cursor no servidor), então um ano de baldes por
+# hora não fica inteiro em memória. Baldes sem dados são omitidos.
+NOITE_INICIO = int(os.environ.get('NOITE_INICIO', '22'))  # hora em que a noite começa
+NOITE_FIM = int(os.environ.get('NOITE_FIM', '6'))  # hora em que a noite termina (exclusiva)
+INTERVALOS_RESUMO = {'hora': 'hour', 'dia': 'day', 'semana': 'week'}
+
+SQL_RESUMO_PERIODO = """
+WITH r AS (
+    SELECT date_trunc(:unidade, data + make_interval(hours => hora)) AS balde,
+           sum(leituras) AS leituras,
+           sum(alertas) AS alertas,
+           sum(leituras) FILTER (WHERE {noite_hora}) AS leituras_noite,
+           sum(alertas) FILTER (WHERE {noite_hora}) AS alertas_noite,
+           min(distancia_min) AS distancia_min,
+           max(distancia_max) AS distancia_max,
+           sum(distancia_soma) / NULLIF(sum(leituras), 0) AS distancia_media
+    FROM resumo_hora
+    WHERE dispositivo_id = :origem AND data >= :de AND data <= :ate
+    GROUP BY 1
+), e AS (
+    SELECT date_trunc(:unidade, inicio) AS balde,
+           count(*) AS episodios,
+           count(*) FILTER (WHERE {noite_inicio}) AS episodios_noite,
+           sum(duracao_s) AS tempo_fora_s,
+           max(duracao_s) AS maior_episodio_s
+    FROM episodio
+    WHERE dispositivo_id = :origem AND inicio >= :inicio AND inicio < :fim
+    GROUP BY 1
+)
+SELECT * FROM r FULL JOIN e USING (balde)
+ORDER BY balde
+"""
+
+def condicao_noite(hora):
+    """Expressão SQL 'hora está na noite' (a janela pode cruzar a meia-noite)"""
+    juncao = 'OR' if NOITE_INICIO > NOITE_FIM else 'AND'
+    return f"({hora} >= :noite_inicio {juncao} {hora} < :noite_fim)"
+
+def consulta_resumo_periodo(origem, de, ate, intervalo):
+    """Linhas do resumo por balde, em ordem, lidas do cursor em partes"""
+    sql = SQL_RESUMO_PERIODO.format(noite_hora=condicao_noite('hora'),
+                                    noite_inicio=condicao_noite('extract(hour FROM inicio)'))
+    inicio, _ = intervalo_dia(de)
+    _, fim = intervalo_dia(ate)
+    return db.session.execute(text(sql), {
+        'unidade': INTERVALOS_RESUMO[intervalo], 'origem': origem, 'de': de, 'ate': ate,
+        'inicio': inicio, 'fim': fim, 'noite_inicio': NOITE_INICIO, 'noite_fim': NOITE_FIM
+    }, execution_options={'stream_results': True, 'yield_per': 500})
+
+def item_resumo(linha):
+    return {
+        'inicio': linha.balde.isoformat(),
+        'leituras': linha.leituras or 0,
+        'alertas': linha.alertas or 0,
+        'episodios': linha.episodios or 0,
+        'tempo_fora_s': linha.tempo_fora_s or 0.0,
+        'maior_episodio_s': linha.maior_episodio_s,
+        'noite': {
+            'leituras': linha.leituras_noite or 0,
+            'alertas': linha.alertas_noite or 0,
+            'episodios': linha.episodios_noite or 0
+        },
+        'distancia_min': linha.distancia_min,
+        'distancia_media': linha.distancia_media,
+        'distancia_max': linha.distancia_max
+    }
+
+@app.route('/api/resumo')
+def resumo_periodo():
+    try:
+        de = datetime.strptime(request.args['de'], '%Y-%m-%d').date()
+        ate = datetime.strptime(request.args['ate'], '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        return jsonify({"status": "erro", "mensagem": "de e ate são obrigatórios (AAAA-MM-DD)"}), 400
+    intervalo = request.args.get('intervalo', 'dia')
+    if intervalo not in INTERVALOS_RESUMO:
+        return jsonify({"status": "erro", "mensagem": "intervalo deve ser hora, dia ou semana"}), 400
+    if ate < de:
+        return jsonify({"status": "erro", "mensagem": "ate deve ser igual ou posterior a de"}), 400
+    
+    origem = get_origem()
+    
+    def gerar():
+        yield json.dumps({'de': de.isoformat(), 'ate': ate.isoformat(), 'intervalo': intervalo,
+                          'noite': [NOITE_INICIO, NOITE_FIM]})[:-1] + ', "baldes": ['
+        separador = ''
+        for linha in consulta_resumo_periodo(origem, de, ate, intervalo):
+            yield separador + json.dumps(item_resumo(linha))
+            separador = ', '
+        yield ']}'
+    
+    return app.response_class(stream_with_context(gerar()), mimetype='application/json')
+
+# --- Exportação das leituras brutas ---
+# Para auditoria: todas as leituras de uma origem em um período, em CSV ou
+# Parquet. As linhas vêm de um cursor no servidor em partes de EXPORTACAO_LOTE
+# (sem objetos ORM) e cada parte vira um lote colunar do Arrow, escrito e
+# enviado antes da próxima: a memória não cresce com o tamanho do período.
+# Sem o pacote pyarrow o CSV é escrito pelo módulo csv e o Parquet fica indisponível.
+EXPORTACAO_LOTE = 50000  # linhas por parte do cursor (e por row group no Parquet)
+COLUNAS_EXPORTACAO = ('id', 'data_hora', 'distancia_cm', 'alerta')
+TIPOS_EXPORTACAO = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+class SaidaEmPartes(io.RawIOBase):
+    """Arquivo só de escrita que acumula os bytes até a próxima retirada"""
+    
+    def __init__(self):
+        self._partes = []
+        self._posicao = 0
+    
+    def writable(self):
+        return True
+    
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        self._posicao += len(dados)
+        return len(dados)
+    
+    def tell(self):
+        return self._posicao
+    
+    def retirar(self):
+        dados = b''.join(self._partes)
+        self._partes = []
+        return dados
+
+def consulta_exportacao(origem, inicio, fim):
+    """Leituras do período em ordem, em partes de EXPORTACAO_LOTE tuplas"""
+    return db.session.execute(
+        select(Leitura.id, Leitura.data_hora, Leitura.distancia_cm, Leitura.alerta).where(
+            Leitura.dispositivo_id == origem,
+            Leitura.data_hora >= inicio,
+            Leitura.data_hora < fim
+        ).order_by(Leitura.data_hora),
+        execution_options={'stream_results': True, 'yield_per': EXPORTACAO_LOTE}
+    ).partitions()
+
+def lote_arrow(linhas, esquema):
+    """Tuplas do cursor -> RecordBatch (uma lista por coluna)"""
+    colunas = list(zip(*linhas))
+    return pyarrow.record_batch([pyarrow.array(valores, type=campo.type)
+                                 for valores, campo in zip(colunas, esquema)], schema=esquema)
+
+def gerar_exportacao(origem, inicio, fim, formato):
+    """Gera o arquivo em partes de bytes, uma por parte do cursor"""
+    partes = consulta_exportacao(origem, inicio, fim)
+    if pyarrow is None:
+        texto = io.StringIO()
+        escritor = csv.writer(texto, lineterminator='\n')
+        escritor.writerow(COLUNAS_EXPORTACAO)
+        for linhas in partes:
+            escritor.writerows(linhas)
+            yield texto.getvalue().encode()
+            texto.seek(0)
+            texto.truncate()
+        if texto.tell():
+            yield texto.getvalue().encode()
+        return
+    
+    esquema = pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('data_hora', pyarrow.timestamp('us')),
+        ('distancia_cm', pyarrow.float64()),
+        ('alerta', pyarrow.bool_())
+    ])
+    saida = SaidaEmPartes()
+    if formato == 'parquet':
+        escritor = pyarrow.parquet.ParquetWriter(saida, esquema, compression='zstd')
+    else:
+        escritor = pyarrow.csv.CSVWriter(saida, esquema)
+    for linhas in partes:
+        escritor.write_batch(lote_arrow(linhas, esquema))
+        yield saida.retirar()
+    escritor.close()
+    yield saida.retirar()
+
+def periodo_exportacao(de, ate):
+    """Datas AAAA-MM-DD (inclusivas) -> intervalo semiaberto; ValueError se inválidas"""
+    inicio, _ = intervalo_dia(datetime.strptime(de, '%Y-%m-%d').date())
+    _, fim = intervalo_dia(datetime.strptime(ate, '%Y-%m-%d').date())
+    if fim <= inicio:
+        raise ValueError('ate deve ser igual ou posterior a de')
+    return inicio, fim
+
+@app.route('/api/exportar')
+def exportar_leituras():
+    formato = request.args.get('formato', 'csv')
+    if formato not in TIPOS_EXPORTACAO:
+        return jsonify({"status": "erro", "mensagem": "formato deve ser csv ou parquet"}), 400
+    if formato == 'parquet' and pyarrow is None:
+        return jsonify({"status": "erro", "mensagem": "Parquet indisponível no servidor (pyarrow)"}), 415
+    try:
+        inicio, fim = periodo_exportacao(request.args['de'], request.args['ate'])
+    except KeyError:
+        return jsonify({"status": "erro", "mensagem": "de e ate são obrigatórios (AAAA-MM-DD)"}), 400
+    except ValueError as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 400
+    
+    origem = get_origem()
+    codigo = request.args.get('dispositivo') or get_client_ip()
+    # O código vem da query string: só caracteres seguros no nome do arquivo
+    ultimo_dia = (fim - timedelta(days=1)).date()
+    arquivo = secure_filename(f"leituras_{codigo}_{inicio.date()}_{ultimo_dia}.{formato}")
+    return app.response_class(
+        stream_with_context(gerar_exportacao(origem, inicio, fim, formato)),
+        mimetype=TIPOS_EXPORTACAO[formato],
+        headers={'Content-Disposition': f'attachment; filename="{arquivo}"'}
+    )
+
+def indices_do_plano(plano):
+    """Nomes dos índices usados em um plano EXPLAIN (FORMAT JSON)"""
+    indices = set()
+    if 'Index Name' in plano:
+        indices.add(plano['Index Name'])
+    for filho in plano.get('Plans', []):
+        indices |= indices_do_plano(filho)
+    return indices
+
+def explicar(conn, statement):
+    """Executa EXPLAIN (FORMAT JSON) de uma consulta e retorna o plano raiz"""
+    sql = statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+    return conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").scalar()[0]['Plan']
+
+@app.cli.command('verificar-indices')
+def verificar_indices_command():
+    """
+    Verifica via EXPLAIN que as consultas de histórico usam os índices.
+    Desliga o seq scan para que o teste valha mesmo com a tabela pequena:
+    se o filtro não for sargável o plano continua sem índice e o comando falha.
+    """
+    origem, dia = 1, datetime.now(BRAZIL_TZ).date()
+    casos = [
+        ('leituras-hoje', consulta_leituras_dia(origem, dia).statement,
+         'ux_leitura_dispositivo_data_hora'),
+        ('alertas-por-hora', consulta_alertas_por_hora(origem, dia).statement,
+         'resumo_hora_pkey'),
+        ('datas-disponiveis', consulta_datas_disponiveis(origem).statement,
+         'resumo_hora_pkey'),
+    ]
+    
+    falhas = 0
+    with db.engine.connect() as conn:
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+        for nome, statement, esperado in casos:
+            # Em tabelas particionadas o plano cita o índice de cada partição;
+            # pg_partition_root devolve o índice declarado na tabela-mãe
+            usados = {
+                conn.execute(text("SELECT CAST(pg_partition_root(CAST(:nome AS regclass)) AS text)"),
+                             {'nome': indice}).scalar() or indice
+                for indice in indices_do_plano(explicar(conn, statement))
+            }
+            ok = esperado in usados
+            falhas += not ok
+            print(f"{'OK ' if ok else 'ERRO'} {nome}: esperado {esperado}, usados {sorted(usados) or '-'}")
+    
+    if falhas:
+        raise SystemExit(1)
+
+# Recalcula o agregado de um dia inteiro a partir das leituras brutas.
+# O advisory lock exclusivo do dia (travar_dia_resumo) segura só os upserts da
+# ingestão para aquele dia durante o recálculo, para que leituras gravadas em
+# paralelo não sejam perdidas nem contadas em dobro; os outros dias seguem.
+# Cada comando devolve os dispositivos afetados (para marcar o cache do histórico)
+SQL_RECALCULAR_RESUMO = [
+    "DELETE FROM resumo_hora WHERE data = :dia RETURNING dispositivo_id",
+    """
+    INSERT INTO resumo_hora (dispositivo_id, data, hora, leituras, alertas,
+                             distancia_min, distancia_max, distancia_soma)
+    SELECT dispositivo_id, CAST(data_hora AS date), EXTRACT(hour FROM data_hora),
+           count(*), count(*) FILTER (WHERE alerta),
+           min(distancia_cm), max(distancia_cm), coalesce(sum(distancia_cm), 0)
+    FROM leitura
+    WHERE data_hora >= :inicio AND data_hora < :fim
+    GROUP BY 1, 2, 3
+    RETURNING dispositivo_id
+    """,
+]
+
+def recalcular_resumo_dia(dia):
+    """Recalcula o agregado do dia; dias sem leituras brutas não são tocados"""
+    inicio, fim = intervalo_dia(dia)
+    existe = db.session.query(Leitura.query.filter(
+        Leitura.data_hora >= inicio, Leitura.data_hora < fim
+    ).exists()).scalar()
+    if not existe:
+        return False
+    
+    params = {'dia': dia, 'inicio': inicio, 'fim': fim}
+    travar_dia_resumo(dia, exclusivo=True)
+    origens = set()
+    for sql in SQL_RECALCULAR_RESUMO:
+        origens.update(db.session.execute(text(sql), params).scalars())
+    db.session.commit()
+    marcar_dias(origens, [dia])
+    return True
+
+@app.cli.command('backfill-resumo')
+@click.option('--de', 'data_inicio', help="Primeiro dia (AAAA-MM-DD); padrão: leitura mais antiga")
+@click.option('--ate', 'data_fim', help="Último dia (AAAA-MM-DD); padrão: leitura mais recente")
+def backfill_resumo_command(data_inicio, data_fim):
+    """Preenche o agregado por hora a partir das leituras existentes"""
+    minimo, maximo = db.session.query(
+        func.min(Leitura.data_hora), func.max(Leitura.data_hora)
+    ).one()
+    if minimo is None:
+        print("Nenhuma leitura para agregar.")
+        return
+    
+    dia = datetime.strptime(data_inicio, '%Y-%m-%d').date() if data_inicio else minimo.date()
+    ultimo = datetime.strptime(data_fim, '%Y-%m-%d').date() if data_fim else maximo.date()
+    while dia <= ultimo:
+        if recalcular_resumo_dia(dia):
+            print(f"Agregado recalculado: {dia}")
+        dia += timedelta(days=1)
+
+@app.cli.command('deduplicar')
+def deduplicar_command():
+    """
+    Remove leituras repetidas (mesmo dispositivo e data_hora) gravadas antes do
+    índice único, mantendo a primeira, recalcula o agregado dos dias afetados e
+    cria o índice único. Rode em horário de pouco uso (lê a tabela inteira).
+    """
+    dias = db.session.execute(text("""
+        WITH removidas AS (
+            DELETE FROM leitura l USING (
+                SELECT id, data_hora, row_number() OVER (
+                    PARTITION BY dispositivo_id, data_hora ORDER BY id) AS ordem
+                FROM leitura
+            ) r
+            WHERE l.id = r.id AND l.data_hora = r.data_hora AND r.ordem > 1
+            RETURNING l.data_hora
+        )
+        SELECT CAST(data_hora AS date) AS dia, count(*) FROM removidas GROUP BY 1 ORDER BY 1
+    """)).all()
+    db.session.commit()
+    for dia, removidas in dias:
+        recalcular_resumo_dia(dia)
+        print(f"{dia}: {removidas} leituras repetidas removidas; agregado recalculado")
+    migrar_schema()
+    print("Índice único de leituras criado.")
+
+# --- Particionamento e retenção da tabela leitura ---
+# A tabela leitura é particionada por intervalo de data_hora (mês ou dia).
+# Há partições dos últimos PARTICOES_PASSADAS_DIAS dias (cargas históricas) até
+# PARTICOES_FUTURAS períodos à frente; leituras fora de todas elas (relógio
+# errado, carga mais antiga) caem na partição DEFAULT. Leituras que caíram na
+# DEFAULT antes de a partição do período existir são movidas para ela.
+# Com RETENCAO_DIAS > 0, partições inteiramente mais antigas que o limite são
+# desanexadas e removidas depois de conferir que o agregado por hora cobre
+# suas leituras. Um worker por vez faz a manutenção (advisory lock de sessão).
+PARTICAO_INTERVALO = os.environ.get('PARTICAO_INTERVALO', 'mes')  # 'mes' ou 'dia'
+PARTICOES_FUTURAS = int(os.environ.get('PARTICOES_FUTURAS', '2'))
+PARTICOES_PASSADAS_DIAS = int(os.environ.get('PARTICOES_PASSADAS_DIAS', '90'))
+RETENCAO_DIAS = int(os.environ.get('RETENCAO_DIAS', '0'))  # 0 = mantém tudo
+MANUTENCAO_INTERVALO = int(os.environ.get('MANUTENCAO_INTERVALO', '3600'))  # segundos
+LOCK_MANUTENCAO = 730301  # advisory lock: um worker por vez faz a manutenção
+
+def inicio_periodo(momento):
+    inicio = datetime.combine(momento.date(), datetime.min.time())
+    if PARTICAO_INTERVALO == 'dia':
+        return inicio
+    return inicio.replace(day=1)
+
+def proximo_periodo(inicio):
+    if PARTICAO_INTERVALO == 'dia':
+        return inicio + timedelta(days=1)
+    return (inicio.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def nome_particao(inicio):
+    formato = '%Y%m%d' if PARTICAO_INTERVALO == 'dia' else '%Y%m'
+    return f"leitura_p{inicio.strftime(formato)}"
+
+def valor_limite(valor):
+    """Converte um limite de partição do catálogo (None = MINVALUE/MAXVALUE)"""
+    if valor in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return datetime.fromisoformat(valor.strip("'"))
+
+def limites_particoes(conn):
+    """Lista (nome, início, fim) das partições de intervalo (sem a DEFAULT)"""
+    linhas = conn.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'leitura'::regclass
+    """)).all()
+    particoes = []
+    for nome, limite in linhas:
+        m = re.match(r"FOR VALUES FROM \((.+)\) TO \((.+)\)", limite)
+        if m:
+            particoes.append((nome, valor_limite(m.group(1)), valor_limite(m.group(2))))
+    return sorted(particoes, key=lambda p: p[2] or datetime.max)
+
+def criar_particao(conn, inicio, fim):
+    """Cria a partição do período, movendo para ela as leituras do período que estão na DEFAULT"""
+    nome = nome_particao(inicio)
+    limites = f"FOR VALUES FROM ('{inicio}') TO ('{fim}')"
+    periodo = {'inicio': inicio, 'fim': fim}
+    na_default = conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM leitura_default WHERE data_hora >= :inicio AND data_hora < :fim)"
+    ), periodo).scalar()
+    if not na_default:
+        conn.execute(text(f"CREATE TABLE {nome} PARTITION OF leitura {limites}"))
+    else:
+        # Com linhas do período na DEFAULT o CREATE ... PARTITION OF falharia
+        colunas = ', '.join(c.name for c in Leitura.__table__.columns)
+        conn.execute(text(f"CREATE TABLE {nome} (LIKE leitura INCLUDING DEFAULTS)"))
+        movidas = conn.execute(text(f"""
+            WITH movidas AS (
+                DELETE FROM leitura_default WHERE data_hora >= :inicio AND data_hora < :fim
+                RETURNING {colunas}
+            )
+            INSERT INTO {nome} ({colunas}) SELECT {colunas} FROM movidas
+        """), periodo).rowcount
+        conn.execute(text(f"ALTER TABLE leitura ATTACH PARTITION {nome} {limites}"))
+        print(f"{movidas} leituras movidas da partição DEFAULT para {nome}")
+    print(f"Partição {nome} criada")
+
+def criar_particoes(conn):
+    """
+    Cria a partição DEFAULT e as dos períodos desde PARTICOES_PASSADAS_DIAS atrás
+    (sem passar do limite da retenção) até PARTICOES_FUTURAS à frente do atual
+    """
+    conn.execute(text("CREATE TABLE IF NOT EXISTS leitura_default PARTITION OF leitura DEFAULT"))
+    existentes = limites_particoes(conn)
+    
+    agora = datetime.now(BRAZIL_TZ)
+    passados = min(PARTICOES_PASSADAS_DIAS, RETENCAO_DIAS) if RETENCAO_DIAS > 0 else PARTICOES_PASSADAS_DIAS
+    inicio = inicio_periodo(agora - timedelta(days=passados))
+    final = inicio_periodo(agora)
+    for _ in range(PARTICOES_FUTURAS + 1):
+        final = proximo_periodo(final)
+    while inicio < final:
+        fim = proximo_periodo(inicio)
+        # Pula períodos já cobertos (ex.: partição legada criada por 'flask particionar')
+        coberto = any((ini is None or ini < fim) and (f is None or f > inicio)
+                      for _, ini, f in existentes)
+        if not coberto:
+            criar_particao(conn, inicio, fim)
+        inicio = fim
+
+def garantir_resumo(tabela, limite):
+    """Recalcula o agregado dos dias da tabela (< limite) cujas contagens divergem"""
+    divergentes = db.session.execute(text(f"""
+        SELECT d.data FROM (
+            SELECT CAST(data_hora AS date) AS data, count(*) AS leituras
+            FROM {tabela}
+            WHERE data_hora < :limite
+            GROUP BY 1
+        ) d LEFT JOIN (
+            SELECT data, sum(leituras) AS leituras
+            FROM resumo_hora WHERE data < :limite
+            GROUP BY data
+        ) r ON r.data = d.data
+        WHERE r.leituras IS DISTINCT FROM d.leituras
+        ORDER BY d.data
+    """), {'limite': limite}).scalars().all()
+    db.session.commit()
+    for dia in divergentes:
+        recalcular_resumo_dia(dia)
+
+def aplicar_retencao():
+    """Remove leituras brutas mais antigas que RETENCAO_DIAS (o agregado é mantido)"""
+    if RETENCAO_DIAS <= 0:
+        return
+    hoje = datetime.now(BRAZIL_TZ).date()
+    limite = datetime.combine(hoje - timedelta(days=RETENCAO_DIAS), datetime.min.time())
+    
+    # Partições desanexadas num ciclo anterior cujo DROP não chegou a rodar
+    for nome in db.session.execute(text(
+        "SELECT relname FROM pg_class "
+        "WHERE relname ~ '^leitura_p[0-9]+$' AND relkind = 'r' AND NOT relispartition"
+    )).scalars().all():
+        db.session.execute(text(f"DROP TABLE {nome}"))
+        db.session.commit()
+        print(f"Partição desanexada {nome} removida")
+    
+    for nome, inicio, fim in limites_particoes(db.session):
+        if fim is None or fim > limite:
+            continue
+        garantir_resumo(nome, fim)
+        # O DETACH só troca o catálogo, mas espera o ACCESS EXCLUSIVE na tabela-mãe:
+        # o lock_timeout evita que a ingestão fique enfileirada atrás dele se uma
+        # consulta longa estiver lendo leitura (o próximo ciclo tenta de novo).
+        # Depois de desanexada, o DROP só trava a própria partição. O DETACH
+        # CONCURRENTLY não é possível porque a tabela tem partição DEFAULT.
+        db.session.execute(text("SET LOCAL lock_timeout = '5s'"))
+        db.session.execute(text(f"ALTER TABLE leitura DETACH PARTITION {nome}"))
+        db.session.commit()
+        db.session.execute(text(f"DROP TABLE {nome}"))
+        db.session.commit()
+        print(f"Partição {nome} removida (retenção de {RETENCAO_DIAS} dias)")
+    
+    # Leituras antigas que caíram na partição DEFAULT
+    garantir_resumo('leitura_default', limite)
+    db.session.execute(text("DELETE FROM leitura_default WHERE data_hora < :limite"),
+                       {'limite': limite})
+    db.session.commit()
+
+def manutencao_particoes(retencao=True):
+    """Cria as partições e aplica a retenção (se a tabela for particionada)"""
+    with app.app_context():
+        # Lock de sessão em uma conexão própria: vale também durante os vários
+        # commits da retenção, feitos pela db.session
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            if not tabela_particionada(conn):
+                return
+            if not conn.execute(text("SELECT pg_try_advisory_lock(:chave)"),
+                                {'chave': LOCK_MANUTENCAO}).scalar():
+                return  # outro worker está fazendo a manutenção
+            try:
+                criar_particoes(db.session)
+                db.session.commit()
+                if retencao:
+                    aplicar_retencao()
+            finally:
+                db.session.rollback()
+                conn.execute(text("SELECT pg_advisory_unlock(:chave)"), {'chave': LOCK_MANUTENCAO})
+
+def tarefa_manutencao_particoes():
+    while True:
+        time.sleep(MANUTENCAO_INTERVALO)
+        try:
+            manutencao_particoes()
+        except Exception as e:
+            print(f"Erro na manutenção das partições: {e}")
+
+@app.cli.command('exportar')
+@click.option('--origem', required=True, help="Código do dispositivo (ou IP de clientes antigos)")
+@click.option('--de', required=True, help="Primeiro dia (AAAA-MM-DD)")
+@click.option('--ate', required=True, help="Último dia (AAAA-MM-DD)")
+@click.option('--formato', type=click.Choice(sorted(TIPOS_EXPORTACAO)), default='csv')
+@click.option('--saida', type=click.File('wb'), default='-', help="Arquivo de saída (padrão: stdout)")
+def exportar_command(origem, de, ate, formato, saida):
+    """Exporta as leituras brutas de uma origem em CSV ou Parquet"""
+    if formato == 'parquet' and pyarrow is None:
+        raise click.ClickException("Parquet exige o pacote pyarrow")
+    try:
+        inicio, fim = periodo_exportacao(de, ate)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    cadastro = buscar_dispositivo(origem)
+    if cadastro is None:
+        raise click.BadParameter(f"dispositivo '{origem}' não cadastrado", param_hint='--origem')
+    for parte in gerar_exportacao(cadastro[0], inicio, fim, formato):
+        saida.write(parte)
+
+@app.cli.command('particionar')
+def particionar_command():
+    """
+    Converte uma tabela leitura antiga (não particionada) em particionada.
+    A tabela antiga vira a partição leitura_legado, cobrindo tudo até o fim do
+    período atual; exige janela de manutenção (a tabela fica bloqueada).
+    """
+    if tabela_particionada(db.session):
+        print("A tabela leitura já é particionada.")
+        return
+    
+    db.session.execute(text("LOCK TABLE leitura IN ACCESS EXCLUSIVE MODE"))
+    agora = datetime.now(BRAZIL_TZ).replace(tzinfo=None)
+    maximo = db.session.execute(text("SELECT max(data_hora) FROM leitura")).scalar()
+    limite = proximo_periodo(inicio_periodo(max(maximo or agora, agora)))
+    
+    for sql in [
+        "ALTER TABLE leitura DROP CONSTRAINT leitura_pkey",
+        "ALTER TABLE leitura RENAME TO leitura_legado",
+        "ALTER SEQUENCE leitura_id_seq RENAME TO leitura_legado_id_seq",
+        "ALTER INDEX IF EXISTS ix_leitura_dispositivo_data_hora "
+        "RENAME TO ix_leitura_legado_dispositivo_data_hora",
+        "ALTER INDEX IF EXISTS ux_leitura_dispositivo_data_hora "
+        "RENAME TO ux_leitura_legado_dispositivo_data_hora",
+        "ALTER INDEX IF EXISTS ix_leitura_dispositivo_data_hora_alerta "
+        "RENAME TO ix_leitura_legado_dispositivo_data_hora_alerta",
+        "ALTER TABLE leitura_legado ALTER COLUMN data_hora SET NOT NULL",
+    ]:
+        db.session.execute(text(sql))
+    
+    Leitura.__table__.create(db.session.connection())
+    db.session.execute(text(
+        "SELECT setval('leitura_id_seq', (SELECT coalesce(max(id), 0) + 1 FROM leitura_legado), false)"
+    ))
+    db.session.execute(text(
+        f"ALTER TABLE leitura ATTACH PARTITION leitura_legado "
+        f"FOR VALUES FROM (MINVALUE) TO ('{limite}')"
+    ))
+    criar_particoes(db.session)
+    db.session.commit()
+    print(f"Tabela leitura particionada; dados antigos em leitura_legado (até {limite}).")
+
+# Cria as partições antes de aceitar leituras (senão iriam para a DEFAULT)
+manutencao_particoes(retencao=False)
+socketio.start_background_task(tarefa_manutencao_particoes)
+
+# --- Saúde dos sensores ---
+# A cada SAUDE_INTERVALO segundos um worker analisa o dia corrente de todos os
+# dispositivos ativos (com leituras nos últimos SAUDE_DIAS_ATIVO dias, pelo
+# agregado) e, uma vez depois da meia-noite, fecha o dia anterior. Criar uma
+# tupla Python por leitura custaria mais que a análise inteira: o banco junta o
+# dia de cada dispositivo em duas séries de texto (instantes e distâncias), que
+# viram arrays NumPy direto (ver saude.py). Dispositivos ativos sem nenhuma
+# leitura no dia ficam como 'sem_dados'.
+SAUDE_INTERVALO = int(os.environ.get('SAUDE_INTERVALO', '900'))  # segundos; 0 desliga
+SAUDE_DIAS_ATIVO = int(os.environ.get('SAUDE_DIAS_ATIVO', '7'))
+SAUDE_LOTE_LEITURA = 100  # dispositivos por parte do cursor
+SAUDE_LOTE_GRAVACAO = 1000  # linhas por upsert (limite de parâmetros do Postgres)
+LOCK_SAUDE = 730302  # advisory lock: um worker por vez analisa
+
+if saude is not None:
+    analisador_saude = saude.AnalisadorSaude(
+        janela_mediana=int(os.environ.get('SAUDE_JANELA_MEDIANA', '5')),
+        limiar_pico_cm=float(os.environ.get('SAUDE_LIMIAR_PICO_CM', '30')),
+        lacuna_s=int(os.environ.get('SAUDE_LACUNA_S', '120')),
+        travado_s=int(os.environ.get('SAUDE_TRAVADO_S', '1800'))
+    )
+
+SQL_LEITURAS_SAUDE = """
+    SELECT dispositivo_id,
+           string_agg(CAST(EXTRACT(epoch FROM data_hora - :inicio) AS text), ',' ORDER BY data_hora, id),
+           string_agg(coalesce(CAST(distancia_cm AS text), 'NaN'), ',' ORDER BY data_hora, id)
+    FROM leitura
+    WHERE data_hora >= :inicio AND data_hora < :fim {filtro}
+    GROUP BY dispositivo_id
+"""
+
+SQL_DISPOSITIVOS_ATIVOS = """
+    SELECT DISTINCT dispositivo_id FROM resumo_hora WHERE data > :desde AND data <= :dia
+"""
+
+def calcular_saude_dia(dia, origem=None):
+    """
+    Analisa o dia (até agora, se for hoje) de todos os dispositivos ativos ou só
+    de `origem`, sem gravar. Retorna as linhas de saude_dia (dicts).
+    """
+    inicio, fim = intervalo_dia(dia)
+    agora = datetime.now(BRAZIL_TZ).replace(tzinfo=None)
+    duracao = (min(fim, agora) - inicio).total_seconds()
+    if duracao <= 0:
+        return []
+    
+    t0 = time.perf_counter()
+    params = {'inicio': inicio, 'fim': fim, 'origem': origem}
+    if origem is None:
+        pendentes = set(db.session.execute(text(SQL_DISPOSITIVOS_ATIVOS), {
+            'desde': dia - timedelta(days=SAUDE_DIAS_ATIVO), 'dia': dia
+        }).scalars())
+    else:
+        pendentes = {origem}
+    filtro = 'AND dispositivo_id = :origem' if origem is not None else ''
+    partes = db.session.execute(
+        text(SQL_LEITURAS_SAUDE.format(filtro=filtro)), params,
+        execution_options={'stream_results': True}
+    ).partitions(SAUDE_LOTE_LEITURA)
+    
+    linhas = []
+    for parte in partes:
+        for id_, instantes, distancias in parte:
+            pendentes.discard(id_)
+            linhas.append(dict(analisador_saude.analisar(
+                saude.serie(instantes), saude.serie(distancias), duracao
+            ), dispositivo_id=id_))
+    for id_ in pendentes:
+        linhas.append(dict(analisador_saude.analisar([], [], duracao), dispositivo_id=id_))
+    metricas.ANALISE_SAUDE.observe(time.perf_counter() - t0)
+    return [dict(l, data=dia, calculado_em=agora) for l in linhas]
+
+def gravar_saude(linhas):
+    """Grava (upsert) linhas de calcular_saude_dia em saude_dia, sem commit"""
+    for i in range(0, len(linhas), SAUDE_LOTE_GRAVACAO):
+        stmt = pg_insert(SaudeDia).values(linhas[i:i + SAUDE_LOTE_GRAVACAO])
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['dispositivo_id', 'data'],
+            set_={c: stmt.excluded[c] for c in linhas[0].keys() - {'dispositivo_id', 'data'}}
+        ))
+
+def analisar_saude_dia(dia, origem=None):
+    """Analisa o dia e grava em saude_dia, sem commit. Retorna os dispositivos analisados."""
+    linhas = calcular_saude_dia(dia, origem)
+    gravar_saude(linhas)
+    return len(linhas)
+
+def ciclo_saude():
+    """Fecha o dia anterior (uma vez) e atualiza o dia corrente"""
+    with app.app_context():
+        bloqueio = db.session.execute(text("SELECT pg_try_advisory_xact_lock(:chave)"),
+                                      {'chave': LOCK_SAUDE}).scalar()
+        if not bloqueio:
+            db.session.rollback()
+            return  # outro worker está analisando
+        hoje = datetime.now(BRAZIL_TZ).date()
+        ontem = hoje - timedelta(days=1)
+        fechado = db.session.query(SaudeDia.query.filter(
+            SaudeDia.data == ontem,
+            SaudeDia.calculado_em >= datetime.combine(hoje, datetime.min.time())
+        ).exists()).scalar()
+        if not fechado:
+            analisar_saude_dia(ontem)
+        analisar_saude_dia(hoje)
+        db.session.commit()
+
+def tarefa_saude():
+    while True:
+        time.sleep(SAUDE_INTERVALO)
+        try:
+            ciclo_saude()
+        except Exception as e:
+            print(f"Erro na análise de saúde dos sensores: {e}")
+
+if saude is not None and SAUDE_INTERVALO > 0:
+    socketio.start_background_task(tarefa_saude)
+
+@app.cli.command('analisar-saude')
+@click.option('--de', 'data_inicio', required=True, help="Primeiro dia (AAAA-MM-DD)")
+@click.option('--ate', 'data_fim', help="Último dia (AAAA-MM-DD); padrão: o primeiro")
+def analisar_saude_command(data_inicio, data_fim):
+    """Analisa (ou refaz) a saúde dos sensores em um intervalo de dias"""
+    if saude is None:
+        raise click.ClickException("A análise de saúde exige o pacote numpy")
+    dia = date.fromisoformat(data_inicio)
+    ultimo = date.fromisoformat(data_fim) if data_fim else dia
+    while dia <= ultimo:
+        inicio = time.perf_counter()
+        total = analisar_saude_dia(dia)
+        db.session.commit()
+        print(f"{dia}: {total} dispositivos em {time.perf_counter() - inicio:.2f}s")
+        dia += timedelta(days=1)
+
+def payload_saude(s):
+    return {
+        'data': s.data.isoformat(),
+        'leituras': s.leituras,
+        'invalidas': s.invalidas,
+        'picos': s.picos,
+        'lacunas': s.lacunas,
+        'sem_dados_s': s.sem_dados_s,
+        'maior_lacuna_s': s.maior_lacuna_s,
+        'travado_s': s.travado_s,
+        'cobertura': s.cobertura,
+        'nota': s.nota,
+        'estado': s.estado,
+        'calculado_em': s.calculado_em.isoformat(timespec='seconds')
+    }
+
+def saude_indisponivel():
+    return jsonify({"status": "erro", "mensagem": "análise de saúde indisponível no servidor (numpy)"}), 503
+
+def dia_saude():
+    """Dia de ?data=AAAA-MM-DD (padrão: hoje), ou None se inválido"""
+    data_str = request.args.get('data')
+    if not data_str:
+        return datetime.now(BRAZIL_TZ).date()
+    try:
+        return date.fromisoformat(data_str)
+    except ValueError:
+        return None
+
+@app.route('/api/saude')
+def saude_dispositivo():
+    if saude is None:
+        return saude_indisponivel()
+    dia = dia_saude()
+    if dia is None:
+        return jsonify({"status": "erro", "mensagem": "data deve ser AAAA-MM-DD"}), 400
+    origem = get_origem()
+    if origem is None:
+        return jsonify({'dispositivo_id': None, 'saude': None})
     
-    return jsonify([d.data.strftime('%Y-%m-%d') for d in datas])
+    registro = db.session.get(SaudeDia, (origem, dia))
+    if registro is None:
+        # Dispositivo ou dia ainda não analisado pela tarefa: analisa agora. Só
+        # guarda dias encerrados, dentro da retenção e com leituras; os demais
+        # (hoje, datas futuras ou antigas, dias sem dados) são só calculados,
+        # para que uma consulta qualquer não encha saude_dia
+        linhas = calcular_saude_dia(dia, origem)
+        if linhas:
+            registro = SaudeDia(**linhas[0])
+            hoje = datetime.now(BRAZIL_TZ).date()
+            if (dia < hoje and linhas[0]['leituras'] > 0
+                    and (RETENCAO_DIAS <= 0 or dia >= hoje - timedelta(days=RETENCAO_DIAS))):
+                gravar_saude(linhas)
+                db.session.commit()
+    return jsonify({'dispositivo_id': origem,
+                    'saude': payload_saude(registro) if registro else None})
+
+@app.route('/api/saude/dispositivos')
+def saude_dispositivos():
+    """Painel de manutenção: todos os dispositivos analisados no dia, da pior nota para a melhor"""
+    exigir_painel()
+    if saude is None:
+        return saude_indisponivel()
+    dia = dia_saude()
+    if dia is None:
+        return jsonify({"status": "erro", "mensagem": "data deve ser AAAA-MM-DD"}), 400
+    consulta = db.session.query(SaudeDia, Dispositivo.codigo, Leito.nome).join(
+        Dispositivo, Dispositivo.id == SaudeDia.dispositivo_id
+    ).outerjoin(Leito, Leito.id == Dispositivo.leito_id).filter(SaudeDia.data == dia)
+    estado = request.args.get('estado')
+    if estado:
+        if estado not in saude.ESTADOS:
+            return jsonify({"status": "erro",
+                            "mensagem": f"estado deve ser um de: {', '.join(saude.ESTADOS)}"}), 400
+        consulta = consulta.filter(SaudeDia.estado == estado)
+    
+    return jsonify({
+        'data': dia.isoformat(),
+        'dispositivos': [dict(payload_saude(s), dispositivo=codigo, leito=leito)
+                         for s, codigo, leito in consulta.order_by(SaudeDia.nota, Dispositivo.codigo)]
+    })
+
+@app.route('/api/ultima')
+def ultima_leitura():
+    origem = get_origem()
+    
+    ultima = cache_leituras.ultima(origem)
+    if ultima is None:
+        # Cache frio (reinício ou dispositivo ocioso): busca no banco e aquece o cache
+        l = Leitura.query.filter(
+            Leitura.dispositivo_id == origem
+        ).order_by(Leitura.data_hora.desc()).first()
+        if l is None:
+            return jsonify({'dispositivo_id': origem, 'ultima': None, 'recentes': []})
+        ultima = {
+            'distancia_cm': l.distancia_cm,
+            'alerta': l.alerta,
+            'data_hora': l.data_hora.isoformat()
+        }
+        cache_leituras.registrar(origem, ultima)
+    
+    # ?n=<quantidade> inclui as leituras recentes do buffer
+    n = request.args.get('n', 0, type=int)
+    recentes = cache_leituras.recentes(origem, min(n, CACHE_BUFFER)) if n > 0 else []
+    
+    def formatar(leitura):
+        data_hora = datetime.fromisoformat(leitura['data_hora'])
+        return dict(payload_leitura(leitura['distancia_cm'], leitura['alerta'], data_hora),
+                    data_hora_iso=leitura['data_hora'])
+    
+    return jsonify({
+        'dispositivo_id': origem,
+        'ultima': formatar(ultima),
+        'recentes': [formatar(l) for l in recentes]
+    })
+
+# --- Páginas e arquivos estáticos ---
+# Chart.js e o cliente Socket.IO ficam em static/vendor com a versão no nome
+# do arquivo: o navegador guarda por um ano e o dashboard funciona sem CDN.
+# As páginas não têm variáveis por requisição: são renderizadas uma vez e
+# revalidadas por ETag (304 quando nada mudou).
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 365 * 24 * 3600
+
+COMPRESSAO_MIN_BYTES = 1024
+TIPOS_COMPRESSIVEIS = {'text/html', 'text/css', 'text/javascript', 'application/javascript',
+                       'application/json', 'application/ld+json'}
+ENDPOINTS_FIXOS = {'static', 'index', 'graficos'}  # corpo comprimido reaproveitado por ETag
+
+paginas = {}  # template -> (corpo, etag)
+comprimidos = {}  # (etag, codificação) -> corpo comprimido
+
+def pagina(template):
+    """Responde o template renderizado uma única vez, com ETag e revalidação"""
+    if template not in paginas or app.debug:
+        corpo = render_template(template).encode()
+        paginas[template] = (corpo, hashlib.sha1(corpo).hexdigest())
+    corpo, etag = paginas[template]
+    
+    resposta = app.response_class(corpo, mimetype='text/html')
+    resposta.set_etag(etag)
+    resposta.cache_control.no_cache = True
+    return resposta.make_conditional(request)
+
+def codificacao_aceita():
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+@app.after_request
+def comprimir_resposta(resposta):
+    """gzip/brotli para texto e JSON; streams (geradores) passam sem compressão"""
+    if (resposta.status_code != 200 or 'Content-Encoding' in resposta.headers
+            or resposta.mimetype not in TIPOS_COMPRESSIVEIS
+            or (resposta.is_streamed and not resposta.direct_passthrough)):
+        return resposta
+    resposta.vary.add('Accept-Encoding')
+    codificacao = codificacao_aceita()
+    if codificacao is None:
+        return resposta
+    
+    resposta.direct_passthrough = False
+    dados = resposta.get_data()
+    if len(dados) < COMPRESSAO_MIN_BYTES:
+        return resposta
+    
+    etag = resposta.get_etag()[0]
+    chave = (etag, codificacao) if etag and request.endpoint in ENDPOINTS_FIXOS else None
+    corpo = comprimidos.get(chave) if chave else None
+    if corpo is None:
+        if codificacao == 'br':
+            corpo = brotli.compress(dados)
+        else:
+            corpo = gzip.compress(dados, compresslevel=6)
+        if chave:
+            comprimidos[chave] = corpo
+    
+    resposta.set_data(corpo)
+    resposta.headers['Content-Encoding'] = codificacao
+    if etag:
+        # Mesmo recurso em outra codificação: ETag fraco
+        resposta.set_etag(etag, weak=True)
+    return resposta
 
 @app.route('/')
 def index():
-    ultima = Leitura.query.order_by(Leitura.id.desc()).first()
-    
-    html = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Monitoramento de Mobilidade</title>
-        <meta charset="UTF-8">
-        <script src="https://cdn.socket.io/4.0.0/socket.io.min.js"></script>
-        <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-        <style>
-            * { margin: 0; padding: 0; box-sizing: border-box; }
-            body { 
-                font-family: 'Segoe UI', Tahoma, sans-serif; 
-                background: linear-gradient(135deg, #1a1a2e 0%, #16213e 100%);
-                min-height: 100vh;
-                color: #fff;
-                padding: 20px;
-            }
-            .container { max-width: 1200px; margin: 0 auto; }
-            h1 { 
-                text-align: center; 
-                margin-bottom: 30px;
-                font-size: 2em;
-            }
-            h1 span { opacity: 0.7; font-weight: normal; }
-            
-            .status-card {
-                background: rgba(255,255,255,0.1);
-                backdrop-filter: blur(10px);
-                border-radius: 20px;
-                padding: 30px;
-                margin-bottom: 30px;
-                border: 1px solid rgba(255,255,255,0.2);
-                display: flex;
-                justify-content: space-around;
-                align-items: center;
-                flex-wrap: wrap;
-                gap: 20px;
-            }
-            
-            .status-item { text-align: center; }
-            .status-value { 
-                font-size: 3em; 
-                font-weight: bold;
-                display: block;
-            }
-            .status-label { opacity: 0.7; margin-top: 5px; }
-            
-            .alert-indicator {
-                padding: 15px 40px;
-                border-radius: 50px;
-                font-size: 1.5em;
-                font-weight: bold;
-                transition: all 0.3s ease;
-            }
-            .alert-normal { 
-                background: linear-gradient(135deg, #00b894, #00cec9);
-                box-shadow: 0 0 30px rgba(0,184,148,0.5);
-            }
-            .alert-danger { 
-                background: linear-gradient(135deg, #e74c3c, #c0392b);
-                box-shadow: 0 0 30px rgba(231,76,60,0.5);
-                animation: pulse 1s infinite;
-            }
-            @keyframes pulse {
-                0%, 100% { transform: scale(1); }
-                50% { transform: scale(1.05); }
-            }
-            
-            .chart-card {
-                background: rgba(255,255,255,0.1);
-                backdrop-filter: blur(10px);
-                border-radius: 20px;
-                padding: 30px;
-                margin-bottom: 30px;
-                border: 1px solid rgba(255,255,255,0.2);
-            }
-            .chart-title { margin-bottom: 20px; font-size: 1.2em; }
-            
-            .nav-link {
-                display: inline-block;
-                background: linear-gradient(135deg, #6c5ce7, #a29bfe);
-                color: #fff;
-                text-decoration: none;
-                padding: 15px 30px;
-                border-radius: 50px;
-                font-weight: bold;
-                transition: transform 0.3s ease;
-            }
-            .nav-link:hover { transform: translateY(-3px); }
-            .text-center { text-align: center; }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1><span>Monitoramento de Mobilidade Leito-Chão</span></h1>
-            
-            <div class="status-card">
-                <div class="status-item">
-                    <span class="status-value" id="distancia">--</span>
-                    <span class="status-label">Distância (cm)</span>
-                </div>
-                <div class="status-item">
-                    <span class="status-value" id="hora">--:--:--</span>
-                    <span class="status-label">Última Leitura</span>
-                </div>
-                <div id="alert-box" class="alert-indicator alert-normal">
-                    🟢 Normal
-                </div>
-            </div>
-            
-            <div class="chart-card">
-                <h3 class="chart-title">Distância ao Longo do Tempo (Hoje)</h3>
-                <canvas id="distanciaChart"></canvas>
-            </div>
-            
-            <div class="text-center">
-                <a href="/graficos" class="nav-link">Ver Histórico de Alertas</a>
-            </div>
-        </div>
-        
-        <script>
-            const socket = io();
-            let chart;
-            const MAX_PONTOS = 100;
-            let alertas = []; // Array para armazenar status de alerta de cada ponto
-            
-            // Inicializa gráfico
-            const ctx = document.getElementById('distanciaChart').getContext('2d');
-            chart = new Chart(ctx, {
-                type: 'line',
-                data: {
-                    labels: [],
-                    datasets: [
-                        {
-                            // Linha principal (todas as leituras)
-                            label: 'Distância (cm)',
-                            data: [],
-                            borderColor: '#00cec9',
-                            backgroundColor: 'rgba(0,206,201,0.1)',
-                            fill: true,
-                            tension: 0.4,
-                            pointRadius: 3,
-                            pointBackgroundColor: [],
-                            pointBorderColor: [],
-                            pointBorderWidth: 1,
-                            borderWidth: 2
-                        },
-                        {
-                            // Linha de alertas (só conecta pontos de alerta)
-                            label: 'Alertas',
-                            data: [],
-                            borderColor: '#e74c3c',
-                            backgroundColor: 'transparent',
-                            fill: false,
-                            tension: 0,
-                            pointRadius: 5,
-                            pointBackgroundColor: '#e74c3c',
-                            pointBorderColor: '#c0392b',
-                            pointBorderWidth: 2,
-                            borderWidth: 1,
-                            spanGaps: true // Conecta pontos mesmo com gaps (null)
-                        }
-                    ]
-                },
-                options: {
-                    animation: false,
-                    responsive: true,
-                    scales: {
-                        y: {
-                            beginAtZero: true,
-                            grid: { color: 'rgba(255,255,255,0.1)' },
-                            ticks: { color: '#fff' }
-                        },
-                        x: {
-                            grid: { color: 'rgba(255,255,255,0.1)' },
-                            ticks: { color: '#fff', maxTicksLimit: 10 }
-                        }
-                    },
-                    plugins: {
-                        legend: { labels: { color: '#fff' } }
-                    }
-                }
-            });
-            
-            // Carrega dados iniciais (todos do dia)
-            fetch('/api/leituras-hoje')
-                .then(r => r.json())
-                .then(data => {
-                    // Carrega todos os dados históricos
-                    chart.data.labels = data.map(l => l.data_hora);
-                    chart.data.datasets[0].data = data.map(l => l.distancia_cm);
-                    alertas = data.map(l => l.alerta);
-                    
-                    // Linha de alertas: só mostra valor quando tem alerta
-                    chart.data.datasets[1].data = data.map(l => l.alerta ? l.distancia_cm : null);
-                    
-                    // Define cores dos pontos da linha principal
-                    chart.data.datasets[0].pointBackgroundColor = alertas.map(a => a ? '#e74c3c' : '#00cec9');
-                    chart.data.datasets[0].pointBorderColor = alertas.map(a => a ? '#c0392b' : '#00b894');
-                    chart.update('none');
-                    
-                    if (data.length > 0) {
-                        const ultimo = data[data.length - 1];
-                        atualizarStatus(ultimo.distancia_cm, ultimo.alerta, ultimo.data_hora);
-                    }
-                });
-            
-            
-            function addPonto(hora, distancia, alerta) {
-                // Limita novos pontos
-                if (chart.data.labels.length > MAX_PONTOS) {
-                    chart.data.labels.shift();
-                    chart.data.datasets[0].data.shift();
-                    chart.data.datasets[1].data.shift();
-                    chart.data.datasets[0].pointBackgroundColor.shift();
-                    chart.data.datasets[0].pointBorderColor.shift();
-                    alertas.shift();
-                }
-                
-                chart.data.labels.push(hora);
-                chart.data.datasets[0].data.push(distancia);
-                chart.data.datasets[1].data.push(alerta ? distancia : null); // Linha de alertas
-                alertas.push(alerta);
-                
-                // Cor do ponto na linha principal
-                chart.data.datasets[0].pointBackgroundColor.push(alerta ? '#e74c3c' : '#00cec9');
-                chart.data.datasets[0].pointBorderColor.push(alerta ? '#c0392b' : '#00b894');
-                
-                chart.update('none');
-            }
-            
-            function atualizarStatus(distancia, alerta, hora) {
-                document.getElementById('distancia').textContent = distancia.toFixed(1);
-                document.getElementById('hora').textContent = hora;
-                
-                const alertBox = document.getElementById('alert-box');
-                if (alerta) {
-                    alertBox.className = 'alert-indicator alert-danger';
-                    alertBox.innerHTML = '🔴 ALERTA!';
-                } else {
-                    alertBox.className = 'alert-indicator alert-normal';
-                    alertBox.innerHTML = '🟢 Normal';
-                }
-            }
-            
-            // Timer para adicionar pontos vazios quando não recebe dados
-            let ultimoRecebimento = Date.now();
-            const INTERVALO_ESPERADO = 3000; // 3 segundos
-            
-            // Marca quando recebeu dados
-            socket.on('nova_leitura', function(data) {
-                ultimoRecebimento = Date.now();
-                addPonto(data.data_hora, data.distancia_cm, data.alerta);
-                atualizarStatus(data.distancia_cm, data.alerta, data.data_hora);
-            });
-            
-            // Verifica a cada segundo se precisa adicionar ponto vazio
-            setInterval(() => {
-                const agora = Date.now();
-                if (agora - ultimoRecebimento > INTERVALO_ESPERADO) {
-                    // Não recebeu dados recentemente, adiciona ponto vazio
-                    const horaAtual = new Date().toLocaleTimeString('pt-BR', {hour: '2-digit', minute: '2-digit', second: '2-digit'});
-                    addPontoVazio(horaAtual);
-                    ultimoRecebimento = agora; // Reseta para não adicionar vários seguidos
-                }
-            }, 1000);
-            
-            function addPontoVazio(hora) {
-                if (chart.data.labels.length > MAX_PONTOS) {
-                    chart.data.labels.shift();
-                    chart.data.datasets[0].data.shift();
-                    chart.data.datasets[1].data.shift();
-                    chart.data.datasets[0].pointBackgroundColor.shift();
-                    chart.data.datasets[0].pointBorderColor.shift();
-                    alertas.shift();
-                }
-                
-                chart.data.labels.push(hora);
-                chart.data.datasets[0].data.push(null); // Ponto vazio
-                chart.data.datasets[1].data.push(null);
-                alertas.push(false);
-                chart.data.datasets[0].pointBackgroundColor.push('transparent');
-                chart.data.datasets[0].pointBorderColor.push('transparent');
-                
-                chart.update('none');
-            }
-            
-            // Fallback: polling a cada 5s caso WebSocket falhe
-            setInterval(() => {
-                fetch('/api/leituras-hoje')
-                    .then(r => r.json())
-                    .then(data => {
-                        if (data.length > 0) {
-                            const ultimo = data[data.length - 1];
-                            atualizarStatus(ultimo.distancia_cm, ultimo.alerta, ultimo.data_hora);
-                        }
-                    });
-            }, 5000);
-        </script>
-    </body>
-    </html>
-    """
-    return render_template_string(html)
+    return pagina('index.html')
 
 @app.route('/graficos')
 def graficos():
-    html = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Histórico de Alertas - IoT</title>
-        <meta charset="UTF-8">
-        <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-        <style>
-            * { margin: 0; padding: 0; box-sizing: border-box; }
-            body { 
-                font-family: 'Segoe UI', Tahoma, sans-serif; 
-                background: linear-gradient(135deg, #1a1a2e 0%, #16213e 100%);
-                min-height: 100vh;
-                color: #fff;
-                padding: 20px;
-            }
-            .container { max-width: 1200px; margin: 0 auto; }
-            h1 { 
-                text-align: center; 
-                margin-bottom: 30px;
-                font-size: 2em;
-            }
-            
-            .controls {
-                background: rgba(255,255,255,0.1);
-                backdrop-filter: blur(10px);
-                border-radius: 20px;
-                padding: 20px;
-                margin-bottom: 30px;
-                border: 1px solid rgba(255,255,255,0.2);
-                display: flex;
-                justify-content: center;
-                align-items: center;
-                gap: 20px;
-                flex-wrap: wrap;
-            }
-            
-            select, button {
-                padding: 12px 25px;
-                border-radius: 50px;
-                border: none;
-                font-size: 1em;
-                cursor: pointer;
-            }
-            select {
-                background: rgba(255,255,255,0.9);
-                color: #333;
-            }
-            button {
-                background: linear-gradient(135deg, #6c5ce7, #a29bfe);
-                color: #fff;
-                font-weight: bold;
-                transition: transform 0.3s ease;
-            }
-            button:hover { transform: translateY(-2px); }
-            
-            .chart-card {
-                background: rgba(255,255,255,0.1);
-                backdrop-filter: blur(10px);
-                border-radius: 20px;
-                padding: 30px;
-                margin-bottom: 30px;
-                border: 1px solid rgba(255,255,255,0.2);
-            }
-            .chart-title { margin-bottom: 20px; font-size: 1.2em; text-align: center; }
-            
-            .nav-link {
-                display: inline-block;
-                background: linear-gradient(135deg, #00b894, #00cec9);
-                color: #fff;
-                text-decoration: none;
-                padding: 15px 30px;
-                border-radius: 50px;
-                font-weight: bold;
-                transition: transform 0.3s ease;
-            }
-            .nav-link:hover { transform: translateY(-3px); }
-            .text-center { text-align: center; }
-            
-            .info-text {
-                text-align: center;
-                opacity: 0.7;
-                margin-bottom: 20px;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Histórico de Alertas</h1>
-            
-            <p class="info-text">Visualize a incidência de alertas de presença por hora do dia</p>
-            
-            <div class="controls">
-                <label>Selecione a data:</label>
-                <select id="dataSelect" onchange="carregarDados()"></select>
-            </div>
-            
-            <div class="chart-card">
-                <h3 class="chart-title" id="chart-title">Alertas por Hora</h3>
-                <canvas id="alertasChart"></canvas>
-            </div>
-            
-            <div class="text-center">
-                <a href="/" class="nav-link">Voltar ao Monitor</a>
-            </div>
-        </div>
-        
-        <script>
-            let chart;
-            
-            // Inicializa gráfico
-            const ctx = document.getElementById('alertasChart').getContext('2d');
-            chart = new Chart(ctx, {
-                type: 'bar',
-                data: {
-                    labels: Array.from({length: 24}, (_, i) => i + 'h'),
-                    datasets: [{
-                        label: 'Quantidade de Alertas',
-                        data: Array(24).fill(0),
-                        backgroundColor: 'rgba(231,76,60,0.7)',
-                        borderColor: '#e74c3c',
-                        borderWidth: 2,
-                        borderRadius: 5
-                    }]
-                },
-                options: {
-                    responsive: true,
-                    scales: {
-                        y: {
-                            beginAtZero: true,
-                            grid: { color: 'rgba(255,255,255,0.1)' },
-                            ticks: { color: '#fff', stepSize: 1 }
-                        },
-                        x: {
-                            grid: { color: 'rgba(255,255,255,0.1)' },
-                            ticks: { color: '#fff' }
-                        }
-                    },
-                    plugins: {
-                        legend: { labels: { color: '#fff' } }
-                    }
-                }
-            });
-            
-            // Carrega datas disponíveis
-            fetch('/api/datas-disponiveis')
-                .then(r => r.json())
-                .then(datas => {
-                    const select = document.getElementById('dataSelect');
-                    if (datas.length === 0) {
-                        const hoje = new Date().toISOString().split('T')[0];
-                        datas = [hoje];
-                    }
-                    datas.forEach(d => {
-                        const opt = document.createElement('option');
-                        opt.value = d;
-                        opt.textContent = formatarData(d);
-                        select.appendChild(opt);
-                    });
-                    carregarDados();
-                });
-            
-            function formatarData(dataStr) {
-                const [ano, mes, dia] = dataStr.split('-');
-                return dia + '/' + mes + '/' + ano;
-            }
-            
-            function carregarDados() {
-                const data = document.getElementById('dataSelect').value;
-                fetch('/api/alertas-por-hora?data=' + data)
-                    .then(r => r.json())
-                    .then(resp => {
-                        const alertas = resp.dados.map(d => d.alertas);
-                        chart.data.datasets[0].data = alertas;
-                        chart.update();
-                        
-                        document.getElementById('chart-title').textContent = 
-                            'Alertas por Hora - ' + formatarData(resp.data);
-                    });
-            }
-        </script>
-    </body>
-    </html>
-    """
-    return render_template_string(html)
+    return pagina('graficos.html')
 
 if __name__ == '__main__':
     socketio.run(app, host='0.0.0.0', port=5000, allow_unsafe_werkzeug=True)
\ No newline at end of file
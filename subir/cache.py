@@ -0,0 +1,180 @@
+"""
+Cache da última leitura e das leituras recentes de cada dispositivo (room)
+
+Evita ir ao banco para saber o status atual de um leito. Também guarda o
+instante da última escrita por dispositivo e dia, usado como validador (ETag /
+Last-Modified) das APIs de histórico. Duas implementações com a mesma interface:
+- CacheMemoria: LRU limitado em memória, por processo
+- CacheRedis: compartilhado entre workers; dispositivos ociosos expiram por TTL
+"""
+
+import json
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+
+
+def chave_ordem(leitura):
+    """Leituras são comparadas pela data/hora ISO (ordem lexicográfica = cronológica)"""
+    return leitura['data_hora']
+
+
+class CacheLeituras(ABC):
+    """
+    Interface comum: registrar() é chamado a cada leitura gravada. As
+    implementações definem tamanho_buffer (leituras recentes por dispositivo).
+    """
+
+    @abstractmethod
+    def registrar(self, origem, leitura):
+        """Guarda a leitura (dict com data_hora ISO) como última e entre as recentes"""
+
+    @abstractmethod
+    def ultima(self, origem):
+        """Última leitura do dispositivo, ou None se não está no cache"""
+
+    @abstractmethod
+    def recentes(self, origem, n=None):
+        """Até n leituras recentes (todas do buffer se n é None), da mais antiga à mais nova"""
+
+    @abstractmethod
+    def marcar_escrita(self, origem, dias, instante):
+        """Registra que houve escrita nos dias (strings ISO ou '*') no instante (ns)"""
+
+    @abstractmethod
+    def ultima_escrita(self, origem, dia):
+        """Instante (ns) da última escrita no dia, ou None se desconhecido"""
+
+    def registrar_lote(self, linhas):
+        """Registra um lote: por dispositivo, só as leituras que cabem no buffer, em ordem"""
+        por_origem = {}
+        for linha in linhas:
+            por_origem.setdefault(linha['dispositivo_id'], []).append(linha)
+        for origem, leituras in por_origem.items():
+            leituras.sort(key=lambda l: l['data_hora'])
+            for linha in leituras[-self.tamanho_buffer:]:
+                self.registrar(origem, {
+                    'distancia_cm': linha['distancia_cm'],
+                    'alerta': linha['alerta'],
+                    'data_hora': linha['data_hora'].isoformat()
+                })
+
+
+class CacheMemoria(CacheLeituras):
+    """LRU por dispositivo: ao passar de max_ips, sai o dispositivo há mais tempo sem leitura"""
+
+    def __init__(self, max_ips=10000, tamanho_buffer=100):
+        self.max_ips = max_ips
+        self.tamanho_buffer = tamanho_buffer
+        self._entradas = OrderedDict()  # dispositivo -> [última, deque de recentes]
+        # Escritas por dispositivo e dia ficam fora do LRU das leituras: um
+        # dispositivo ocioso não perde as marcas. Acima de max_ips dispositivos
+        # sai o marcado há mais tempo e o piso sobe até a marca mais nova dele;
+        # um dia sem marca vale o piso, nunca uma versão anterior à escrita esquecida.
+        self._escritas = OrderedDict()  # dispositivo -> {dia: instante}
+        self._piso = None
+        self._lock = threading.Lock()
+
+    def registrar(self, origem, leitura):
+        with self._lock:
+            entrada = self._entrada(origem)
+
+            # Leituras atrasadas (reenvios) não substituem o status atual
+            if entrada[0] is not None and chave_ordem(leitura) < chave_ordem(entrada[0]):
+                return
+            entrada[0] = leitura
+            entrada[1].append(leitura)
+
+    def _entrada(self, origem):
+        entrada = self._entradas.get(origem)
+        if entrada is None:
+            entrada = self._entradas[origem] = [None, deque(maxlen=self.tamanho_buffer)]
+            if len(self._entradas) > self.max_ips:
+                self._entradas.popitem(last=False)
+        else:
+            self._entradas.move_to_end(origem)
+        return entrada
+
+    def ultima(self, origem):
+        with self._lock:
+            entrada = self._entradas.get(origem)
+            return entrada[0] if entrada else None
+
+    def recentes(self, origem, n=None):
+        with self._lock:
+            entrada = self._entradas.get(origem)
+            if entrada is None:
+                return []
+            recentes = list(entrada[1])
+        return recentes[-n:] if n else recentes
+
+    def marcar_escrita(self, origem, dias, instante):
+        with self._lock:
+            escritas = self._escritas.setdefault(origem, {})
+            self._escritas.move_to_end(origem)
+            for dia in dias:
+                escritas[dia] = max(escritas.get(dia, 0), instante)
+            if len(self._escritas) > self.max_ips:
+                _, removidas = self._escritas.popitem(last=False)
+                self._piso = max([self._piso or 0, *removidas.values()])
+
+    def ultima_escrita(self, origem, dia):
+        with self._lock:
+            escritas = self._escritas.get(origem)
+            instante = escritas.get(dia) if escritas else None
+            return instante if instante is not None else self._piso
+
+
+# Atualiza última leitura + buffer de forma atômica, ignorando leituras atrasadas
+SCRIPT_REGISTRAR = """
+local atual = redis.call('HGET', KEYS[1], 'data_hora')
+if atual and atual > ARGV[2] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'leitura', ARGV[1], 'data_hora', ARGV[2])
+redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[3]), -1)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return 1
+"""
+
+
+class CacheRedis(CacheLeituras):
+    """Cache compartilhado via Redis (ou compatível); exige o pacote redis"""
+
+    def __init__(self, url, tamanho_buffer=100, ttl=86400, prefixo='monitor:dispositivo'):
+        import redis
+
+        self.tamanho_buffer = tamanho_buffer
+        self.ttl = ttl
+        self.prefixo = prefixo
+        self._redis = redis.Redis.from_url(url)
+        self._registrar = self._redis.register_script(SCRIPT_REGISTRAR)
+
+    def _chaves(self, origem):
+        return f"{self.prefixo}:{origem}:ultima", f"{self.prefixo}:{origem}:recentes"
+
+    def _chave_escritas(self, origem):
+        return f"{self.prefixo}:{origem}:escritas"
+
+    def registrar(self, origem, leitura):
+        self._registrar(keys=self._chaves(origem), args=[
+            json.dumps(leitura), chave_ordem(leitura), self.tamanho_buffer, self.ttl
+        ])
+
+    def ultima(self, origem):
+        valor = self._redis.hget(self._chaves(origem)[0], 'leitura')
+        return json.loads(valor) if valor else None
+
+    def recentes(self, origem, n=None):
+        inicio = -n if n else 0
+        return [json.loads(v) for v in self._redis.lrange(self._chaves(origem)[1], inicio, -1)]
+
+    def marcar_escrita(self, origem, dias, instante):
+        # Sem TTL: uma marca expirada deixaria o histórico com versão antiga
+        self._redis.hset(self._chave_escritas(origem), mapping={dia: instante for dia in dias})
+
+    def ultima_escrita(self, origem, dia):
+        valor = self._redis.hget(self._chave_escritas(origem), dia)
+        return int(valor) if valor else None
@@ -0,0 +1,57 @@
+"""
+Coalescência dos eventos de leitura por room (IP ou dispositivo)
+
+Em vez de um evento por leitura gravada, as leituras de cada room são
+acumuladas e enviadas no máximo N vezes por segundo (ver tarefa_difusao no
+app.py). Cada mensagem leva só o estado mais recente e as transições de
+alerta do intervalo, em formato compacto:
+
+    {"n": 37, "p": [["14:03:10", 52.3, 1], ["14:03:12", 15.0, 0]]}
+
+n = leituras representadas; p = pontos [hora, distância, alerta 0/1].
+"""
+
+import threading
+
+
+def ponto_compacto(data_hora, distancia_cm, alerta):
+    distancia = round(distancia_cm, 1) if distancia_cm is not None else None
+    return [data_hora.strftime("%H:%M:%S"), distancia, int(bool(alerta))]
+
+
+def mensagem_unica(data_hora, distancia_cm, alerta):
+    """Mensagem com uma única leitura (coalescência desligada)"""
+    return {'n': 1, 'p': [ponto_compacto(data_hora, distancia_cm, alerta)]}
+
+
+class DifusorLeituras:
+    """Acumula leituras por room entre duas coletas"""
+
+    def __init__(self):
+        self._pendentes = {}  # room -> [leituras, transições, último ponto]
+        self._alerta_anterior = {}  # room -> alerta da última leitura registrada
+        self._lock = threading.Lock()
+
+    def registrar(self, room, data_hora, distancia_cm, alerta):
+        ponto = ponto_compacto(data_hora, distancia_cm, alerta)
+        with self._lock:
+            pendente = self._pendentes.get(room)
+            if pendente is None:
+                pendente = self._pendentes[room] = [0, [], None]
+            pendente[0] += 1
+            anterior = self._alerta_anterior.get(room)
+            if anterior is not None and ponto[2] != anterior:
+                pendente[1].append(ponto)
+            self._alerta_anterior[room] = ponto[2]
+            pendente[2] = ponto
+
+    def coletar(self):
+        """Retorna {room: mensagem} do que foi acumulado e recomeça do zero"""
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, {}
+        mensagens = {}
+        for room, (leituras, pontos, ultimo) in pendentes.items():
+            if not pontos or pontos[-1] is not ultimo:
+                pontos.append(ultimo)
+            mensagens[room] = {'n': leituras, 'p': pontos}
+        return mensagens
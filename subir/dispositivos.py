@@ -0,0 +1,67 @@
+"""
+Chaves de API e cache do cadastro de dispositivos
+
+Cada dispositivo tem um id inteiro (chave estrangeira nas tabelas de leituras)
+e um código textual: o nível do tópico MQTT ou, em clientes antigos, o IP. A
+chave de API é mostrada uma única vez no cadastro; o banco guarda só o SHA-256.
+
+O RegistroDispositivos evita uma consulta ao cadastro por leitura: guarda por
+código e por hash da chave o que veio do banco, inclusive ausências, por
+ttl segundos. Assim uma chave trocada em outro processo (CLI ou outro worker)
+passa a valer em no máximo ttl segundos. Com o banco fora do ar, a entrada
+vencida continua valendo (vencido=True) para a ingestão não depender do banco.
+"""
+
+import hashlib
+import secrets
+import threading
+import time
+
+
+def gerar_chave():
+    return secrets.token_urlsafe(32)
+
+
+def hash_chave(chave):
+    return hashlib.sha256(chave.encode()).hexdigest()
+
+
+class RegistroDispositivos:
+    """
+    Cache com TTL: código -> (id, hash da chave, hash da chave do leito) e
+    hash -> (id, código)
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._por_codigo = {}
+        self._por_chave = {}
+        self._lock = threading.Lock()
+
+    def _ler(self, tabela, chave, vencido):
+        with self._lock:
+            item = tabela.get(chave)
+        if item is None or (not vencido and time.monotonic() - item[0] > self.ttl):
+            return None
+        return item
+
+    def por_codigo(self, codigo, vencido=False):
+        """
+        (encontrado, (id, hash da chave, hash da chave do leito) ou None);
+        encontrado=False se expirou (com vencido=True, só se nunca foi guardado)
+        """
+        item = self._ler(self._por_codigo, codigo, vencido)
+        return (False, None) if item is None else (True, item[1])
+
+    def por_chave(self, chave_hash, vencido=False):
+        """(encontrado, (id, código) ou None); encontrado=False como em por_codigo"""
+        item = self._ler(self._por_chave, chave_hash, vencido)
+        return (False, None) if item is None else (True, item[1])
+
+    def guardar_codigo(self, codigo, valor):
+        with self._lock:
+            self._por_codigo[codigo] = (time.monotonic(), valor)
+
+    def guardar_chave(self, chave_hash, valor):
+        with self._lock:
+            self._por_chave[chave_hash] = (time.monotonic(), valor)
@@ -0,0 +1,111 @@
+"""
+Detecção de episódios de saída do leito sobre o fluxo de leituras
+
+O sensor marca cada leitura com 'alerta'; uma saída de 2 minutos gera dezenas
+de leituras em alerta. O detector mantém uma máquina de estados pequena por
+origem (IP ou dispositivo) e transforma o fluxo em episódios com início e fim:
+- debounce: o episódio só abre se o alerta durar ao menos inicio_s segundos
+- histerese: só fecha se a volta ao normal durar ao menos fim_s segundos
+A duração é medida pela data_hora das leituras, não pela quantidade delas: o
+emissor só encaminha mudanças (e um heartbeat a cada 30 s), então uma saída
+curta pode chegar como uma única leitura em alerta seguida de uma normal. A
+mudança vale a partir da sua primeira leitura e é confirmada pela primeira
+leitura que chega depois do prazo, seja ela qual for.
+Cada leitura custa O(1) e nenhuma consulta ao histórico é feita.
+
+Um lote é processado sobre cópias dos estados (estados()); elas só substituem
+os do detector em publicar(), depois do commit. Se a transação falhar, o
+detector continua igual ao banco.
+"""
+
+import copy
+import threading
+from collections import OrderedDict
+
+
+class EstadoOrigem:
+    """Estado da máquina de uma origem: no leito ou fora (episódio aberto)"""
+    __slots__ = ('inicio', 'alertas', 'candidato', 'consecutivas', 'ultima')
+
+    def __init__(self, inicio=None, alertas=0):
+        self.inicio = inicio  # início do episódio aberto (None = no leito)
+        self.alertas = alertas  # leituras em alerta no episódio aberto
+        self.candidato = None  # data/hora da 1ª leitura da sequência que pode mudar o estado
+        self.consecutivas = 0  # leituras da sequência candidata
+        self.ultima = inicio  # data/hora da última leitura processada
+
+
+class DetectorEpisodios:
+    """Máquinas de estado por origem, limitadas a max_origens (LRU)"""
+
+    def __init__(self, inicio_s=5, fim_s=5, max_origens=10000):
+        self.inicio_s = inicio_s
+        self.fim_s = fim_s
+        self.max_origens = max_origens
+        self._estados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def estados(self, origens):
+        """Cópias dos estados das origens, para processar um lote (None = origem desconhecida)"""
+        with self._lock:
+            return {origem: copy.copy(self._estados[origem]) if origem in self._estados else None
+                    for origem in origens}
+
+    def publicar(self, estados):
+        """Guarda os estados processados (depois do commit do lote)"""
+        with self._lock:
+            for origem, estado in estados.items():
+                self._guardar(origem, estado)
+
+    def _guardar(self, origem, estado):
+        self._estados[origem] = estado
+        self._estados.move_to_end(origem)
+        if len(self._estados) > self.max_origens:
+            self._estados.popitem(last=False)
+
+    def processar(self, estado, origem, data_hora, alerta):
+        """
+        Aplica uma leitura ao estado (uma cópia de estados()) e retorna a transição,
+        se houver: {'tipo': 'inicio'|'fim', 'origem', 'inicio', 'fim', 'alertas'} ou None.
+        Leituras atrasadas (mais antigas que a última processada) são ignoradas.
+        """
+        if estado.ultima is not None and data_hora < estado.ultima:
+            return None
+        estado.ultima = data_hora
+        alerta = bool(alerta)
+        aberto = estado.inicio is not None
+
+        transicao = None
+        if estado.candidato is not None:
+            prazo = self.fim_s if aberto else self.inicio_s
+            if (data_hora - estado.candidato).total_seconds() >= prazo:
+                # A sequência candidata durou o bastante: o estado muda no seu início
+                transicao = self._confirmar(estado, origem)
+                aberto = not aberto
+            elif alerta == aberto:
+                # Voltou ao estado atual antes do prazo: era ruído
+                estado.candidato = None
+                estado.consecutivas = 0
+
+        if alerta == aberto:
+            estado.alertas += alerta
+        else:
+            if estado.candidato is None:
+                estado.candidato = data_hora
+            estado.consecutivas += 1
+        return transicao
+
+    def _confirmar(self, estado, origem):
+        if estado.inicio is None:
+            estado.inicio = estado.candidato
+            estado.alertas = estado.consecutivas
+            transicao = {'tipo': 'inicio', 'origem': origem, 'inicio': estado.inicio,
+                         'fim': None, 'alertas': estado.alertas}
+        else:
+            transicao = {'tipo': 'fim', 'origem': origem, 'inicio': estado.inicio,
+                         'fim': estado.candidato, 'alertas': estado.alertas}
+            estado.inicio = None
+            estado.alertas = 0
+        estado.candidato = None
+        estado.consecutivas = 0
+        return transicao
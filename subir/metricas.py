@@ -0,0 +1,96 @@
+"""
+Métricas no formato Prometheus e profiling por requisição
+
+As métricas ficam no registro padrão do prometheus_client e são expostas em
+GET /metrics (ver app.py). Cada container roda um único worker, então o
+registro em memória do processo basta; com várias instâncias o Prometheus
+coleta cada uma e soma.
+
+O profiling grava um arquivo .prof do cProfile por requisição escolhida
+(abrir com `python -m pstats` ou snakeviz). Só uma requisição é perfilada por
+vez: o cProfile não aceita dois perfis ativos e, com gevent, o perfil também
+inclui o trabalho de outros greenlets que rodarem no meio.
+"""
+
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+BALDES_LATENCIA = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+BALDES_BYTES = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# HTTP (por endpoint do Flask, não pela URL, para não multiplicar as séries)
+REQUISICOES = Counter('http_requisicoes_total', 'Requisições HTTP atendidas',
+                      ['endpoint', 'metodo', 'status'])
+LATENCIA = Histogram('http_requisicao_segundos', 'Latência das requisições por rota',
+                     ['endpoint', 'metodo'], buckets=BALDES_LATENCIA)
+TAMANHO_REQUISICAO = Histogram('http_requisicao_bytes', 'Tamanho do corpo recebido',
+                               ['endpoint'], buckets=BALDES_BYTES)
+TAMANHO_RESPOSTA = Histogram('http_resposta_bytes', 'Tamanho do corpo enviado (já comprimido)',
+                             ['endpoint'], buckets=BALDES_BYTES)
+
+# Ingestão e banco
+LEITURAS = Counter('ingestao_leituras_total', 'Leituras recebidas pela ingestão',
+                   ['resultado'])  # gravada, duplicada, enfileirada, rejeitada, fila_cheia, banco_indisponivel, descartada
+TRANSACAO = Histogram('db_gravacao_segundos', 'Transação de gravação (INSERT, resumo, episódios e commit)',
+                      ['caminho'], buckets=BALDES_LATENCIA)  # unitaria ou lote
+COMMIT = Histogram('db_commit_segundos', 'Duração do COMMIT da gravação',
+                   ['caminho'], buckets=BALDES_LATENCIA)
+LEITURAS_POR_COMMIT = Histogram('db_leituras_por_commit', 'Leituras gravadas por transação',
+                                buckets=(1, 10, 50, 100, 500, 1000, 5000, 20000, 100000))
+PROFUNDIDADE_FILA = Gauge('ingestao_fila_profundidade', 'Leituras na fila de gravação assíncrona')
+ANALISE_SAUDE = Histogram('saude_analise_segundos', 'Análise de saúde de um dia (consulta, NumPy e gravação)',
+                          buckets=(.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+
+# Socket.IO (sem rótulo por room: há uma room por leito)
+EMISSOES = Counter('socketio_emissoes_total', 'Mensagens emitidas (uma por room)', ['evento'])
+ROOMS_POR_CICLO = Histogram('socketio_rooms_por_ciclo', 'Rooms notificadas em cada ciclo da difusão',
+                            buckets=(0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000))
+CICLO_DIFUSAO = Histogram('socketio_ciclo_difusao_segundos', 'Duração de um ciclo da difusão',
+                          buckets=BALDES_LATENCIA)
+CLIENTES = Gauge('socketio_clientes_conectados', 'Conexões Socket.IO abertas')
+
+# Vivacidade dos sensores (dispositivos acompanhados por esta instância)
+SENSORES_ONLINE = Gauge('sensores_online', 'Dispositivos com leitura dentro do SENSOR_TIMEOUT')
+SENSORES_OFFLINE = Gauge('sensores_offline', 'Dispositivos sem leitura há mais de SENSOR_TIMEOUT')
+
+
+class ProfilerRequisicoes:
+    """Perfila requisições por amostragem ou quando o cliente pede (forcar=True)"""
+
+    def __init__(self, diretorio, amostragem=0.0):
+        self.diretorio = diretorio
+        self.amostragem = amostragem
+        self._lock = threading.Lock()
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+
+    def iniciar(self, forcar=False):
+        """Retorna o perfil ativo ou None (desligado, não sorteada ou outro em andamento)"""
+        if not self.diretorio or not (forcar or random.random() < self.amostragem):
+            return None
+        if not self._lock.acquire(blocking=False):
+            return None
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+        except ValueError:
+            # Outro profiler (ex.: depurador) já está ativo no processo
+            self._lock.release()
+            return None
+        return perfil
+
+    def finalizar(self, perfil, nome, duracao):
+        """Para o perfil e grava <instante>_<nome>_<ms>ms.prof; retorna o caminho"""
+        perfil.disable()
+        self._lock.release()
+        nome = re.sub(r'[^A-Za-z0-9_.-]', '_', nome)
+        arquivo = os.path.join(self.diretorio, f"{time.strftime('%Y%m%d_%H%M%S')}_"
+                                               f"{nome}_{duracao * 1000:.0f}ms.prof")
+        perfil.dump_stats(arquivo)
+        return arquivo
@@ -0,0 +1,115 @@
+"""
+Saúde dos sensores: análise vetorizada (NumPy) das leituras de um período
+
+O sensor ultrassônico falha de formas que a regra de alerta não vê:
+- leituras inválidas: NaN ou fora da faixa útil do HC-SR04 (2 a 400 cm)
+- picos: ecos ruidosos que se afastam da mediana móvel das leituras vizinhas
+- lacunas: intervalos sem leitura maiores que lacuna_s (sensor ou emissor parado)
+- travamento: a mesma distância repetida por mais de travado_s (leitura congelada)
+
+Cada dispositivo é analisado com arrays de (segundos desde o início do
+período, distância). Não há laço por leitura: tudo é feito com operações
+sobre os arrays, então um dia de um leito custa poucos milissegundos mesmo
+com uma leitura por segundo.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+DISTANCIA_MIN_CM = 2.0  # Faixa útil do HC-SR04
+DISTANCIA_MAX_CM = 400.0
+
+# Estados, da melhor para a pior nota
+ESTADOS = ('ok', 'degradado', 'falho', 'sem_dados')
+
+
+def mediana_movel(valores, janela):
+    """Mediana centrada em janelas de `janela` leituras (ímpar); as bordas repetem o extremo"""
+    if len(valores) == 0 or janela <= 1:
+        return valores.copy()
+    meia = janela // 2
+    estendido = np.pad(valores, meia, mode='edge')
+    return np.median(sliding_window_view(estendido, janela), axis=1)
+
+
+def sequencias(iguais):
+    """
+    Índices da primeira e da última leitura de cada sequência de True em
+    `iguais` (iguais[i] compara a leitura i com a i+1)
+    """
+    bordas = np.diff(np.concatenate(([0], iguais.astype(np.int8), [0])))
+    return np.flatnonzero(bordas == 1), np.flatnonzero(bordas == -1)
+
+
+class AnalisadorSaude:
+    """Métricas de saúde e nota (0-100) de um dispositivo em um período"""
+
+    def __init__(self, janela_mediana=5, limiar_pico_cm=30.0, lacuna_s=120,
+                 travado_s=1800, peso_picos=5.0):
+        self.janela_mediana = janela_mediana | 1  # janela centrada: sempre ímpar
+        self.limiar_pico_cm = limiar_pico_cm
+        self.lacuna_s = lacuna_s
+        self.travado_s = travado_s
+        self.peso_picos = peso_picos  # 10% de picos com peso 5 reduz a nota à metade
+
+    def analisar(self, instantes, distancias, duracao):
+        """
+        instantes: segundos desde o início do período, em ordem crescente;
+        distancias: cm (NaN para leitura sem valor); duracao: segundos do período
+        (até agora, para o dia corrente). Retorna um dict com as métricas.
+        """
+        instantes = np.asarray(instantes, dtype=np.float64)
+        distancias = np.asarray(distancias, dtype=np.float64)
+        total = len(distancias)
+        if total == 0:
+            return {
+                'leituras': 0, 'invalidas': 0, 'picos': 0, 'lacunas': 1,
+                'sem_dados_s': float(duracao), 'maior_lacuna_s': float(duracao),
+                'travado_s': 0.0, 'cobertura': 0.0, 'nota': 0.0, 'estado': 'sem_dados'
+            }
+
+        validas = (np.isfinite(distancias) & (distancias >= DISTANCIA_MIN_CM)
+                   & (distancias <= DISTANCIA_MAX_CM))
+        t, d = instantes[validas], distancias[validas]
+
+        # Picos: distância da mediana móvel acima do limiar
+        picos = int(np.count_nonzero(
+            np.abs(d - mediana_movel(d, self.janela_mediana)) > self.limiar_pico_cm))
+
+        # Lacunas: espaços entre leituras (e nas bordas do período) acima de lacuna_s.
+        # Leituras inválidas contam como presença: o sensor respondeu.
+        espacos = np.diff(np.concatenate(([0.0], instantes, [max(duracao, instantes[-1])])))
+        lacunas = espacos[espacos > self.lacuna_s]
+        sem_dados = float(lacunas.sum())
+
+        # Travamento: sequências de leituras válidas com a mesma distância
+        travado = maior_travado = 0.0
+        if len(d) > 1:
+            inicios, fins = sequencias(np.diff(d) == 0)
+            duracoes = t[fins] - t[inicios]
+            travado = float(duracoes[duracoes >= self.travado_s].sum())
+            maior_travado = float(duracoes.max()) if len(duracoes) else 0.0
+
+        cobertura = max(0.0, 1.0 - sem_dados / duracao) if duracao > 0 else 0.0
+        validade = len(d) / total
+        estabilidade = 1.0 - min(1.0, self.peso_picos * picos / len(d)) if len(d) else 0.0
+        nao_travado = 1.0 - min(1.0, travado / duracao) if duracao > 0 else 1.0
+        nota = round(100 * cobertura * validade * estabilidade * nao_travado, 1)
+
+        return {
+            'leituras': total,
+            'invalidas': total - len(d),
+            'picos': picos,
+            'lacunas': len(lacunas),
+            'sem_dados_s': round(sem_dados, 1),
+            'maior_lacuna_s': round(float(lacunas.max()), 1) if len(lacunas) else 0.0,
+            'travado_s': round(maior_travado, 1),
+            'cobertura': round(cobertura, 4),
+            'nota': nota,
+            'estado': 'ok' if nota >= 80 else 'degradado' if nota >= 50 else 'falho'
+        }
+
+
+def serie(texto):
+    """Série agregada pelo banco como texto ('12.5,13,NaN,...') -> array float64"""
+    return np.array(texto.split(','), dtype=np.float64)
@@ -0,0 +1,88 @@
+"""
+Vivacidade dos sensores: detecta dispositivos que pararam de enviar leituras
+
+Cada leitura recebida só atualiza o último instante visto do dispositivo
+(O(1), sem banco). Em vez de um timer por dispositivo, um único heap guarda no
+máximo uma entrada por dispositivo online, com o prazo (último instante +
+timeout) que ele tinha quando entrou. A coleta periódica retira do topo as
+entradas vencidas: se o dispositivo mandou leituras depois, a entrada volta
+ao heap com o prazo novo; senão ele passa a offline. Cada dispositivo entra
+no heap no máximo uma vez por timeout, com custo O(log n).
+
+O estado é do processo: cada instância acompanha os dispositivos cujas
+leituras recebe (o balanceador fixa cada emissor em uma instância). Quando o
+emissor muda de instância, a interrupção aberta por uma é fechada pela outra,
+que consulta o banco (ver registrar_vivacidade e reconciliar_vivacidade no app).
+"""
+
+import heapq
+import threading
+import time
+
+
+class MonitorVivacidade:
+    """Último instante visto por dispositivo e transições online/offline"""
+
+    def __init__(self, timeout=90):
+        self.timeout = timeout
+        self._ultimo = {}  # dispositivo online -> último instante visto (epoch)
+        self._offline = {}  # dispositivo offline -> último instante visto antes de cair
+        self._voltaram = []  # (dispositivo, offline desde, visto em) desde a última coleta
+        self._heap = []  # (prazo, dispositivo), uma entrada por dispositivo online
+        self._lock = threading.Lock()
+
+    def registrar(self, dispositivo, agora=None):
+        """Marca o dispositivo como visto em `agora` (epoch; padrão: time.time())"""
+        agora = time.time() if agora is None else agora
+        with self._lock:
+            ultimo = self._ultimo.get(dispositivo)
+            if ultimo is not None:
+                self._ultimo[dispositivo] = max(ultimo, agora)
+                return
+            self._ultimo[dispositivo] = agora
+            heapq.heappush(self._heap, (agora + self.timeout, dispositivo))
+            desde = self._offline.pop(dispositivo, None)
+            if desde is not None:
+                self._voltaram.append((dispositivo, desde, agora))
+
+    def marcar_offline(self, dispositivo, desde):
+        """Dispositivo já offline antes deste processo (interrupção aberta no banco)"""
+        with self._lock:
+            if dispositivo not in self._ultimo:
+                self._offline[dispositivo] = desde
+
+    def desconhecidos(self, dispositivos):
+        """Dispositivos que este processo ainda não acompanha (nem online nem offline)"""
+        with self._lock:
+            return [d for d in dispositivos if d not in self._ultimo and d not in self._offline]
+
+    def online(self):
+        """Cópia de {dispositivo online: último instante visto}"""
+        with self._lock:
+            return dict(self._ultimo)
+
+    def coletar(self, agora=None):
+        """
+        Transições desde a última coleta: (caidos, voltaram), com caidos =
+        [(dispositivo, último instante visto)] e voltaram = [(dispositivo,
+        offline desde, visto em)]
+        """
+        agora = time.time() if agora is None else agora
+        caidos = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= agora:
+                _, dispositivo = heapq.heappop(self._heap)
+                ultimo = self._ultimo[dispositivo]
+                if ultimo + self.timeout > agora:
+                    heapq.heappush(self._heap, (ultimo + self.timeout, dispositivo))
+                    continue
+                del self._ultimo[dispositivo]
+                self._offline[dispositivo] = ultimo
+                caidos.append((dispositivo, ultimo))
+            voltaram, self._voltaram = self._voltaram, []
+        return caidos, voltaram
+
+    def contagem(self):
+        """(online, offline) neste processo"""
+        with self._lock:
+            return len(self._ultimo), len(self._offline)
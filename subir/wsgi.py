@@ -0,0 +1,23 @@
+"""
+Ponto de entrada de produção: gunicorn com worker gevent
+
+    gunicorn -k gevent -w 1 --worker-connections 2000 -b 0.0.0.0:5000 wsgi:app
+
+O monkey patching precisa acontecer antes de importar o app (threads, filas e
+sockets viram greenlets) e o psycopg2 passa a ceder o loop durante as consultas.
+Para mais de um processo, suba várias instâncias atrás do nginx (ver nginx.conf)
+com SOCKETIO_MESSAGE_QUEUE apontando para o Redis.
+"""
+
+from gevent import monkey
+
+monkey.patch_all()
+
+import os
+
+from psycogreen.gevent import patch_psycopg
+
+patch_psycopg()
+os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'gevent')
+
+from app import app, socketio  # noqa: E402,F401